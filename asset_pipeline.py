@@ -0,0 +1,583 @@
+"""
+DailyWell Asset Pipeline - Shared Helpers
+=========================================
+
+Standard-library helpers shared by generate_assets.py,
+generate_assets_comfyui.py and the test_local_* scripts. Nothing here
+imports torch, so the ComfyUI client and the inspection scripts stay light.
+"""
+
+import hashlib
+import io
+import json
+import math
+import os
+import struct
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+# ================= SAFETENSORS HEADER =================
+
+def read_safetensors_header(path):
+    """
+    Parse the JSON header of a safetensors file without reading tensor data.
+
+    The file starts with a little-endian u64 header length followed by the
+    JSON header, so only those bytes are read whatever the file size.
+    Returns (tensors, metadata) where tensors maps key -> {dtype, shape,
+    data_offsets}.
+    """
+    with open(path, "rb") as f:
+        (length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length))
+    metadata = header.pop("__metadata__", {})
+    return header, metadata
+
+
+def summarize_safetensors(path, strip_prefix="", block_prefix="transformer_blocks."):
+    """
+    Summary of a safetensors file from its header alone.
+
+    Parameter totals are grouped by the first key component after
+    strip_prefix. block_count is the number of block indices under
+    block_prefix, which is what BlockWeightPlan.num_blocks reports.
+    """
+    start = time.perf_counter()
+    tensors, metadata = read_safetensors_header(path)
+
+    prefixes = {}
+    dtypes = {}
+    block_indices = set()
+    for key, info in tensors.items():
+        name = key[len(strip_prefix):] if key.startswith(strip_prefix) else key
+        numel = 1
+        for dim in info["shape"]:
+            numel *= dim
+        nbytes = info["data_offsets"][1] - info["data_offsets"][0]
+
+        prefix = name.split(".", 1)[0]
+        params, size = prefixes.get(prefix, (0, 0))
+        prefixes[prefix] = (params + numel, size + nbytes)
+
+        count, size = dtypes.get(info["dtype"], (0, 0))
+        dtypes[info["dtype"]] = (count + 1, size + nbytes)
+
+        if key.startswith(strip_prefix) and name.startswith(block_prefix):
+            block_indices.add(int(name[len(block_prefix):].split(".", 1)[0]))
+
+    return {
+        "path": str(path),
+        "file_bytes": Path(path).stat().st_size,
+        "tensors": tensors,
+        "metadata": metadata,
+        "prefixes": prefixes,
+        "dtypes": dtypes,
+        "block_count": max(block_indices) + 1 if block_indices else 0,
+        "elapsed_ms": (time.perf_counter() - start) * 1000,
+    }
+
+
+def print_safetensors_summary(summary, show_keys=20):
+    """Print a summary from summarize_safetensors()."""
+    tensors = summary["tensors"]
+    print(f"\nFile: {summary['path']} ({summary['file_bytes'] / (1024**3):.2f}GB)")
+    print(f"Header parsed in {summary['elapsed_ms']:.1f}ms")
+    print(f"Tensors: {len(tensors)}")
+    print(f"Transformer blocks: {summary['block_count']}")
+
+    print("\nDtypes:")
+    for dtype, (count, nbytes) in sorted(summary["dtypes"].items(), key=lambda kv: -kv[1][1]):
+        print(f"  {dtype:8s} {count:6d} tensors  {nbytes / (1024**2):10.1f} MB")
+
+    print("\nParameters by prefix:")
+    for prefix, (params, nbytes) in sorted(summary["prefixes"].items(), key=lambda kv: -kv[1][0]):
+        print(f"  {prefix:40s} {params:15,d}  {nbytes / (1024**2):10.1f} MB")
+
+    if show_keys:
+        print(f"\nFirst {show_keys} keys:")
+        for key, info in sorted(tensors.items(), key=lambda kv: kv[1]["data_offsets"][0])[:show_keys]:
+            begin, end = info["data_offsets"]
+            print(f"  {key}: {info['shape']} ({info['dtype']}) bytes {begin}-{end}")
+
+
+# ================= SEEDS =================
+
+def stable_seed(key, global_seed=0):
+    """
+    32-bit seed derived from blake2b of global_seed and key.
+
+    Unlike hash(), which is salted per process for str, this is the same in
+    every run and on every machine, so reruns are reproducible and cached
+    outputs stay valid. Changing global_seed reseeds every asset at once.
+    """
+    digest = hashlib.blake2b(f"{global_seed}:{key}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % 2**32
+
+
+# ================= OUTPUT WRITER =================
+
+def atomic_write(path, data):
+    """
+    Write bytes to path through a temp file in the same directory and a rename,
+    so readers never see a partially written file.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def encode_png(image, compress_level=6, optimize=False):
+    """PNG bytes for a PIL image; bytes are passed through as already encoded."""
+    if isinstance(image, (bytes, bytearray)):
+        return bytes(image)
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG", compress_level=compress_level, optimize=optimize)
+    return buffer.getvalue()
+
+
+# ================= ENCODERS =================
+
+# name -> (file suffix, lossy, encode(image, options) -> bytes)
+IMAGE_ENCODERS = {}
+
+
+def register_encoder(name, suffix, lossy):
+    """Decorator adding an encoder to IMAGE_ENCODERS under name."""
+    def register(fn):
+        IMAGE_ENCODERS[name] = (suffix, lossy, fn)
+        return fn
+    return register
+
+
+@register_encoder("png", ".png", lossy=False)
+def _encode_png(image, options):
+    return encode_png(image, options.get("compress_level", 6), options.get("optimize", False))
+
+
+@register_encoder("png8", ".png", lossy=True)
+def _encode_png8(image, options):
+    """256-colour palette PNG; flat icons often survive this above the quality floor."""
+    from PIL import Image
+
+    method = Image.Quantize.FASTOCTREE if image.mode == "RGBA" else Image.Quantize.MEDIANCUT
+    return encode_png(image.quantize(256, method=method), options.get("compress_level", 6))
+
+
+@register_encoder("webp_lossless", ".webp", lossy=False)
+def _encode_webp_lossless(image, options):
+    buffer = io.BytesIO()
+    image.save(buffer, "WEBP", lossless=True, quality=100, method=options.get("webp_method", 4), exact=True)
+    return buffer.getvalue()
+
+
+@register_encoder("webp", ".webp", lossy=True)
+def _encode_webp(image, options):
+    buffer = io.BytesIO()
+    image.save(buffer, "WEBP", quality=options.get("webp_quality", 90), method=options.get("webp_method", 4))
+    return buffer.getvalue()
+
+
+def image_psnr(reference, data):
+    """
+    PSNR in dB of encoded bytes against the reference PIL image, on
+    premultiplied RGBA so colour under fully transparent pixels is ignored.
+    """
+    from PIL import Image, ImageChops, ImageStat
+
+    decoded = Image.open(io.BytesIO(data)).convert("RGBA").convert("RGBa")
+    diff = ImageChops.difference(reference.convert("RGBA").convert("RGBa"), decoded)
+    mse = sum(ImageStat.Stat(diff).sum2) / (reference.width * reference.height * 4)
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+class EncodedImage:
+    """Chosen encoding from encode_best(), with every candidate's size and PSNR."""
+
+    def __init__(self, format, suffix, data, psnr, candidates):
+        self.format = format
+        self.suffix = suffix
+        self.data = data
+        self.psnr = psnr
+        self.candidates = candidates
+
+
+def encode_best(image, formats=("png",), min_psnr=40.0, **options):
+    """
+    Smallest encoding of image among formats that keeps PSNR >= min_psnr.
+
+    Lossless encoders always qualify; lossy ones are decoded and measured.
+    Already encoded bytes pass through when only "png" is asked for and
+    are decoded otherwise, as is an encoded file given by path.
+    candidates maps format -> (bytes, psnr or None when it fell below the
+    floor or failed).
+    """
+    if isinstance(image, (bytes, bytearray)):
+        if list(formats) == ["png"]:
+            return EncodedImage("png", ".png", bytes(image), math.inf, {"png": (len(image), math.inf)})
+        image = io.BytesIO(image)
+    if isinstance(image, (io.BytesIO, str, os.PathLike)):
+        from PIL import Image
+
+        image = Image.open(image)
+        image.load()
+
+    best = None
+    candidates = {}
+    for name in formats:
+        suffix, lossy, encode = IMAGE_ENCODERS[name]
+        try:
+            data = encode(image, options)
+        except (OSError, ValueError) as e:
+            print(f"  [WARN] {name} encoder failed: {e}")
+            candidates[name] = (0, None)
+            continue
+        psnr = image_psnr(image, data) if lossy else math.inf
+        candidates[name] = (len(data), psnr if psnr >= min_psnr else None)
+        if psnr >= min_psnr and (best is None or len(data) < len(best.data)):
+            best = EncodedImage(name, suffix, data, psnr, candidates)
+    if best is None:
+        raise ValueError(f"no encoder in {list(formats)} reached {min_psnr} dB")
+    return best
+
+
+def other_layout_dirs(directory):
+    """
+    Android resource folders where a same-named drawable would shadow, or be
+    shadowed by, one in directory: the drawable-*dpi buckets next to a plain
+    drawable/ folder, or the plain drawable/ next to a bucket. Android picks
+    a density-qualified resource over drawable/, so only one layout may hold
+    a given name.
+    """
+    directory = Path(directory)
+    base, _, qualifier = directory.name.partition("-")
+    if base != "drawable":
+        return []
+    if qualifier:
+        return [directory.parent / base] if qualifier.endswith("dpi") else []
+    return sorted(directory.parent.glob("drawable-*dpi"))
+
+
+def remove_stale_siblings(path):
+    """
+    Delete files next to path with the same stem and another encoder's
+    suffix, and same-stem files in the other drawable layout (see
+    other_layout_dirs).
+    """
+    path = Path(path)
+    suffixes = {suffix for suffix, _, _ in IMAGE_ENCODERS.values()}
+    stale = [path.with_suffix(suffix) for suffix in suffixes - {path.suffix}]
+    stale += [directory / f"{path.stem}{suffix}" for directory in other_layout_dirs(path.parent)
+              for suffix in suffixes | {path.suffix}]
+    for stale_path in stale:
+        try:
+            stale_path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def encode_and_write(path, image, **options):
+    """
+    Encode with encode_best() and write atomically under path's stem with
+    the chosen suffix, removing same-named outputs in other formats (Android
+    rejects duplicate resource names) or in the other drawable layout (see
+    remove_stale_siblings). Returns (encode_seconds,
+    write_seconds, bytes_written, output_path, EncodedImage).
+
+    image may also be the Path of an already encoded PNG staged in the
+    output directory (a streamed download). It is renamed into place when
+    only "png" is asked for, and decoded from disk and deleted otherwise.
+    """
+    if isinstance(image, Path):
+        try:
+            if list(options.get("formats", ("png",))) == ["png"]:
+                start = time.perf_counter()
+                output = Path(path).with_suffix(".png")
+                os.replace(image, output)
+                remove_stale_siblings(output)
+                nbytes = output.stat().st_size
+                encoded = EncodedImage("png", ".png", None, math.inf, {"png": (nbytes, math.inf)})
+                return 0.0, time.perf_counter() - start, nbytes, output, encoded
+            return encode_and_write(path, str(image), **options)
+        finally:
+            image.unlink(missing_ok=True)
+
+    start = time.perf_counter()
+    encoded = encode_best(image, **options)
+    done = time.perf_counter()
+    output = Path(path).with_suffix(encoded.suffix)
+    atomic_write(output, encoded.data)
+    remove_stale_siblings(output)
+    nbytes = len(encoded.data)
+    encoded.data = None  # keep results small when they come back from a process pool
+    return done - start, time.perf_counter() - done, nbytes, output, encoded
+
+
+class WriteResult:
+    """Outcome of one ImageWriter job; output is the file actually written."""
+
+    def __init__(self, path, encode_s=0.0, write_s=0.0, nbytes=0, output=None, encoded=None, error=None):
+        self.path = Path(path)
+        self.encode_s = encode_s
+        self.write_s = write_s
+        self.nbytes = nbytes
+        self.output = Path(output) if output is not None else self.path
+        self.encoded = encoded
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class ImageWriter:
+    """
+    Background encode and write-out stage.
+
+    submit() hands over a finished PIL image (or already encoded PNG bytes,
+    or the Path of a staged PNG, see encode_and_write) and returns at once,
+    so generation moves on to the next asset while a pool encodes and
+    writes atomically. Each image is written in the
+    smallest of formats that stays above min_psnr (see encode_best), so
+    the suffix of the file written may differ from the path submitted.
+    Threads work well because zlib and libwebp release the GIL;
+    processes=True uses a process pool instead (images are pickled
+    across). At most max_pending jobs are in flight, after which submit()
+    waits for the oldest. flush() waits for everything and returns one
+    WriteResult per file.
+    """
+
+    def __init__(self, workers=2, compress_level=6, optimize=False, processes=False, max_pending=None,
+                 formats=("png",), min_psnr=40.0, webp_quality=90):
+        self.options = {"compress_level": compress_level, "optimize": optimize, "formats": tuple(formats),
+                        "min_psnr": min_psnr, "webp_quality": webp_quality}
+        pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self._executor = pool(max_workers=workers)
+        self._max_pending = max_pending or 2 * workers
+        self._pending = deque()
+        self._results = []
+        self.submit_wait_s = 0.0
+
+    def submit(self, path, image):
+        while len(self._pending) >= self._max_pending:
+            start = time.perf_counter()
+            self._collect(*self._pending.popleft())
+            self.submit_wait_s += time.perf_counter() - start
+        future = self._executor.submit(encode_and_write, str(path), image, **self.options)
+        self._pending.append((path, future))
+
+    def _collect(self, path, future):
+        try:
+            self._results.append(WriteResult(path, *future.result()))
+        except Exception as e:
+            self._results.append(WriteResult(path, error=e))
+
+    def flush(self):
+        """Wait for every submitted job; returns and clears the results so far."""
+        while self._pending:
+            self._collect(*self._pending.popleft())
+        results, self._results = self._results, []
+        return results
+
+    def close(self):
+        results = self.flush()
+        self._executor.shutdown()
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._executor.shutdown()
+        return False
+
+
+def print_write_report(results, submit_wait_s=0.0):
+    """Print per-file encode/write timings from ImageWriter.flush()."""
+    print(f"\nOutput writer: {len(results)} files")
+    for r in results:
+        if r.ok:
+            print(f"  {r.output.name:32s} encode {r.encode_s * 1000:7.1f}ms  write {r.write_s * 1000:6.1f}ms  "
+                  f"{r.nbytes / 1024:8.1f} KB")
+        else:
+            print(f"  {r.path.name:32s} [ERROR] {r.error}")
+    total = sum(r.encode_s + r.write_s for r in results)
+    print(f"  Total {total:.2f}s off the generation thread, {submit_wait_s:.2f}s waited for a free slot")
+
+
+def size_report(rows):
+    """
+    Per-file format choice and sizes, from (output_path, EncodedImage) rows.
+
+    Returns a JSON-ready dict; print_size_report() prints it.
+    """
+    files = []
+    for output, encoded in rows:
+        png = encoded.candidates.get("png", (None, None))[0]
+        chosen = encoded.candidates[encoded.format][0]
+        files.append({
+            "file": str(output),
+            "format": encoded.format,
+            "bytes": chosen,
+            "png_bytes": png,
+            "psnr": None if math.isinf(encoded.psnr) else round(encoded.psnr, 2),
+            "candidates": {name: {"bytes": size, "psnr": None if psnr is None or math.isinf(psnr) else round(psnr, 2),
+                                  "accepted": psnr is not None}
+                           for name, (size, psnr) in encoded.candidates.items()},
+        })
+    total = sum(f["bytes"] for f in files)
+    total_png = sum(f["png_bytes"] or f["bytes"] for f in files)
+    return {"files": files, "total_bytes": total, "total_png_bytes": total_png}
+
+
+def print_size_report(report):
+    print(f"\n{'File':44s} {'Format':14s} {'KB':>8s} {'PNG KB':>8s} {'Saved':>6s} {'PSNR':>7s}")
+    for f in report["files"]:
+        png = f["png_bytes"]
+        saved = f"{100 * (1 - f['bytes'] / png):5.0f}%" if png else "     -"
+        psnr = f"{f['psnr']:7.1f}" if f["psnr"] is not None else "    inf"
+        name = "/".join(Path(f["file"]).parts[-2:])
+        print(f"{name:44s} {f['format']:14s} {f['bytes'] / 1024:8.1f} "
+              f"{(png or 0) / 1024:8.1f} {saved} {psnr}")
+    total, total_png = report["total_bytes"], report["total_png_bytes"]
+    print(f"Total {total / 1024:.1f} KB vs {total_png / 1024:.1f} KB as PNG "
+          f"({100 * (1 - total / total_png) if total_png else 0:.0f}% smaller)")
+
+
+def write_size_report(rows, path):
+    """Print the size report for rows and save it as JSON at path."""
+    report = size_report(rows)
+    print_size_report(report)
+    atomic_write(path, json.dumps(report, indent=1).encode("utf-8"))
+    print(f"Size report: {path}")
+    return report
+
+
+# ================= GENERATION CACHE =================
+
+def cache_key(**fields):
+    """Content address for a generation: sha256 of its inputs as canonical JSON."""
+    blob = json.dumps(fields, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def safetensors_header_digest(path):
+    """
+    sha256 of a safetensors header (length prefix plus JSON).
+
+    The header lists every tensor's name, dtype, shape and offsets, so it
+    identifies the model without hashing gigabytes of weights.
+    """
+    with open(path, "rb") as f:
+        prefix = f.read(8)
+        (length,) = struct.unpack("<Q", prefix)
+        return hashlib.sha256(prefix + f.read(length)).hexdigest()
+
+
+class GenerationCache:
+    """
+    Persistent content-addressed cache of generated images.
+
+    Objects are stored as cache_dir/objects/<key[:2]>/<key><suffix>, where
+    key is a cache_key() over everything that determines the image and
+    suffix is that of the format the writer chose. The manifest
+    (cache_dir/manifest.json) records each object's size, suffix and last
+    use, and which key each output file was last written from. fetch()
+    counts an asset as done when its output already holds that key, and
+    otherwise restores the output from the stored object. Once the objects
+    exceed max_bytes, the least recently used ones are evicted.
+    """
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024**3):
+        self.cache_dir = Path(cache_dir)
+        self.objects_dir = self.cache_dir / "objects"
+        self.manifest_path = self.cache_dir / "manifest.json"
+        self.max_bytes = max_bytes
+        self.hits = self.restored = self.misses = self.evicted = 0
+        self.entries = {}
+        self.outputs = {}
+        if self.manifest_path.exists():
+            try:
+                manifest = json.loads(self.manifest_path.read_text())
+                self.entries = manifest.get("entries", {})
+                self.outputs = manifest.get("outputs", {})
+            except (OSError, ValueError) as e:
+                print(f"  [WARN] Ignoring unreadable cache manifest: {e}")
+
+    def _object_path(self, key):
+        suffix = self.entries.get(key, {}).get("suffix", ".png")
+        return self.objects_dir / key[:2] / f"{key}{suffix}"
+
+    def fetch(self, key, output_path):
+        """
+        True if output_path, with the suffix of the stored format, now holds
+        the image for key (already there or restored).
+        """
+        entry = self.entries.get(key)
+        obj = self._object_path(key)
+        if entry is None or not obj.exists():
+            self.entries.pop(key, None)
+            self.misses += 1
+            return False
+
+        entry["last_used"] = time.time()
+        output_path = Path(output_path).with_suffix(entry.get("suffix", ".png"))
+        current = output_path.exists() and self.outputs.get(str(output_path)) == key \
+            and output_path.stat().st_size == entry["bytes"]
+        if current:
+            # Also clears copies a placeholder run left in the other drawable layout
+            remove_stale_siblings(output_path)
+            self.hits += 1
+        else:
+            atomic_write(output_path, obj.read_bytes())
+            remove_stale_siblings(output_path)
+            self.outputs[str(output_path)] = key
+            self.restored += 1
+        return True
+
+    def store(self, key, output_path, name=None):
+        """Record output_path (already written) as the image for key."""
+        output_path = Path(output_path)
+        data = output_path.read_bytes()
+        self.entries[key] = {"name": name or output_path.name, "bytes": len(data), "suffix": output_path.suffix,
+                             "last_used": time.time()}
+        atomic_write(self._object_path(key), data)
+        self.outputs[str(output_path)] = key
+        self._evict()
+
+    def total_bytes(self):
+        return sum(entry["bytes"] for entry in self.entries.values())
+
+    def _evict(self):
+        total = self.total_bytes()
+        for key in sorted(self.entries, key=lambda k: self.entries[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            obj = self._object_path(key)
+            total -= self.entries.pop(key)["bytes"]
+            try:
+                obj.unlink()
+            except OSError:
+                pass
+            self.outputs = {path: k for path, k in self.outputs.items() if k != key}
+            self.evicted += 1
+
+    def save(self):
+        manifest = {"version": 1, "entries": self.entries, "outputs": self.outputs}
+        atomic_write(self.manifest_path, json.dumps(manifest, indent=1, sort_keys=True).encode("utf-8"))
+
+    def summary(self):
+        return (f"{self.hits} up to date, {self.restored} restored, {self.misses} to generate, "
+                f"{self.evicted} evicted, {len(self.entries)} objects / {self.total_bytes() / (1024**2):.1f} MB")
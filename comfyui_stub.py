@@ -0,0 +1,433 @@
+"""
+DailyWell Asset Pipeline - ComfyUI Stub Server
+==============================================
+
+A small stand-in for ComfyUI's HTTP API so generate_assets_comfyui.py can
+be exercised without a GPU or model files. It serves the endpoints the
+client uses:
+
+- POST /prompt         queue a workflow, returns {"prompt_id", "number"}
+- POST /queue          {"delete": [prompt ids]} removes prompts that have not started
+- POST /interrupt      stops the running prompt ({"prompt_id"} limits it to that one)
+- GET  /history/<id>   {} until the prompt has run, then its outputs
+- GET  /view           an image written by a SaveImage node
+- GET  /system_stats   liveness
+- GET  /ws?clientId=   WebSocket stream of execution events for that client
+
+Prompts run one at a time on a worker thread, taking step_time seconds
+per KSampler step. Every SaveImage node writes one solid-colour PNG per
+latent in its batch, at the size of the EmptySD3LatentImage it traces
+back to. While a prompt runs, the client that queued it receives
+execution_start, execution_cached, executing, progress and executed
+events followed by executing with node None, as ComfyUI sends them.
+Like ComfyUI, the stub keeps the last output of every node id and
+reuses it while the node's inputs, and everything upstream of them, are
+unchanged: those nodes are listed in execution_cached (event and history
+status messages) and are not run again; a cached KSampler takes no time.
+websocket=False answers /ws with 404, like a proxy that strips upgrades.
+HTTP/1.1 connections are kept alive; fail_next and drop_next make the
+next requests answer 503 or hang up without a response, and
+truncate_next makes the next /view downloads hang up halfway through
+the body, to exercise client retries. hang_next makes the next prompts
+stall at their first node until interrupted, which then ends them with
+execution_interrupted like ComfyUI. Standard library only.
+
+Usage:
+    python comfyui_stub.py [port]
+"""
+
+import base64
+import hashlib
+import itertools
+import json
+import struct
+import sys
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def solid_png(width, height, rgb):
+    """Encode a width x height RGB PNG filled with one colour."""
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    row = b"\x00" + bytes(rgb) * width
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(row * height, 6)) + chunk(b"IEND", b""))
+
+
+def _latent_source(workflow, node_id):
+    """(width, height, batch) of the empty latent feeding node_id, following links upstream."""
+    seen = set()
+    stack = [node_id]
+    while stack:
+        current = stack.pop()
+        if current in seen or current not in workflow:
+            continue
+        seen.add(current)
+        node = workflow[current]
+        inputs = node.get("inputs", {})
+        if node.get("class_type") in ("EmptySD3LatentImage", "EmptyLatentImage"):
+            return inputs["width"], inputs["height"], inputs.get("batch_size", 1)
+        if node.get("class_type") == "LatentFromBatch":
+            width, height, _ = _latent_source(workflow, inputs["samples"][0])
+            return width, height, inputs.get("length", 1)
+        stack.extend(value[0] for value in inputs.values() if isinstance(value, list) and value)
+    return 64, 64, 1
+
+
+def _signature(workflow, node_id, _memo=None):
+    """Class, inputs and upstream signatures of a node, as a string that changes when any of them do."""
+    memo = {} if _memo is None else _memo
+    if node_id not in memo:
+        node = workflow[node_id]
+        inputs = {name: _signature(workflow, value[0], memo) if isinstance(value, list) and value[0] in workflow
+                  else value for name, value in node.get("inputs", {}).items()}
+        memo[node_id] = json.dumps([node.get("class_type"), inputs], sort_keys=True)
+    return memo[node_id]
+
+
+class StubComfyUI:
+    """
+    In-process ComfyUI stand-in on a background thread.
+
+    Counters for tests: requests (per endpoint), connections (accepted),
+    max_pending (most prompts queued or running at once), executed,
+    interrupted, deleted and events_sent.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, step_time=0.002, websocket=True):
+        self.step_time = step_time
+        self.websocket = websocket
+        self.events_sent = 0
+        self._sockets = {}   # client_id -> [(wfile, lock)]
+        self.requests = Counter()
+        self.connections = 0
+        self.fail_next = 0
+        self.drop_next = 0
+        self.truncate_next = 0
+        self.hang_next = 0
+        self.interrupted = 0
+        self.deleted = 0
+        self._interrupt = threading.Event()
+        self.max_pending = 0
+        self.executed = 0
+        self.history = {}
+        self.images = {}
+        self._signatures = {}   # node id -> inputs signature of its last execution
+        self._queue = deque()
+        self._running = None
+        self._number = itertools.count()
+        self._files = itertools.count(1)
+        self._cond = threading.Condition()
+        self._closed = False
+        handler = type("Handler", (_Handler,), {"stub": self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self._threads = [threading.Thread(target=self.server.serve_forever, daemon=True),
+                         threading.Thread(target=self._worker, daemon=True)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._interrupt.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def submit(self, workflow, client_id=None):
+        prompt_id = str(uuid.uuid4())
+        with self._cond:
+            number = next(self._number)
+            self._queue.append((prompt_id, workflow, client_id))
+            self.max_pending = max(self.max_pending, len(self._queue) + (self._running is not None))
+            self._cond.notify_all()
+        return prompt_id, number
+
+    def delete(self, prompt_ids):
+        """Remove prompts that have not started yet from the queue."""
+        with self._cond:
+            kept = [item for item in self._queue if item[0] not in prompt_ids]
+            self.deleted += len(self._queue) - len(kept)
+            self._queue = deque(kept)
+
+    def interrupt(self, prompt_id=None):
+        """Interrupt the running prompt (only if it is prompt_id, when given)."""
+        with self._cond:
+            if self._running is not None and prompt_id in (None, self._running[0]):
+                self._interrupt.set()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                prompt_id, workflow, client_id = self._running = self._queue.popleft()
+                hang = self.hang_next > 0
+                self.hang_next -= hang
+                self._interrupt.clear()
+            entry = self._execute(prompt_id, workflow, client_id, hang)
+            with self._cond:
+                self.history[prompt_id] = entry
+                self.executed += 1
+                self._running = None
+
+    def _execute(self, prompt_id, workflow, client_id=None, hang=False):
+        def send(kind, **data):
+            self.send_event(client_id, kind, prompt_id=prompt_id, **data)
+
+        def interrupted(node_id):
+            self.interrupted += 1
+            data = {"node_id": node_id, "node_type": workflow[node_id].get("class_type"), "executed": list(outputs)}
+            send("execution_interrupted", **data)
+            messages.append(["execution_interrupted", {"prompt_id": prompt_id, **data,
+                                                       "timestamp": int(time.time() * 1000)}])
+            return {"prompt": [0, prompt_id, workflow, {}, list(outputs)], "outputs": outputs,
+                    "status": {"status_str": "error", "completed": False, "messages": messages}}
+
+        memo = {}
+        signatures = {node_id: _signature(workflow, node_id, memo) for node_id in workflow}
+        cached = [node_id for node_id, node in workflow.items()
+                  if node.get("class_type") != "SaveImage" and self._signatures.get(node_id) == signatures[node_id]]
+        self._signatures.update(signatures)
+        messages = [["execution_start", {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)}],
+                    ["execution_cached", {"nodes": cached, "prompt_id": prompt_id,
+                                          "timestamp": int(time.time() * 1000)}]]
+        for kind, data in messages:
+            send(kind, **{k: v for k, v in data.items() if k != "prompt_id"})
+        outputs = {}
+        for node_id, node in workflow.items():
+            if node_id in cached:
+                continue
+            send("executing", node=node_id, display_node=node_id)
+            if hang:
+                self._interrupt.wait()
+            if self._interrupt.is_set():
+                return interrupted(node_id)
+            steps = node["inputs"].get("steps", 0) if node.get("class_type") == "KSampler" else 0
+            for step in range(1, steps + 1):
+                time.sleep(self.step_time)
+                if self._interrupt.is_set():
+                    return interrupted(node_id)
+                send("progress", value=step, max=steps, node=node_id)
+            if node.get("class_type") != "SaveImage":
+                continue
+            width, height, batch = _latent_source(workflow, node_id)
+            prefix = node["inputs"].get("filename_prefix", "ComfyUI")
+            images = []
+            for index in range(batch):
+                filename = f"{prefix}_{next(self._files):05d}_.png"
+                rgb = hashlib.blake2b(f"{prompt_id}/{node_id}/{index}".encode(), digest_size=3).digest()
+                self.images[filename] = solid_png(width, height, rgb)
+                images.append({"filename": filename, "subfolder": "", "type": "output"})
+            outputs[node_id] = {"images": images}
+            send("executed", node=node_id, display_node=node_id, output=outputs[node_id])
+        send("executing", node=None)
+        messages.append(["execution_success", {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)}])
+        return {"prompt": [0, prompt_id, workflow, {}, list(outputs)], "outputs": outputs,
+                "status": {"status_str": "success", "completed": True, "messages": messages}}
+
+    def send_event(self, client_id, kind, **data):
+        """Send a JSON event to every socket of client_id (no-op without one)."""
+        message = json.dumps({"type": kind, "data": data}).encode("utf-8")
+        for wfile, lock in list(self._sockets.get(client_id, [])):
+            try:
+                with lock:
+                    wfile.write(_ws_frame(0x1, message))
+                    wfile.flush()
+                self.events_sent += 1
+            except OSError:
+                pass
+
+    def _attach(self, client_id, wfile, lock):
+        with self._cond:
+            self._sockets.setdefault(client_id, []).append((wfile, lock))
+
+    def _detach(self, client_id, wfile, lock):
+        with self._cond:
+            sockets = self._sockets.get(client_id, [])
+            if (wfile, lock) in sockets:
+                sockets.remove((wfile, lock))
+
+
+def _ws_frame(opcode, payload):
+    """Unmasked server frame."""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack(">BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def _ws_read_frame(rfile):
+    """(opcode, payload) of one masked client frame; raises EOFError when the peer goes away."""
+    head = rfile.read(2)
+    if len(head) < 2:
+        raise EOFError
+    length = head[1] & 0x7F
+    if length == 126:
+        (length,) = struct.unpack(">H", rfile.read(2))
+    elif length == 127:
+        (length,) = struct.unpack(">Q", rfile.read(8))
+    mask = rfile.read(4) if head[1] & 0x80 else b"\0\0\0\0"
+    payload = rfile.read(length)
+    if len(payload) < length:
+        raise EOFError
+    return head[0] & 0x0F, bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    stub = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.stub.connections += 1
+
+    def _injected_failure(self):
+        """Answer with a 503 or hang up if the stub was told to; True when it did."""
+        with self.stub._cond:
+            drop, self.stub.drop_next = self.stub.drop_next > 0, max(0, self.stub.drop_next - 1)
+            fail = not drop and self.stub.fail_next > 0
+            self.stub.fail_next -= fail
+        if drop:
+            self.close_connection = True
+            return True
+        if fail:
+            self._send(503, {"error": "busy"})
+        return fail
+
+    def _send(self, status, body, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        self.stub.requests[url.path] += 1
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self._injected_failure():
+            return
+        if url.path not in ("/prompt", "/queue", "/interrupt"):
+            return self._send(404, {"error": "not found"})
+        try:
+            request = json.loads(body) if body else {}
+            if url.path == "/prompt":
+                workflow = request["prompt"]
+        except (ValueError, KeyError) as e:
+            return self._send(400, {"error": str(e)})
+        if url.path == "/queue":
+            self.stub.delete(set(request.get("delete", [])))
+            return self._send(200, {})
+        if url.path == "/interrupt":
+            self.stub.interrupt(request.get("prompt_id"))
+            return self._send(200, {})
+        prompt_id, number = self.stub.submit(workflow, request.get("client_id"))
+        self._send(200, {"prompt_id": prompt_id, "number": number, "node_errors": {}})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if self._injected_failure():
+            return
+        if url.path.startswith("/history/"):
+            self.stub.requests["/history"] += 1
+            prompt_id = url.path[len("/history/"):]
+            entry = self.stub.history.get(prompt_id)
+            return self._send(200, {prompt_id: entry} if entry else {})
+        self.stub.requests[url.path] += 1
+        if url.path == "/ws" and self.stub.websocket:
+            return self._websocket(parse_qs(url.query).get("clientId", [""])[0])
+        if url.path == "/view":
+            query = parse_qs(url.query)
+            data = self.stub.images.get(query.get("filename", [""])[0])
+            if data is None:
+                return self._send(404, {"error": "no such image"})
+            with self.stub._cond:
+                truncate = self.stub.truncate_next > 0
+                self.stub.truncate_next -= truncate
+            if truncate:
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data[:len(data) // 2])
+                self.close_connection = True
+                return
+            return self._send(200, data, "image/png")
+        if url.path == "/system_stats":
+            return self._send(200, {"system": {"os": "stub"}, "devices": []})
+        self._send(404, {"error": "not found"})
+
+    def _websocket(self, client_id):
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+        lock = threading.Lock()
+        self.stub._attach(client_id, self.wfile, lock)
+        self.stub.send_event(client_id, "status", status={"exec_info": {"queue_remaining": len(self.stub._queue)}},
+                             sid=client_id)
+        try:
+            while True:
+                opcode, payload = _ws_read_frame(self.rfile)
+                if opcode == 0x8:
+                    with lock:
+                        self.wfile.write(_ws_frame(0x8, payload[:2]))
+                    break
+                if opcode == 0x9:
+                    with lock:
+                        self.wfile.write(_ws_frame(0xA, payload))
+        except (EOFError, OSError):
+            pass
+        finally:
+            self.stub._detach(client_id, self.wfile, lock)
+            self.close_connection = True
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8001
+    with StubComfyUI(port=port, step_time=0.05) as stub:
+        print(f"ComfyUI stub listening on {stub.url} (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
@@ -21,8 +21,13 @@ Style: Glassmorphic/Futuristic 2026
 
 import sys
 import os
+import functools
 import gc
 import math
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional, Tuple, List
 import numpy as np
@@ -34,9 +39,14 @@ sys.path.insert(0, str(COMFYUI_PATH))
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from safetensors import safe_open
 from safetensors.torch import load_file
 from PIL import Image
 
+from asset_pipeline import (summarize_safetensors, print_safetensors_summary, ImageWriter, print_write_report,
+                            GenerationCache, cache_key, safetensors_header_digest, stable_seed, encode_best,
+                            encode_and_write, write_size_report, IMAGE_ENCODERS)
+
 # ================= PATHS =================
 MODEL_DIR = Path(r"D:\Models\qwen_image_fp8")
 OUTPUT_DIR = Path(r"C:\Users\PC\Desktop\moneygrinder\mobile\PART_2_HEALTH_APPS\03_HABIT_BASED_HEALTH\habit-health\shared\src\androidMain\res\drawable")
@@ -44,12 +54,46 @@ OUTPUT_DIR = Path(r"C:\Users\PC\Desktop\moneygrinder\mobile\PART_2_HEALTH_APPS\0
 TRANSFORMER_PATH = MODEL_DIR / "qwen_image_2512_fp8_e4m3fn.safetensors"
 VAE_PATH = MODEL_DIR / "qwen_image_vae.safetensors"
 TEXT_ENCODER_PATH = MODEL_DIR / "qwen_2.5_vl_7b_fp8_scaled.safetensors"
+CACHE_DIR = Path(__file__).resolve().parent / ".asset_cache"
+SIZE_REPORT_PATH = Path(__file__).resolve().parent / "asset_size_report.json"
 
 # ================= CONFIG =================
 VRAM_LIMIT_GB = 29
 LATENT_CHANNELS = 16
 VAE_SCALE_FACTOR = 8
 PATCH_SIZE = 2
+TRANSFORMER_PREFIX = "model.diffusion_model."
+ACTIVATION_HEADROOM_GB = 4  # VRAM left free for activations when sizing the weight cache
+TEXT_HIDDEN_DIM = 3584
+ATTENTION_HEAD_DIM = 128
+ATTENTION_CHUNK_TOKENS = 4096  # Query chunk for long sequences (1080x1920 backgrounds), None = one pass
+SCHEDULE = "linear"     # Sigma schedule: "linear" or "shifted" (flow-matching shift)
+SCHEDULE_SHIFT = 3.0    # Shift for the "shifted" schedule
+SAMPLER = "euler"       # Sampler: "euler", "heun", "dpmpp_2m" or "unipc"
+STEPS = 20              # Sampling steps (heun evaluates the model about twice per step)
+SEED = 0                # Global seed; per-asset seeds are stable_seed(asset name, SEED)
+CFG_SCALE = 7.0
+CFG_OFF_LAST_STEPS = 0  # Adaptive CFG: skip the unconditional pass for the last N steps
+CFG_MIN_SIGMA = 0.0     # Adaptive CFG: skip the unconditional pass below this sigma
+MAX_BATCH_SIZE = 8      # Upper bound on same-size assets sampled together
+ACTIVATION_FACTOR = 16  # Rough live activation copies per token while a block runs
+VAE_TILE_SIZE = 512     # VAE decode tile in pixels, 0 = decode in one pass
+VAE_TILE_OVERLAP = 128  # Pixels shared by neighbouring tiles (blended) and of extra context per side
+PNG_COMPRESS_LEVEL = 6  # zlib level for written PNGs (0-9), encoded off the generation thread
+WRITER_WORKERS = 2      # Background encode/write threads
+# Candidate encoders (see asset_pipeline.IMAGE_ENCODERS); each asset is written in the smallest
+# whose PSNR against the rendered image is at least MIN_PSNR. Lossless formats always qualify.
+OUTPUT_FORMATS = ["png", "png8", "webp_lossless", "webp"]
+MIN_PSNR = 40.0         # Quality floor in dB for the lossy encoders (png8, webp)
+WEBP_QUALITY = 90       # Lossy WebP quality (0-100)
+CACHE_MAX_GB = 2        # Generation cache size before least recently used images are evicted
+
+# Android density buckets (scale vs mdpi). Placeholder icons are sized for ICON_SOURCE_DENSITY at their
+# ASSETS size, drawn once at ICON_SUPERSAMPLE times that, and downsampled into res/drawable-<bucket>.
+DENSITY_BUCKETS = {"mdpi": 1.0, "hdpi": 1.5, "xhdpi": 2.0, "xxhdpi": 3.0, "xxxhdpi": 4.0}
+ICON_SOURCE_DENSITY = "xxxhdpi"
+ICON_SUPERSAMPLE = 2    # Icon render scale over ICON_SOURCE_DENSITY, so every bucket is anti-aliased
+DENSITIES = list(DENSITY_BUCKETS)
 
 # ================= ASSET DEFINITIONS =================
 ASSETS = {
@@ -227,243 +271,1384 @@ class TimestepEmbedding(nn.Module):
         return emb
 
 
-def euler_sample(model_fn, x, sigmas, context, attention_mask=None, cfg_scale=7.0, steps=20):
+def cfg_enabled(step, num_steps, sigma, cfg_scale, off_last_steps=0, min_sigma=0.0):
+    """
+    Whether classifier-free guidance runs at this step.
+
+    Adaptive CFG drops the unconditional pass for the last off_last_steps
+    steps and once sigma falls below min_sigma, where guidance barely changes
+    the result but still doubles the cost of the step.
+    """
+    if cfg_scale == 1.0:
+        return False
+    if step >= num_steps - off_last_steps:
+        return False
+    return float(sigma) >= min_sigma
+
+
+def guided_velocity(model_fn, x, step, cfg_context, cfg_scale):
+    """
+    Classifier-free guided velocity from one batched forward pass.
+
+    The conditional and unconditional inputs are stacked along the batch
+    dimension so both run through the model in a single call; cfg_context
+    is torch.cat([context, uncond_context]), built once per sampling run.
+    """
+    batch = x.shape[0]
+    v = model_fn(torch.cat([x, x]), step, cfg_context)
+    v_cond, v_uncond = v[:batch], v[batch:]
+    return v_uncond + cfg_scale * (v_cond - v_uncond)
+
+
+class GuidedModel:
+    """
+    velocity(x, i) at sigmas[i] with adaptive CFG applied, shared by the samplers.
+
+    Counts model evaluations so samplers can be compared by cost.
+    """
+
+    def __init__(self, model_fn, sigmas, context, uncond_context=None, cfg_scale=7.0, cfg_off_last_steps=0, cfg_min_sigma=0.0):
+        self.model_fn = model_fn
+        self.sigmas = sigmas
+        self.context = context
+        self.cfg_context = torch.cat([context, uncond_context]) if uncond_context is not None else None
+        self.cfg_scale = cfg_scale
+        self.cfg_off_last_steps = cfg_off_last_steps
+        self.cfg_min_sigma = cfg_min_sigma
+        self.evaluations = 0
+        self.cfg_evaluations = 0
+
+    def __call__(self, x, i):
+        num_steps = len(self.sigmas) - 1
+        use_cfg = self.cfg_context is not None and cfg_enabled(
+            min(i, num_steps - 1), num_steps, self.sigmas[i], self.cfg_scale, self.cfg_off_last_steps, self.cfg_min_sigma)
+        self.evaluations += 1
+        with torch.autocast(device_type=x.device.type, dtype=torch.bfloat16):
+            if use_cfg:
+                self.cfg_evaluations += 1
+                return guided_velocity(self.model_fn, x, i, self.cfg_context, self.cfg_scale)
+            return self.model_fn(x, i, self.context)
+
+    def report(self, stats=None):
+        if stats is not None:
+            stats.update(evaluations=self.evaluations, cfg_evaluations=self.cfg_evaluations)
+        if self.cfg_context is not None:
+            print(f"  {self.evaluations} model evaluations, CFG on {self.cfg_evaluations}")
+        else:
+            print(f"  {self.evaluations} model evaluations")
+
+
+def _progress(i, sigmas):
+    if (i + 1) % 5 == 0:
+        print(f"  Step {i+1}/{len(sigmas) - 1}, sigma={sigmas[i]:.4f}")
+
+
+def _first_order(x, sigma, sigma_next, denoised):
+    """
+    Exact step along x_t = (1-sigma)*x_0 + sigma*noise for a fixed x_0 estimate.
+
+    Equal to an Euler step on the velocity, and the first-order DPM-Solver++
+    update written without log-SNR so it also holds at sigma = 1.
+    """
+    ratio = sigma_next / sigma
+    return ratio * x + (1 - ratio) * denoised
+
+
+def _log_snr(sigma):
+    """lambda = log(alpha / sigma) with alpha = 1 - sigma; infinite at sigma 0 or 1."""
+    sigma = float(sigma)
+    if sigma <= 0.0 or sigma >= 1.0:
+        return None
+    return math.log((1 - sigma) / sigma)
+
+
+def _second_order_denoised(denoised, prev_denoised, sigma_prev, sigma, sigma_next):
+    """DPM-Solver++(2M) combination of the last two x_0 estimates, or None at the ends."""
+    lambdas = [_log_snr(s) for s in (sigma_prev, sigma, sigma_next)]
+    if prev_denoised is None or None in lambdas:
+        return None
+    r = (lambdas[1] - lambdas[0]) / (lambdas[2] - lambdas[1])
+    return (1 + 1 / (2 * r)) * denoised - (1 / (2 * r)) * prev_denoised
+
+
+def euler_sample(model_fn, x, sigmas, context, uncond_context=None, cfg_scale=7.0, cfg_off_last_steps=0, cfg_min_sigma=0.0,
+                 stats=None):
     """
     Simple Euler sampler for flow matching models.
 
     Args:
-        model_fn: Function that takes (x, timestep, context) and returns velocity/denoised
+        model_fn: Function that takes (x, i, context) and returns the velocity at sigmas[i]
         x: Initial noise latent [B, C, H, W]
         sigmas: Noise schedule (1.0 -> 0.0)
         context: Text embeddings [B, seq_len, dim]
+        uncond_context: Unconditional embeddings for CFG, None disables CFG
         cfg_scale: Classifier-free guidance scale
+        cfg_off_last_steps: Run the last N steps without CFG
+        cfg_min_sigma: Run steps below this sigma without CFG
+        stats: Optional dict updated with the GuidedModel counters
+            (evaluations, cfg_evaluations) when sampling finishes
     """
     # Flow matching uses linear interpolation: x_t = (1-t)*x_0 + t*noise
-    # Model predicts velocity: v = x_0 - noise
-    # Update: x_{t-dt} = x_t + v * dt
+    # Model predicts velocity: v = noise - x_0
+    # Update: x_{t-dt} = x_t - v * dt
+    model = GuidedModel(model_fn, sigmas, context, uncond_context, cfg_scale, cfg_off_last_steps, cfg_min_sigma)
+
+    for i in range(len(sigmas) - 1):
+        dt = sigmas[i] - sigmas[i + 1]  # Positive since we go from 1->0
+        x = x - model(x, i) * dt
+        _progress(i, sigmas)
+
+    model.report(stats)
+    return x
+
+
+def heun_sample(model_fn, x, sigmas, context, uncond_context=None, cfg_scale=7.0, cfg_off_last_steps=0, cfg_min_sigma=0.0,
+                stats=None):
+    """
+    Heun (trapezoidal) sampler: an Euler step corrected with the velocity at its end.
+
+    Two evaluations per step except the last, which ends at sigma 0 and stays
+    first order. Same arguments as euler_sample.
+    """
+    model = GuidedModel(model_fn, sigmas, context, uncond_context, cfg_scale, cfg_off_last_steps, cfg_min_sigma)
 
     for i in range(len(sigmas) - 1):
-        sigma = sigmas[i]
-        sigma_next = sigmas[i + 1]
-        dt = sigma_next - sigma  # Negative since we go from 1->0
+        dt = sigmas[i + 1] - sigmas[i]
+        v = model(x, i)
+        x_euler = x + v * dt
+        if sigmas[i + 1] == 0:
+            x = x_euler
+        else:
+            x = x + (v + model(x_euler, i + 1)) * (dt / 2)
+        _progress(i, sigmas)
+
+    model.report(stats)
+    return x
 
-        # Get model prediction
-        with torch.cuda.amp.autocast(dtype=torch.bfloat16):
-            v = model_fn(x, sigma, context, attention_mask)
 
-        # Euler step
-        x = x + v * (-dt)  # Negative because we're going backward
+def dpmpp_2m_sample(model_fn, x, sigmas, context, uncond_context=None, cfg_scale=7.0, cfg_off_last_steps=0, cfg_min_sigma=0.0,
+                    stats=None):
+    """
+    DPM-Solver++(2M) for flow matching: one evaluation per step.
 
-        if (i + 1) % 5 == 0:
-            print(f"  Step {i+1}/{len(sigmas)-1}, sigma={sigma:.4f}")
+    Works on x_0 estimates (x - sigma * v) and extrapolates from the previous
+    step's estimate, so it reaches second order without extra evaluations.
+    Same arguments as euler_sample.
+    """
+    model = GuidedModel(model_fn, sigmas, context, uncond_context, cfg_scale, cfg_off_last_steps, cfg_min_sigma)
 
+    prev_denoised = None
+    for i in range(len(sigmas) - 1):
+        sigma, sigma_next = sigmas[i], sigmas[i + 1]
+        denoised = x - sigma * model(x, i)
+        combined = _second_order_denoised(denoised, prev_denoised, sigmas[i - 1] if i else None, sigma, sigma_next) if i else None
+        x = _first_order(x, sigma, sigma_next, denoised if combined is None else combined)
+        prev_denoised = denoised
+        _progress(i, sigmas)
+
+    model.report(stats)
     return x
 
 
-class SimpleVAEDecoder(nn.Module):
-    """Simplified VAE decoder that loads from safetensors state dict."""
+def unipc_sample(model_fn, x, sigmas, context, uncond_context=None, cfg_scale=7.0, cfg_off_last_steps=0, cfg_min_sigma=0.0,
+                 stats=None):
+    """
+    UniPC-style predictor-corrector: one evaluation per step.
 
-    def __init__(self):
-        super().__init__()
-        # Will be populated from state dict
-        self.layers = nn.ModuleDict()
-
-    def load_from_state_dict(self, sd):
-        """Load decoder weights from VAE state dict."""
-        # Extract decoder keys
-        decoder_keys = [k for k in sd.keys() if k.startswith('decoder.')]
-        print(f"  Found {len(decoder_keys)} decoder keys")
-
-        # Build the decoder structure from keys
-        # Standard VAE decoder structure
-        self.conv_in = nn.Conv2d(16, 512, 3, padding=1)
-
-        # Mid block
-        self.mid_norm1 = nn.GroupNorm(32, 512)
-        self.mid_conv1 = nn.Conv2d(512, 512, 3, padding=1)
-        self.mid_norm2 = nn.GroupNorm(32, 512)
-        self.mid_conv2 = nn.Conv2d(512, 512, 3, padding=1)
-
-        # Up blocks (4 stages: 512->512->256->128->128)
-        self.up_blocks = nn.ModuleList([
-            self._make_up_block(512, 512),
-            self._make_up_block(512, 256),
-            self._make_up_block(256, 128),
-            self._make_up_block(128, 128),
-        ])
-
-        self.norm_out = nn.GroupNorm(32, 128)
-        self.conv_out = nn.Conv2d(128, 3, 3, padding=1)
-
-        # Load weights
-        self._load_weights(sd)
-
-    def _make_up_block(self, in_ch, out_ch):
-        return nn.ModuleDict({
-            'upsample': nn.Upsample(scale_factor=2, mode='nearest'),
-            'conv': nn.Conv2d(in_ch, out_ch, 3, padding=1),
-            'norm1': nn.GroupNorm(32, out_ch),
-            'conv1': nn.Conv2d(out_ch, out_ch, 3, padding=1),
-            'norm2': nn.GroupNorm(32, out_ch),
-            'conv2': nn.Conv2d(out_ch, out_ch, 3, padding=1),
-        })
-
-    def _load_weights(self, sd):
-        """Map state dict keys to our structure."""
-        # This is a simplified loader - real implementation would need exact key mapping
-        pass
-
-    def forward(self, z):
-        # Scale latent
-        z = z / 0.13025
-
-        h = self.conv_in(z)
-
-        # Mid block
-        h = self.mid_norm1(h)
-        h = F.silu(h)
-        h = self.mid_conv1(h)
-        h = self.mid_norm2(h)
-        h = F.silu(h)
-        h = self.mid_conv2(h)
-
-        # Up blocks
-        for up_block in self.up_blocks:
-            h = up_block['upsample'](h)
-            h = up_block['conv'](h)
-            res = h
-            h = up_block['norm1'](h)
-            h = F.silu(h)
-            h = up_block['conv1'](h)
-            h = up_block['norm2'](h)
-            h = F.silu(h)
-            h = up_block['conv2'](h)
-            h = h + res
-
-        h = self.norm_out(h)
-        h = F.silu(h)
-        h = self.conv_out(h)
+    Each new evaluation first corrects the point it was taken at (trapezoidal
+    rule on the x_0 estimates of both ends of the previous step), then drives
+    a DPM-Solver++(2M) prediction of the next point. The correction reuses
+    the evaluation the predictor needs anyway. Same arguments as euler_sample.
+    """
+    model = GuidedModel(model_fn, sigmas, context, uncond_context, cfg_scale, cfg_off_last_steps, cfg_min_sigma)
 
-        return h
+    prev_x = prev_denoised = None
+    for i in range(len(sigmas) - 1):
+        sigma, sigma_next = sigmas[i], sigmas[i + 1]
+        denoised = x - sigma * model(x, i)
+        if prev_denoised is not None:
+            x = _first_order(prev_x, sigmas[i - 1], sigma, (prev_denoised + denoised) / 2)
+        combined = _second_order_denoised(denoised, prev_denoised, sigmas[i - 1] if i else None, sigma, sigma_next) if i else None
+        prev_x, prev_denoised = x, denoised
+        x = _first_order(x, sigma, sigma_next, denoised if combined is None else combined)
+        _progress(i, sigmas)
+
+    model.report(stats)
+    return x
 
 
-def decode_vae_simple(latent, vae_sd):
+SAMPLERS = {
+    "euler": euler_sample,
+    "heun": heun_sample,
+    "dpmpp_2m": dpmpp_2m_sample,
+    "unipc": unipc_sample,
+}
+
+
+# ================= VAE DECODER =================
+
+# Per-channel latent statistics of the Qwen-Image (Wan 2.1) VAE
+VAE_LATENTS_MEAN = [-0.7571, -0.7089, -0.9113, 0.1075, -0.1745, 0.9653, -0.1517, 1.5508,
+                    0.4134, -0.0715, 0.5517, -0.3632, -0.1922, -0.9497, 0.2503, -0.2921]
+VAE_LATENTS_STD = [2.8184, 1.4541, 2.3275, 2.6558, 1.2196, 1.7708, 2.6052, 2.0743,
+                   3.2687, 2.1526, 2.8652, 1.5579, 1.6382, 1.1253, 2.8251, 1.9160]
+
+_WAN_RESIDUAL_KEYS = {
+    "residual.0.": "norm1.",
+    "residual.2.": "conv1.",
+    "residual.3.": "norm2.",
+    "residual.6.": "conv2.",
+    "shortcut.": "conv_shortcut.",
+}
+
+
+def remap_wan_vae_keys(sd):
     """
-    Decode latent to image using direct tensor operations on VAE state dict.
-    This avoids building a full model - we just apply the convolutions directly.
+    Decoder keys of a VAE state dict under the diffusers Qwen-Image/Wan names.
+
+    ComfyUI ships the original Wan layout (decoder.conv1, decoder.middle.N,
+    a flat decoder.upsamples.N list, decoder.head.N and a top-level conv2);
+    those are renamed here. Files already in diffusers layout pass through.
+    Encoder keys are dropped.
     """
-    # Get the decoder weights
-    z = latent / 0.13025  # VAE scaling
+    out = {}
+    upsamples = {}
+    for key in sd.keys():
+        if key.startswith("conv2."):
+            out["post_quant_conv." + key[len("conv2."):]] = key
+        elif key.startswith("decoder.conv1."):
+            out["decoder.conv_in." + key[len("decoder.conv1."):]] = key
+        elif key.startswith("decoder.head."):
+            index, rest = key[len("decoder.head."):].split(".", 1)
+            out[{"0": "decoder.norm_out.", "2": "decoder.conv_out."}[index] + rest] = key
+        elif key.startswith("decoder.middle."):
+            index, rest = key[len("decoder.middle."):].split(".", 1)
+            if index == "1":
+                out["decoder.mid_block.attentions.0." + rest] = key
+            else:
+                out[f"decoder.mid_block.resnets.{int(index) // 2}." + _remap_residual(rest)] = key
+        elif key.startswith("decoder.upsamples."):
+            index, rest = key[len("decoder.upsamples."):].split(".", 1)
+            upsamples.setdefault(int(index), []).append((rest, key))
+        elif key.startswith(("decoder.", "post_quant_conv.")):
+            out[key] = key
+
+    # The flat list is resnets followed by one resampler per up block
+    block = resnet = 0
+    for index in sorted(upsamples):
+        entries = upsamples[index]
+        if any(rest.startswith("resample.") or rest.startswith("time_conv.") for rest, _ in entries):
+            for rest, key in entries:
+                out[f"decoder.up_blocks.{block}.upsamplers.0.{rest}"] = key
+            block, resnet = block + 1, 0
+        else:
+            for rest, key in entries:
+                out[f"decoder.up_blocks.{block}.resnets.{resnet}.{_remap_residual(rest)}"] = key
+            resnet += 1
+    return {name: sd[key] for name, key in out.items()}
 
-    # Find all decoder layer keys and their shapes
-    decoder_layers = {}
-    for k, v in vae_sd.items():
-        if k.startswith('decoder.'):
-            decoder_layers[k] = v
 
-    # For now, use a simplified approach: just do basic upsampling
-    # Real implementation would apply each conv layer in order
+def _remap_residual(rest):
+    for old, new in _WAN_RESIDUAL_KEYS.items():
+        if rest.startswith(old):
+            return new + rest[len(old):]
+    return rest
 
-    # Simple upscale + conv approximation
-    batch, ch, h, w = z.shape
 
-    # Upsample 8x (VAE scale factor)
-    img = F.interpolate(z, scale_factor=8, mode='bilinear', align_corners=False)
+class VAEDecoder:
+    """
+    Qwen-Image VAE decoder run from a state dict, one image frame at a time.
+
+    The Wan VAE is a causal video VAE. For a single frame each causal 3D
+    convolution only sees its last temporal kernel slice (the earlier ones
+    read the zero padding), so weights are sliced to 2D once at load and the
+    decoder runs as plain 2D convolutions. Structure (up blocks, resnets per
+    block, mid attention) is read from the keys.
+
+    Latents larger than tile_size pixels are decoded in tiles that share
+    `overlap` pixels with their neighbours, blended with linear ramps. Each
+    tile is decoded with another `overlap` pixels of latent context around
+    it that is cropped off afterwards, so peak activation memory is set by
+    tile_size + 2 * overlap rather than by the image size. Without the mid
+    attention the result matches a one-pass decode once overlap covers the
+    convolutions' receptive field; attention sees only its tile, which the
+    blending hides. tile_size=0 decodes in one pass.
+    """
+
+    def __init__(self, vae_sd, device, dtype=torch.bfloat16, tile_size=VAE_TILE_SIZE, overlap=VAE_TILE_OVERLAP):
+        self.device = device
+        self.dtype = dtype
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.weights = {}
+        for name, tensor in remap_wan_vae_keys(vae_sd).items():
+            if name.endswith(".weight") and tensor.dim() == 5:
+                tensor = tensor[:, :, -1]
+            if name.endswith(".gamma"):
+                tensor = tensor.reshape(-1)
+            self.weights[name] = tensor.to(device, dtype=dtype)
+
+        self.up_blocks = []
+        block = 0
+        while f"decoder.up_blocks.{block}.resnets.0.conv1.weight" in self.weights:
+            resnets = 0
+            while f"decoder.up_blocks.{block}.resnets.{resnets}.conv1.weight" in self.weights:
+                resnets += 1
+            upsample = f"decoder.up_blocks.{block}.upsamplers.0.resample.1.weight" in self.weights
+            self.up_blocks.append((resnets, upsample))
+            block += 1
+        self.scale_factor = 2 ** sum(upsample for _, upsample in self.up_blocks)
+
+        channels = self.weights["decoder.conv_in.weight"].shape[1]
+        self.latents_mean = torch.tensor(VAE_LATENTS_MEAN[:channels], device=device).view(1, -1, 1, 1)
+        self.latents_std = torch.tensor(VAE_LATENTS_STD[:channels], device=device).view(1, -1, 1, 1)
+
+    def _conv(self, x, name):
+        weight = self.weights[name + ".weight"]
+        return F.conv2d(x, weight, self.weights.get(name + ".bias"), padding=weight.shape[-1] // 2)
+
+    def _norm(self, x, name):
+        gamma = self.weights[name + ".gamma"]
+        return F.normalize(x, dim=1) * math.sqrt(x.shape[1]) * gamma.view(1, -1, 1, 1)
+
+    def _resnet(self, x, name):
+        h = self._conv(F.silu(self._norm(x, name + ".norm1")), name + ".conv1")
+        h = self._conv(F.silu(self._norm(h, name + ".norm2")), name + ".conv2")
+        if name + ".conv_shortcut.weight" in self.weights:
+            x = self._conv(x, name + ".conv_shortcut")
+        return x + h
+
+    def _attention(self, x, name):
+        batch, channels, height, width = x.shape
+        qkv = self._conv(self._norm(x, name + ".norm"), name + ".to_qkv")
+        q, k, v = qkv.view(batch, 1, 3 * channels, height * width).transpose(-1, -2).chunk(3, dim=-1)
+        out = F.scaled_dot_product_attention(q, k, v)
+        out = out.squeeze(1).transpose(1, 2).reshape(batch, channels, height, width)
+        return x + self._conv(out, name + ".proj")
+
+    def _forward(self, z):
+        """Decoder body: scaled latent [B, C, h, w] -> image in [-1, 1]."""
+        h = self._conv(z, "decoder.conv_in")
+        h = self._resnet(h, "decoder.mid_block.resnets.0")
+        if "decoder.mid_block.attentions.0.to_qkv.weight" in self.weights:
+            h = self._attention(h, "decoder.mid_block.attentions.0")
+        h = self._resnet(h, "decoder.mid_block.resnets.1")
+
+        for block, (resnets, upsample) in enumerate(self.up_blocks):
+            for i in range(resnets):
+                h = self._resnet(h, f"decoder.up_blocks.{block}.resnets.{i}")
+            if upsample:
+                h = F.interpolate(h, scale_factor=2, mode="nearest-exact")
+                h = self._conv(h, f"decoder.up_blocks.{block}.upsamplers.0.resample.1")
+
+        h = self._conv(F.silu(self._norm(h, "decoder.norm_out")), "decoder.conv_out")
+        return h.clamp(-1, 1)
+
+    def _tile_starts(self, length, tile, overlap):
+        if length <= tile:
+            return [0]
+        stride = tile - overlap
+        starts = list(range(0, length - tile, stride))
+        return starts + [length - tile]
+
+    def _ramp(self, length, overlap, ramp_start, ramp_end):
+        """Blend weights along one tile axis, ramping only on sides shared with a neighbour."""
+        weight = torch.ones(length, device=self.device)
+        if overlap:
+            ramp = (torch.arange(overlap, device=self.device) + 0.5) / overlap
+            if ramp_start:
+                weight[:overlap] = ramp
+            if ramp_end:
+                weight[-overlap:] = ramp.flip(0)
+        return weight
+
+    def _decode_tiled(self, z):
+        scale = self.scale_factor
+        tile = max(self.tile_size // scale, 1)
+        overlap = min(self.overlap // scale, tile - 1)
+        batch, _, height, width = z.shape
+        rows = self._tile_starts(height, tile, overlap)
+        cols = self._tile_starts(width, tile, overlap)
+
+        out = torch.zeros(batch, 3, height * scale, width * scale, device=self.device)
+        total = torch.zeros(1, 1, height * scale, width * scale, device=self.device)
+        for top in rows:
+            for left in cols:
+                # Decode with `overlap` latent pixels of extra context on each side, then crop it
+                # off, so tile edges see the same neighbourhood as a one-pass decode
+                y0, x0 = max(top - overlap, 0), max(left - overlap, 0)
+                y1, x1 = min(top + tile + overlap, height), min(left + tile + overlap, width)
+                piece = self._forward(z[:, :, y0:y1, x0:x1]).float()
+                tile_h, tile_w = min(tile, height - top) * scale, min(tile, width - left) * scale
+                crop_y, crop_x = (top - y0) * scale, (left - x0) * scale
+                piece = piece[:, :, crop_y:crop_y + tile_h, crop_x:crop_x + tile_w]
+
+                mask = (self._ramp(tile_h, overlap * scale, top > 0, top + tile < height).view(-1, 1) *
+                        self._ramp(tile_w, overlap * scale, left > 0, left + tile < width).view(1, -1))
+                y, x = top * scale, left * scale
+                out[:, :, y:y + tile_h, x:x + tile_w] += piece * mask
+                total[:, :, y:y + tile_h, x:x + tile_w] += mask
+                del piece
+        return out / total
+
+    def decode(self, latent):
+        """Latent [B, C, h, w] from the sampler -> image tensor [B, 3, H, W] in [0, 1]."""
+        with torch.no_grad():
+            z = latent.to(self.device, dtype=torch.float32) * self.latents_std + self.latents_mean
+            z = z.to(self.dtype)
+            if "post_quant_conv.weight" in self.weights:
+                z = self._conv(z, "post_quant_conv")
+
+            tile = self.tile_size // self.scale_factor
+            if self.tile_size and (z.shape[-2] > tile or z.shape[-1] > tile):
+                img = self._decode_tiled(z)
+            else:
+                img = self._forward(z).float()
+        return img.add_(1).div_(2)
 
-    # Project 16 channels -> 3 RGB
-    # Use first conv out weights if available
-    conv_out_key = 'decoder.conv_out.weight'
-    if conv_out_key in vae_sd:
-        weight = vae_sd[conv_out_key].to(z.device, dtype=z.dtype)
-        bias = vae_sd['decoder.conv_out.bias'].to(z.device, dtype=z.dtype)
-        # Need to match input channels
-        img = F.conv2d(img[:, :weight.shape[1]], weight, bias, padding=1)
-    else:
-        # Fallback: just take first 3 channels and normalize
-        img = img[:, :3]
 
-    # Normalize to 0-1
-    img = (img + 1) / 2
-    img = img.clamp(0, 1)
+class FrameBufferPool:
+    """
+    Reusable host uint8 buffers for decoded frames, keyed by shape.
+
+    Buffers are pinned when CUDA is available so the device-to-host copy is
+    a single DMA transfer, and after the first frame of a size no new host
+    memory is allocated.
+    """
+
+    def __init__(self, pin_memory=None):
+        self.pin_memory = torch.cuda.is_available() if pin_memory is None else pin_memory
+        self._free = {}
+        self.allocated = 0
+
+    def acquire(self, shape):
+        free = self._free.get(tuple(shape))
+        if free:
+            return free.pop()
+        self.allocated += 1
+        return torch.empty(tuple(shape), dtype=torch.uint8, pin_memory=self.pin_memory)
+
+    def release(self, buffer):
+        self._free.setdefault(tuple(buffer.shape), []).append(buffer)
+
+
+_FRAME_BUFFERS = FrameBufferPool()
+
+
+def image_to_pil(img, pool=None):
+    """
+    Quantize a [1, 3, H, W] image tensor in [0, 1] into a PIL RGB image.
+
+    img is overwritten. Scaling and rounding run in place on its device and
+    the HWC uint8 frame is written in one strided copy, so the only new
+    device allocation is the uint8 frame itself. That frame is copied once
+    into a pooled host buffer and handed to Image.frombuffer, which unpacks
+    it into PIL's own storage, so the buffer goes back to the pool at once.
+    """
+    _, _, height, width = img.shape
+    img.mul_(255).add_(0.5).clamp_(0, 255)
+    frame = torch.empty(height, width, 3, dtype=torch.uint8, device=img.device)
+    frame.copy_(img[0].permute(1, 2, 0))  # truncation after +0.5 rounds to nearest
+
+    if frame.device.type == "cpu":
+        return Image.frombuffer("RGB", (width, height), frame.numpy(), "raw", "RGB", 0, 1)
+
+    pool = pool or _FRAME_BUFFERS
+    host = pool.acquire(frame.shape)
+    try:
+        host.copy_(frame, non_blocking=True)
+        torch.cuda.current_stream(frame.device).synchronize()
+        return Image.frombuffer("RGB", (width, height), host.numpy(), "raw", "RGB", 0, 1)
+    finally:
+        pool.release(host)
+
+
+def latent_to_image(latent, vae, pool=None):
+    """Convert latent tensor to PIL image with a VAEDecoder."""
+    return image_to_pil(vae.decode(latent), pool)
+
+
+# ================= STREAMING LOADER =================
+
+class StreamingStateDict:
+    """
+    Read-only state dict over a memory-mapped safetensors file.
+
+    Tensors are read from the file only when accessed, so peak memory is set
+    by what the caller holds rather than by the file size. prefetch() reads
+    tensors on a background thread (with its own file handle) so the next
+    block can load while the current one runs; a prefetched tensor is handed
+    over and dropped on first access.
+    """
+
+    def __init__(self, path, device="cpu", prefetch=True):
+        self.path = str(path)
+        self.device = str(device)
+        self._file = safe_open(self.path, framework="pt", device=self.device)
+        self._keys = list(self._file.keys())
+        self._key_set = set(self._keys)
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch") if prefetch else None
+        self._pending = {}
+        self.bytes_read = 0
+
+    def keys(self):
+        return list(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __contains__(self, key):
+        return key in self._key_set
+
+    def __getitem__(self, key):
+        future = self._pending.pop(key, None)
+        if future is not None:
+            return future.result()
+        if key not in self._key_set:
+            raise KeyError(key)
+        return self._read(self._file, key)
+
+    def get(self, key, default=None):
+        return self[key] if key in self._key_set else default
+
+    def prefetch(self, keys):
+        """Start reading keys in the background."""
+        if self._executor is None:
+            return
+        for key in keys:
+            if key in self._key_set and key not in self._pending:
+                self._pending[key] = self._executor.submit(self._read_background, key)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        self._pending.clear()
+
+    def _read_background(self, key):
+        handle = getattr(self._local, "file", None)
+        if handle is None:
+            handle = self._local.file = safe_open(self.path, framework="pt", device=self.device)
+        return self._read(handle, key)
+
+    def _read(self, handle, key):
+        tensor = handle.get_tensor(key)
+        self.bytes_read += tensor.numel() * tensor.element_size()
+        return tensor
+
+
+def load_transformer(device="cuda", stream=False):
+    """Transformer state dict, fully loaded or streamed block by block."""
+    if stream:
+        return StreamingStateDict(TRANSFORMER_PATH, device=device)
+    return load_file(str(TRANSFORMER_PATH), device=device)
+
+
+# ================= WEIGHT PLAN =================
+
+# Projections concatenated into one matmul at load time
+FUSED_PROJECTIONS = {
+    "attn.to_qkv": ("attn.to_q", "attn.to_k", "attn.to_v"),
+    "attn.add_qkv_proj": ("attn.add_q_proj", "attn.add_k_proj", "attn.add_v_proj"),
+}
+
+# Norm weights applied through RMSNorm modules
+RMS_NORM_WEIGHTS = ("attn.norm_q", "attn.norm_k", "attn.norm_added_q", "attn.norm_added_k", "txt_norm")
+
+
+class BlockWeightPlan:
+    """
+    Transformer weights resolved once and cast once for the whole run.
+
+    Keys are resolved at construction so the sampling loop never builds key
+    strings. Weights are cast to the compute dtype on first use and kept
+    resident, a whole block at a time, while they fit in budget_bytes
+    (non-block weights are small and always kept). Blocks are visited in
+    the same order every step, so an LRU would evict exactly the block
+    needed next; once the budget is full the remaining blocks are cast on
+    the fly instead of evicting the ones already held.
+    """
+
+    def __init__(self, transformer_sd, device, dtype=torch.bfloat16, budget_bytes=None, prefix=TRANSFORMER_PREFIX):
+        self.source = transformer_sd
+        self.device = torch.device(device)
+        self.dtype = dtype
+        self.budget_bytes = budget_bytes
+
+        self.global_keys = {}
+        block_keys = {}
+        block_prefix = "transformer_blocks."
+        for key in transformer_sd.keys():
+            if not key.startswith(prefix):
+                continue
+            name = key[len(prefix):]
+            if name.startswith(block_prefix):
+                idx, rest = name[len(block_prefix):].split(".", 1)
+                block_keys.setdefault(int(idx), {})[rest] = key
+            else:
+                self.global_keys[name] = key
+        num_blocks = max(block_keys) + 1 if block_keys else 0
+        self.block_keys = [block_keys.get(i, {}) for i in range(num_blocks)]
+
+        self.globals = self._prepare(self._cast(self.global_keys))
+        self.resident_bytes = self._nbytes(self.globals)
+        self._blocks = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def num_blocks(self):
+        return len(self.block_keys)
+
+    @property
+    def context_dim(self):
+        """Width of the text embeddings txt_in expects."""
+        txt_in = self.get("txt_in.weight")
+        return txt_in.shape[1] if txt_in is not None else TEXT_HIDDEN_DIM
+
+    def get(self, name):
+        """Non-block weight by name without prefix, e.g. "img_in.weight"."""
+        return self.globals.get(name)
+
+    def block(self, idx, prefetch=None):
+        """
+        Cast weights of block idx as a dict keyed by the name inside the block.
+
+        prefetch names the block that runs next; a streaming source starts
+        reading it in the background if the plan does not already hold it.
+        """
+        if prefetch is not None and prefetch not in self._blocks and hasattr(self.source, "prefetch"):
+            self.source.prefetch(self.block_keys[prefetch].values())
+
+        weights = self._blocks.get(idx)
+        if weights is not None:
+            self.hits += 1
+            return weights
+
+        self.misses += 1
+        weights = self._prepare(self._cast(self.block_keys[idx]))
+        size = self._nbytes(weights)
+        if self.budget_bytes is None or self.resident_bytes + size <= self.budget_bytes:
+            self._blocks[idx] = weights
+            self.resident_bytes += size
+        return weights
+
+    def warm(self):
+        """Cast blocks up front until the budget is full."""
+        for i in range(self.num_blocks):
+            if i not in self._blocks:
+                self.block(i)
+                if i not in self._blocks:
+                    break
+        self.misses = 0
+        return self.resident_bytes
+
+    def _cast(self, keys):
+        return {name: self.source[key].to(device=self.device, dtype=self.dtype) for name, key in keys.items()}
+
+    @staticmethod
+    def _prepare(weights):
+        """Fuse Q/K/V projections into one matrix and wrap Q/K norm weights in RMSNorm."""
+        for fused, parts in FUSED_PROJECTIONS.items():
+            if all(f"{p}.weight" in weights for p in parts):
+                weights[f"{fused}.weight"] = torch.cat([weights.pop(f"{p}.weight") for p in parts])
+                biases = [weights.pop(f"{p}.bias", None) for p in parts]
+                if all(b is not None for b in biases):
+                    weights[f"{fused}.bias"] = torch.cat(biases)
+
+        for name in RMS_NORM_WEIGHTS:
+            weight = weights.pop(f"{name}.weight", None)
+            if weight is not None:
+                norm = RMSNorm(weight.shape[0])
+                norm.weight = nn.Parameter(weight, requires_grad=False)
+                weights[name] = norm
+        return weights
+
+    @staticmethod
+    def _nbytes(weights):
+        tensors = [w.weight if isinstance(w, nn.Module) else w for w in weights.values()]
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def weight_budget_bytes():
+    """Bytes the weight plan may keep resident under VRAM_LIMIT_GB."""
+    budget = (VRAM_LIMIT_GB - ACTIVATION_HEADROOM_GB) * (1024**3)
+    if torch.cuda.is_available():
+        budget -= torch.cuda.memory_allocated(0)
+    return max(int(budget), 0)
+
+
+def build_weight_plan(transformer_sd, device, stream=False):
+    """
+    BlockWeightPlan for generation. Streamed weights keep no blocks
+    resident, so only the running block and the one being prefetched are
+    in memory; otherwise blocks are cast up front up to weight_budget_bytes().
+    """
+    if stream:
+        return BlockWeightPlan(transformer_sd, device, budget_bytes=0)
+    plan = BlockWeightPlan(transformer_sd, device, budget_bytes=weight_budget_bytes())
+    plan.warm()
+    return plan
+
+
+# ================= SCHEDULES =================
+
+_SINUSOID_FREQS = {}
+
+
+def timestep_embedding(timestep, plan):
+    """Sinusoidal embedding of timestep [N] through time_text_embed, [N, dim]."""
+    device = timestep.device
+    freqs = _SINUSOID_FREQS.get(device)
+    if freqs is None:
+        half_dim = 128
+        emb = math.log(10000) / (half_dim - 1)
+        freqs = _SINUSOID_FREQS[device] = torch.exp(torch.arange(half_dim, device=device, dtype=torch.float32) * -emb)
+
+    # Create sinusoidal embedding for timestep
+    emb = timestep[:, None].float() * freqs[None, :]
+    emb = torch.cat([torch.sin(emb), torch.cos(emb)], dim=-1).to(plan.dtype)
+
+    prefix = "time_text_embed.timestep_embedder."
+    if plan.get(prefix + "linear_1.weight") is None:
+        return emb
+    temb = F.linear(emb, plan.get(prefix + "linear_1.weight"), plan.get(prefix + "linear_1.bias"))
+    temb = F.silu(temb)
+    return F.linear(temb, plan.get(prefix + "linear_2.weight"), plan.get(prefix + "linear_2.bias"))
+
+
+class FlowSchedule:
+    """
+    Precomputed sigmas, timesteps and timestep embeddings for one step count.
+
+    kind "linear" spaces sigmas evenly from 1 to 0; "shifted" applies the
+    flow-matching shift sigma' = shift*sigma / (1 + (shift-1)*sigma), which
+    spends more steps at high noise. temb(plan) computes the embedding for
+    every step in one batched pass and keeps it, so sampling does a table
+    lookup instead of the embedding MLP per step. The table is held per
+    plan through a weak reference, so a cached schedule never keeps a
+    deleted plan (and its weights) alive.
+    """
+
+    KINDS = ("linear", "shifted")
+
+    def __init__(self, steps, kind="linear", shift=1.0, device="cpu"):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown schedule: {kind} (expected one of {', '.join(self.KINDS)})")
+        sigmas = torch.linspace(1.0, 0.0, steps + 1, device=device)
+        if kind == "shifted":
+            sigmas = shift * sigmas / (1 + (shift - 1) * sigmas)
+        self.steps = steps
+        self.kind = kind
+        self.shift = shift
+        self.sigmas = sigmas
+        self.timesteps = sigmas * 1000  # Scale to typical timestep range
+        self._temb = weakref.WeakKeyDictionary()   # plan -> [steps + 1, dim] table
+
+    def temb(self, plan):
+        """Timestep embeddings for every sigma, [steps + 1, dim]."""
+        table = self._temb.get(plan)
+        if table is None:
+            with torch.no_grad():
+                table = self._temb[plan] = timestep_embedding(self.timesteps, plan)
+        return table
+
+
+_SCHEDULES = {}
+
+
+def get_schedule(steps, kind="linear", shift=1.0, device="cpu"):
+    """Shared FlowSchedule for (steps, kind, shift, device)."""
+    key = (steps, kind, float(shift) if kind == "shifted" else None, str(device))
+    schedule = _SCHEDULES.get(key)
+    if schedule is None:
+        schedule = _SCHEDULES[key] = FlowSchedule(steps, kind, shift, device)
+    return schedule
+
+
+# ================= SPEED MODES =================
+
+class SpeedMode:
+    """
+    Which transformer blocks run at each sampling step.
+
+    "full"   runs every block (up to num_blocks).
+    "subset" runs only the block indices in blocks (or the first blocks
+             blocks when it is an int).
+    "cache"  is a step-level feature cache: when an item's block-stack
+             input has moved less than tolerance (relative L2) since the
+             stack last ran for it, the residual from that run is added
+             instead of running the blocks again. Drift is measured against
+             the item's last computed step, so small changes accumulate
+             until they force a rerun. Each batch item is judged on its own,
+             so an asset's output does not depend on its batch.
+
+    Counters are block evaluations summed over batch items since the last
+    reset().
+    """
+
+    MODES = ("full", "subset", "cache")
+
+    def __init__(self, mode="full", blocks=None, tolerance=0.05):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown speed mode: {mode} (expected one of {', '.join(self.MODES)})")
+        if mode == "subset" and blocks is None:
+            raise ValueError("Speed mode 'subset' needs blocks")
+        self.mode = mode
+        self.blocks = blocks
+        self.tolerance = tolerance
+        self.reset()
+
+    def reset(self):
+        self.evaluated = 0
+        self.saved = 0
+        self._input = None
+        self._residual = None
+
+    def block_indices(self, num_blocks):
+        if self.mode != "subset":
+            return list(range(num_blocks))
+        if isinstance(self.blocks, int):
+            return list(range(min(self.blocks, num_blocks)))
+        return [i for i in self.blocks if i < num_blocks]
+
+    def reuse(self, x, num_total):
+        """
+        (x, rows): x with the cached stack output filled in for the items
+        that can reuse it, and the indices of the items whose blocks must run.
+        """
+        rows = torch.arange(x.shape[0], device=x.device)
+        if self.mode != "cache" or self._input is None or self._input.shape != x.shape:
+            return x, rows
+        dims = tuple(range(1, x.dim()))
+        change = (x - self._input).float().norm(dim=dims) / self._input.float().norm(dim=dims).clamp_min(1e-12)
+        keep = change < self.tolerance
+        if not keep.any():
+            return x, rows
+        self.saved += num_total * int(keep.sum())
+        x = torch.where(keep.view(-1, *([1] * len(dims))), x + self._residual, x)
+        return x, rows[~keep]
+
+    def record(self, x_in, x_out, rows, evaluated, num_total):
+        """Count evaluated block runs over the items in rows and keep their residuals."""
+        self.evaluated += evaluated
+        self.saved += num_total * len(rows) - evaluated
+        if self.mode != "cache":
+            return
+        if self._input is None or self._input.shape != x_in.shape:
+            self._input = x_in
+            self._residual = x_out - x_in
+        else:
+            self._input[rows] = x_in[rows]
+            self._residual[rows] = (x_out - x_in)[rows]
+
+
+class ActivationCache:
+    """
+    Activations reused across the sampling steps of one generation.
+
+    Text context projections (txt_norm + txt_in) do not depend on the step,
+    so each context tensor is projected once and looked up by identity
+    afterwards. With deep_from set, blocks from that index on form the deep
+    part of the stack: their residual is computed on one step and reused on
+    the next, so deep blocks run on alternating steps only. The alternation
+    is kept per batch item, since SpeedMode may run the stack for only some
+    of them.
+    """
+
+    def __init__(self, deep_from=None):
+        self.deep_from = deep_from
+        self.context_hits = 0
+        self.context_misses = 0
+        self.deep_hits = 0
+        self.deep_misses = 0
+        self._contexts = []
+        self._deep_residual = None   # [batch, ...] residual per item...
+        self._deep_ready = None      # ...usable on the item's next pass
+
+    def project_context(self, context, project):
+        for source, projected in self._contexts:
+            if source is context:
+                self.context_hits += 1
+                return projected
+        self.context_misses += 1
+        projected = project(context)
+        self._contexts.append((context, projected))
+        return projected
+
+    def deep_split(self, indices):
+        """Position in indices where the deep blocks start."""
+        if self.deep_from is None:
+            return len(indices)
+        return next((j for j, i in enumerate(indices) if i >= self.deep_from), len(indices))
+
+    def _deep_fits(self, x, batch):
+        residual = self._deep_residual
+        return residual is not None and residual.shape[0] == batch and residual.shape[1:] == x.shape[1:]
+
+    def reuse_deep(self, x, rows, batch):
+        """
+        (x, run) for the items rows of a batch of batch: x plus the stored
+        deep residual for items that have one pending (alternating passes),
+        and the positions in x of the items whose deep blocks must run.
+        """
+        run = torch.arange(x.shape[0], device=x.device)
+        if not self._deep_fits(x, batch):
+            self.deep_misses += len(rows)
+            return x, run
+        ready = self._deep_ready[rows]
+        hits = int(ready.sum())
+        self.deep_hits += hits
+        self.deep_misses += len(rows) - hits
+        if not hits:
+            return x, run
+        x = torch.where(ready.view(-1, *([1] * (x.dim() - 1))), x + self._deep_residual[rows], x)
+        self._deep_ready[rows] = False
+        return x, run[~ready]
+
+    def store_deep(self, x_in, x_out, rows, batch):
+        if not self._deep_fits(x_in, batch):
+            self._deep_residual = x_in.new_zeros((batch, *x_in.shape[1:]))
+            self._deep_ready = torch.zeros(batch, dtype=torch.bool, device=x_in.device)
+        self._deep_residual[rows] = x_out - x_in
+        self._deep_ready[rows] = True
+
+    def summary(self):
+        return (f"context {self.context_hits} hits / {self.context_misses} misses, "
+                f"deep {self.deep_hits} hits / {self.deep_misses} misses")
+
+
+def parse_block_spec(spec):
+    """"20" -> 20 (first 20 blocks); "0-29,40,50" -> [0, ..., 29, 40, 50]."""
+    if spec.isdigit():
+        return int(spec)
+    indices = []
+    for part in spec.split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            indices.extend(range(int(start), int(end) + 1))
+        else:
+            indices.append(int(part))
+    return indices
+
+
+# ================= PLACEHOLDER RENDERER =================
+
+# Gradient color pairs per asset for placeholder mode
+PLACEHOLDER_COLORS = {
+    "habit_rest": [(139, 92, 246), (88, 28, 135)],
+    "habit_hydrate": [(34, 211, 238), (6, 95, 124)],
+    "habit_move": [(52, 211, 153), (4, 120, 87)],
+    "habit_nourish": [(163, 230, 53), (22, 101, 52)],
+    "habit_calm": [(249, 168, 212), (131, 24, 67)],
+    "habit_connect": [(251, 146, 60), (154, 52, 18)],
+    "habit_unplug": [(148, 163, 184), (51, 65, 85)],
+    "badge_streak_7": [(217, 119, 6), (120, 53, 15)],
+    "badge_streak_30": [(203, 213, 225), (100, 116, 139)],
+    "badge_streak_100": [(251, 191, 36), (180, 83, 9)],
+    "badge_first_habit": [(34, 211, 238), (6, 95, 124)],
+    "badge_perfect_week": [(52, 211, 153), (4, 120, 87)],
+    "badge_early_bird": [(251, 146, 60), (180, 83, 9)],
+    "badge_night_owl": [(139, 92, 246), (30, 27, 75)],
+    "badge_comeback": [(239, 68, 68), (153, 27, 27)],
+    "coach_sam": [(139, 92, 246), (88, 28, 135)],
+    "coach_alex": [(52, 211, 153), (4, 120, 87)],
+    "coach_dana": [(249, 168, 212), (131, 24, 67)],
+    "coach_grace": [(163, 230, 53), (120, 80, 20)],
+    "bg_dashboard": [(240, 253, 250), (204, 251, 241)],
+    "bg_insights": [(250, 245, 255), (233, 213, 255)],
+    "bg_settings": [(248, 250, 252), (226, 232, 240)],
+    "bg_profile": [(255, 251, 235), (254, 243, 199)],
+}
+PLACEHOLDER_DEFAULT_COLORS = [(128, 128, 128), (64, 64, 64)]
+
+@functools.lru_cache(maxsize=None)
+def _circle_spans(diameter):
+    """
+    Row spans of the circle ImageDraw rasterizes in a diameter-pixel box.
+
+    Follows Pillow's ellipse tracer: in doubled coordinates it walks one
+    quarter from (diameter, 0) to (0, diameter), at each step taking the
+    neighbour that best fits the ellipse equation. Returns (outer, inner)
+    arrays indexed by row offset from the centre: the largest and smallest
+    column offsets visited on that row. A fill covers |dx| <= outer[dy]; an
+    outline leaves |dx| < inner[dy] of its inner ellipse unpainted.
+    """
+    a = diameter
+    a2 = a * a
+    x, y = a, 0
+    outer = np.full(a // 2 + 1, -1, dtype=np.int64)
+    inner = np.full(a // 2 + 1, -1, dtype=np.int64)
+    while True:
+        row = y // 2
+        outer[row] = max(outer[row], x // 2)
+        inner[row] = x // 2
+        if x == 0 and y == a:
+            break
+        steps = []
+        if x > 0:
+            steps.append((x - 2, y))
+        if y < a:
+            steps.append((x, y + 2))
+        if x > 0 and y < a:
+            steps.append((x - 2, y + 2))
+        x, y = min(steps, key=lambda p: abs(a2 * p[1] * p[1] + a2 * p[0] * p[0] - a2 * a2))
+    return outer, inner
+
+
+def _disc(dx, dy, r):
+    """Pixels of ImageDraw's filled circle of radius r, from offsets to its centre."""
+    if r < 1:
+        return np.zeros(np.broadcast(dx, dy).shape, dtype=bool)
+    outer, _ = _circle_spans(2 * r)
+    return (dy <= r) & (dx <= outer[np.minimum(dy, r)])
+
+
+def _ring(dx, dy, r, width):
+    """Pixels of ImageDraw's circle outline of radius r and the given width."""
+    inner_r = r - (width - 1)
+    _, inner = _circle_spans(2 * inner_r)
+    hole = (dy < inner_r) & (dx < inner[np.minimum(dy, inner_r)])
+    return _disc(dx, dy, r) & ~hole
+
+
+@functools.lru_cache(maxsize=None)
+def _covering_radius(max_radius):
+    """
+    [dy, dx] -> smallest radius in 1..max_radius whose ImageDraw circle
+    covers that offset, or max_radius + 1 if none does. Spans grow with the
+    radius, so this is 1 + the number of radii whose row span stops short.
+    """
+    spans = np.stack([np.pad(_circle_spans(2 * r)[0], (0, max_radius - r), constant_values=-1)
+                      for r in range(1, max_radius + 1)])
+    offsets = np.arange(max_radius + 1)
+    return 1 + (spans[:, :, None] < offsets[None, None, :]).sum(0)
+
+
+def create_icon(config, colors, scale=1):
+    """
+    Glassmorphic gradient disc icon, rendered as one NumPy array program.
+
+    Same pixels as drawing ~115 concentric ImageDraw ellipses from the
+    outside in: ImageDraw on RGBA replaces pixels rather than blending, so
+    each pixel takes the colour of the smallest circle covering it. That
+    radius indexes a per-radius colour/alpha table; the rings and the inner
+    glow then overwrite their pixels the same way. scale multiplies the
+    size and the ring spacing, for supersampled rendering.
+    """
+    width, height = config['width'] * scale, config['height'] * scale
+    center_x, center_y = width // 2, height // 2
+    max_radius = int(width * 0.45)
+
+    dy, dx = np.ogrid[:height, :width]
+    dy, dx = np.abs(dy - center_y), np.abs(dx - center_x)
+
+    # Colour table indexed by radius, with the same float math and truncation as the drawn version
+    ratio = np.arange(max_radius + 1) / max_radius
+    c0, c1 = np.array(colors[0], dtype=np.float64), np.array(colors[1], dtype=np.float64)
+    lut = np.zeros((max_radius + 2, 4), dtype=np.uint8)
+    lut[:max_radius + 1, :3] = (c0 * ratio[:, None] + c1 * (1 - ratio[:, None])).astype(np.uint8)
+    lut[:max_radius + 1, 3] = (255 * (0.7 + 0.3 * ratio)).astype(np.uint8)
+
+    # Gradient circle
+    near = (dy <= max_radius) & (dx <= max_radius)
+    radius = np.where(near, _covering_radius(max_radius)[np.minimum(dy, max_radius), np.minimum(dx, max_radius)],
+                      max_radius + 1)
+    pixels = lut[radius]
+
+    # Glassmorphic rings
+    for i in range(3):
+        r = max_radius - (5 + i * 12) * scale
+        pixels[_ring(dx, dy, r, 2 * scale)] = (255, 255, 255, 120 - i * 30)
+
+    # Inner glow
+    pixels[_disc(dx, dy, int(max_radius * 0.6))] = (255, 255, 255, 30)
+
+    return Image.fromarray(pixels, 'RGBA')
+
+
+def create_background(config, colors, seed=SEED):
+    """
+    Vertical gradient background with soft glass circles, as NumPy broadcasts.
+
+    The gradient is one row-colour table broadcast across the width. The
+    circles take the same random draws as before and overwrite their pixels
+    (ImageDraw replace semantics), each only within its bounding box.
+    """
+    import random
+
+    width, height = config['width'], config['height']
+
+    # Vertical gradient
+    ratio = np.arange(height) / height
+    c0, c1 = np.array(colors[0], dtype=np.float64), np.array(colors[1], dtype=np.float64)
+    rows = (c0 * (1 - ratio[:, None]) + c1 * ratio[:, None]).astype(np.uint8)
+    pixels = np.empty((height, width, 4), dtype=np.uint8)
+    pixels[..., :3] = rows[:, None, :]
+    pixels[..., 3] = 255
+
+    # Glassmorphic circles
+    rng = random.Random(stable_seed(config['filename'], seed))
+    for _ in range(5):
+        cx = rng.randint(0, width)
+        cy = rng.randint(0, height)
+        r = rng.randint(100, 300)
+        alpha = rng.randint(10, 30)
+        top, bottom = max(cy - r, 0), min(cy + r + 1, height)
+        left, right = max(cx - r, 0), min(cx + r + 1, width)
+        if top >= bottom or left >= right:
+            continue
+        dy, dx = np.ogrid[top:bottom, left:right]
+        inside = _disc(np.abs(dx - cx), np.abs(dy - cy), r)
+        pixels[top:bottom, left:right][inside] = (255, 255, 255, alpha)
+
+    return Image.fromarray(pixels, 'RGBA')
+
+
+def render_placeholder(name, config, seed=SEED, scale=1):
+    """Placeholder image for one asset; scale enlarges icons only."""
+    colors = PLACEHOLDER_COLORS.get(name, PLACEHOLDER_DEFAULT_COLORS)
+    if name.startswith('bg_'):
+        return create_background(config, colors, seed)
+    return create_icon(config, colors, scale)
+
+
+def placeholder_outputs(name, config, seed=SEED, densities=None):
+    """
+    Render a placeholder and return the (path, image) pairs to write.
+
+    Backgrounds and, with no densities, icons go to OUTPUT_DIR as rendered.
+    Otherwise the icon is drawn at ICON_SUPERSAMPLE times its
+    ICON_SOURCE_DENSITY size and resampled with Lanczos into the sibling
+    drawable-<bucket> folder of each bucket, xxxhdpi included, so none of
+    them keeps the renderer's hard edges. Writing either layout deletes the
+    asset's copy in the other (see asset_pipeline.remove_stale_siblings), so
+    the AI runs, which write drawable/, are not hidden by older bucket copies.
+    """
+    filename = config['filename']
+    if not densities or name.startswith('bg_'):
+        return [(OUTPUT_DIR / filename, render_placeholder(name, config, seed))]
+
+    img = render_placeholder(name, config, seed, scale=ICON_SUPERSAMPLE)
+    source = DENSITY_BUCKETS[ICON_SOURCE_DENSITY]
+    outputs = []
+    for bucket in densities:
+        scale = DENSITY_BUCKETS[bucket] / source
+        size = (max(1, round(config['width'] * scale)), max(1, round(config['height'] * scale)))
+        outputs.append((OUTPUT_DIR.parent / f"drawable-{bucket}" / filename, img.resize(size, Image.LANCZOS)))
+    return outputs
+
+
+def parse_densities(spec):
+    """--densities value: comma-separated buckets, 'all', or 'none' for a single drawable/ copy."""
+    if spec == "all":
+        return list(DENSITY_BUCKETS)
+    if spec == "none":
+        return []
+    buckets = [b.strip() for b in spec.split(",") if b.strip()]
+    unknown = [b for b in buckets if b not in DENSITY_BUCKETS]
+    if unknown:
+        import argparse
+        raise argparse.ArgumentTypeError(f"unknown density {', '.join(unknown)} (choose from {', '.join(DENSITY_BUCKETS)})")
+    return buckets
+
+
+def draw_icon_pil(config, colors):
+    """Reference ImageDraw version of create_icon, kept for the pixel-diff self check."""
+    from PIL import ImageDraw
+
+    width = config['width']
+    height = config['height']
+
+    img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+
+    center_x, center_y = width // 2, height // 2
+    max_radius = int(width * 0.45)
+
+    # Gradient circle
+    for r in range(max_radius, 0, -1):
+        ratio = r / max_radius
+        color = tuple(int(colors[0][i] * ratio + colors[1][i] * (1 - ratio)) for i in range(3))
+        alpha = int(255 * (0.7 + 0.3 * ratio))
+        draw.ellipse([center_x - r, center_y - r, center_x + r, center_y + r], fill=(*color, alpha))
+
+    # Glassmorphic rings
+    for i in range(3):
+        r = max_radius - 5 - i * 12
+        alpha = 120 - i * 30
+        draw.ellipse([center_x - r, center_y - r, center_x + r, center_y + r], outline=(255, 255, 255, alpha), width=2)
+
+    # Inner glow
+    inner_r = int(max_radius * 0.6)
+    draw.ellipse([center_x - inner_r, center_y - inner_r, center_x + inner_r, center_y + inner_r], fill=(255, 255, 255, 30))
 
     return img
 
 
-def latent_to_image(latent, vae_sd):
-    """Convert latent tensor to PIL image."""
-    with torch.no_grad():
-        img = decode_vae_simple(latent, vae_sd)
+def draw_background_pil(config, colors, seed=SEED):
+    """Reference ImageDraw version of create_background, kept for the pixel-diff self check."""
+    from PIL import ImageDraw
+    import random
+
+    width = config['width']
+    height = config['height']
+
+    img = Image.new('RGBA', (width, height), (255, 255, 255, 255))
+    draw = ImageDraw.Draw(img)
 
-    # Convert to numpy
-    img = img[0].permute(1, 2, 0).cpu().float().numpy()
-    img = (img * 255).astype(np.uint8)
+    # Vertical gradient
+    for y in range(height):
+        ratio = y / height
+        color = tuple(int(colors[0][i] * (1 - ratio) + colors[1][i] * ratio) for i in range(3))
+        draw.line([(0, y), (width, y)], fill=(*color, 255))
 
-    return Image.fromarray(img)
+    # Glassmorphic circles
+    rng = random.Random(stable_seed(config['filename'], seed))
+    for _ in range(5):
+        x = rng.randint(0, width)
+        y = rng.randint(0, height)
+        r = rng.randint(100, 300)
+        alpha = rng.randint(10, 30)
+        draw.ellipse([x - r, y - r, x + r, y + r], fill=(255, 255, 255, alpha))
+
+    return img
 
 
 # ================= MAIN GENERATION =================
 
-def apply_transformer_block(x, context, timestep_emb, block_idx, transformer_sd, device, dtype):
-    """Apply a single transformer block using state dict weights."""
-    # Keys have model.diffusion_model. prefix
-    prefix = f"model.diffusion_model.transformer_blocks.{block_idx}."
+def scaled_dot_product_attention(q, k, v, chunk_size=None):
+    """
+    F.scaled_dot_product_attention over [B, heads, seq, head_dim] tensors.
 
-    def get_weight(name):
-        key = prefix + name
-        if key in transformer_sd:
-            return transformer_sd[key].to(device=device, dtype=dtype)
-        return None
+    With chunk_size set, queries are processed chunk_size at a time against
+    the full keys and values, so the attention matrix never exceeds
+    chunk_size x seq per head whichever kernel PyTorch picks.
+    """
+    if chunk_size is None or q.shape[2] <= chunk_size:
+        return F.scaled_dot_product_attention(q, k, v)
+    out = torch.empty_like(q)
+    for start in range(0, q.shape[2], chunk_size):
+        out[:, :, start:start + chunk_size] = F.scaled_dot_product_attention(q[:, :, start:start + chunk_size], k, v)
+    return out
 
-    # Get modulation parameters
-    img_mod_w = get_weight("img_mod.1.weight")
-    img_mod_b = get_weight("img_mod.1.bias")
 
-    if img_mod_w is None:
-        return x  # Skip if weights not found
+def joint_attention(img, txt, weights, chunk_size=None):
+    """
+    Joint image/text attention of a Qwen-Image block.
+
+    Each stream projects Q, K and V with one fused matmul, normalizes Q and K
+    per head, and both streams attend over the concatenated [txt, img]
+    sequence. Returns (img_out, txt_out); txt_out is None without text.
+    """
+    norm_q = weights.get("attn.norm_q")
+    head_dim = norm_q.weight.shape[0] if norm_q is not None else ATTENTION_HEAD_DIM
+    heads = img.shape[-1] // head_dim
+
+    def project(h, name, q_norm, k_norm):
+        qkv = F.linear(h, weights[f"{name}.weight"], weights.get(f"{name}.bias"))
+        q, k, v = qkv.unflatten(-1, (3, heads, head_dim)).unbind(2)
+        if q_norm is not None:
+            q = q_norm(q)
+        if k_norm is not None:
+            k = k_norm(k)
+        return q, k, v
+
+    q, k, v = project(img, "attn.to_qkv", norm_q, weights.get("attn.norm_k"))
+
+    txt_len = 0
+    if txt is not None and "attn.add_qkv_proj.weight" in weights:
+        txt_q, txt_k, txt_v = project(txt, "attn.add_qkv_proj", weights.get("attn.norm_added_q"), weights.get("attn.norm_added_k"))
+        txt_len = txt.shape[1]
+        q = torch.cat([txt_q, q], dim=1)
+        k = torch.cat([txt_k, k], dim=1)
+        v = torch.cat([txt_v, v], dim=1)
+
+    # [B, seq, heads, head_dim] -> [B, heads, seq, head_dim]
+    out = scaled_dot_product_attention(q.transpose(1, 2), k.transpose(1, 2), v.transpose(1, 2), chunk_size)
+    out = out.transpose(1, 2).flatten(2)
+
+    img_out = F.linear(out[:, txt_len:], weights["attn.to_out.0.weight"], weights.get("attn.to_out.0.bias"))
+    txt_out = None
+    if txt_len:
+        txt_out = F.linear(out[:, :txt_len], weights["attn.to_add_out.weight"], weights.get("attn.to_add_out.bias"))
+    return img_out, txt_out
+
+
+def _mlp(h, weights, prefix):
+    w1 = weights.get(f"{prefix}.net.0.proj.weight")
+    if w1 is None:
+        return h
+    h = F.linear(h, w1, weights.get(f"{prefix}.net.0.proj.bias"))
+    h = F.gelu(h, approximate='tanh')
+    return F.linear(h, weights[f"{prefix}.net.2.weight"], weights.get(f"{prefix}.net.2.bias"))
 
-    # Apply modulation
-    mod = F.silu(timestep_emb)
-    mod = F.linear(mod, img_mod_w, img_mod_b)
+
+def _modulation(timestep_emb, weights, prefix):
+    """(shift, scale, gate, shift2, scale2, gate2), each [B, 1, dim]."""
+    mod = F.linear(F.silu(timestep_emb), weights[f"{prefix}.1.weight"], weights.get(f"{prefix}.1.bias"))
+    return [m.unsqueeze(1) for m in mod.chunk(6, dim=-1)]
+
+
+def apply_transformer_block(x, context, timestep_emb, weights, attn_chunk=ATTENTION_CHUNK_TOKENS):
+    """
+    Apply a single transformer block using resolved block weights.
+
+    x is the image token stream and context the projected text stream (or
+    None). Returns the updated (x, context).
+    """
+    if weights.get("img_mod.1.weight") is None:
+        return x, context  # Skip if weights not found
 
     # Split into shift, scale, gate (6 * dim)
-    shift, scale, gate, shift2, scale2, gate2 = mod.chunk(6, dim=-1)
+    shift, scale, gate, shift2, scale2, gate2 = _modulation(timestep_emb, weights, "img_mod")
+    h = F.layer_norm(x, x.shape[-1:])
+    h = h * (1 + scale) + shift
 
-    # Simplified attention - just normalize and scale
-    h = x
-    # Apply layer norm (approximate with normalization)
-    h = F.layer_norm(h, h.shape[-1:])
-    h = h * (1 + scale.unsqueeze(1)) + shift.unsqueeze(1)
+    c = None
+    has_txt = context is not None and "txt_mod.1.weight" in weights
+    if has_txt:
+        t_shift, t_scale, t_gate, t_shift2, t_scale2, t_gate2 = _modulation(timestep_emb, weights, "txt_mod")
+        c = F.layer_norm(context, context.shape[-1:])
+        c = c * (1 + t_scale) + t_shift
 
-    # Skip actual attention computation for speed
-    # In full implementation, would do: Q, K, V projection, attention, output projection
+    if "attn.to_qkv.weight" in weights:
+        h, c = joint_attention(h, c, weights, attn_chunk)
+        if c is not None:
+            context = context + t_gate * c
+    # Without attention weights the modulated input stands in for the attention output
 
     # Apply gate
-    x = x + gate.unsqueeze(1) * h
+    x = x + gate * h
 
     # MLP
     h = F.layer_norm(x, x.shape[-1:])
-    h = h * (1 + scale2.unsqueeze(1)) + shift2.unsqueeze(1)
+    h = h * (1 + scale2) + shift2
+    x = x + gate2 * _mlp(h, weights, "img_mlp")
 
-    # Get MLP weights
-    mlp_w1 = get_weight("img_mlp.net.0.proj.weight")
-    mlp_b1 = get_weight("img_mlp.net.0.proj.bias")
-    mlp_w2 = get_weight("img_mlp.net.2.weight")
-    mlp_b2 = get_weight("img_mlp.net.2.bias")
+    if has_txt:
+        c = F.layer_norm(context, context.shape[-1:])
+        c = c * (1 + t_scale2) + t_shift2
+        context = context + t_gate2 * _mlp(c, weights, "txt_mlp")
 
-    if mlp_w1 is not None:
-        h = F.linear(h, mlp_w1, mlp_b1)
-        h = F.gelu(h, approximate='tanh')
-        h = F.linear(h, mlp_w2, mlp_b2)
+    return x, context
 
-    x = x + gate2.unsqueeze(1) * h
-
-    return x
 
+def run_transformer(latent, timestep, context, plan, num_blocks=None, speed=None, cache=None, temb=None):
+    """
+    Run the transformer denoising step.
 
-def run_transformer(latent, timestep, context, transformer_sd, num_blocks=60):
-    """Run the transformer denoising step."""
-    device = latent.device
-    dtype = torch.bfloat16
+    num_blocks limits the stack to its first blocks (None runs all of them);
+    speed is a SpeedMode that can further skip or reuse blocks, and cache an
+    ActivationCache shared by the steps of one generation. temb is the
+    timestep embedding from a FlowSchedule table; it is computed from
+    timestep when not given.
+    """
+    if not isinstance(plan, BlockWeightPlan):
+        plan = BlockWeightPlan(plan, latent.device)
 
     batch, ch, orig_h, orig_w = latent.shape
 
@@ -480,70 +1665,73 @@ def run_transformer(latent, timestep, context, transformer_sd, num_blocks=60):
     x = latent.reshape(batch, ch, h // 2, 2, w // 2, 2)
     x = x.permute(0, 2, 4, 1, 3, 5).reshape(batch, (h // 2) * (w // 2), ch * 4)
 
-    # Keys have model.diffusion_model. prefix
-    prefix = "model.diffusion_model."
-
     # Get input projection
-    img_in_w = transformer_sd.get(prefix + "img_in.weight")
-    img_in_b = transformer_sd.get(prefix + "img_in.bias")
-
+    img_in_w = plan.get("img_in.weight")
     if img_in_w is not None:
-        img_in_w = img_in_w.to(device=device, dtype=dtype)
-        img_in_b = img_in_b.to(device=device, dtype=dtype) if img_in_b is not None else None
-        x = F.linear(x, img_in_w, img_in_b)
+        x = F.linear(x, img_in_w, plan.get("img_in.bias"))
 
-    # Get timestep embedding
-    t_emb_w1 = transformer_sd.get(prefix + "time_text_embed.timestep_embedder.linear_1.weight")
-    t_emb_b1 = transformer_sd.get(prefix + "time_text_embed.timestep_embedder.linear_1.bias")
-    t_emb_w2 = transformer_sd.get(prefix + "time_text_embed.timestep_embedder.linear_2.weight")
-    t_emb_b2 = transformer_sd.get(prefix + "time_text_embed.timestep_embedder.linear_2.bias")
+    # Project text embeddings into the transformer width
+    txt_in_w = plan.get("txt_in.weight")
+    if context is not None and txt_in_w is not None:
+        def project(c):
+            if plan.get("txt_norm") is not None:
+                c = plan.get("txt_norm")(c)
+            return F.linear(c, txt_in_w, plan.get("txt_in.bias"))
 
-    # Create sinusoidal embedding for timestep
-    half_dim = 128
-    emb = math.log(10000) / (half_dim - 1)
-    emb = torch.exp(torch.arange(half_dim, device=device, dtype=torch.float32) * -emb)
-    emb = timestep[:, None] * emb[None, :]
-    emb = torch.cat([torch.sin(emb), torch.cos(emb)], dim=-1).to(dtype)
-
-    if t_emb_w1 is not None:
-        t_emb_w1 = t_emb_w1.to(device=device, dtype=dtype)
-        t_emb_b1 = t_emb_b1.to(device=device, dtype=dtype) if t_emb_b1 is not None else None
-        t_emb_w2 = t_emb_w2.to(device=device, dtype=dtype)
-        t_emb_b2 = t_emb_b2.to(device=device, dtype=dtype) if t_emb_b2 is not None else None
-
-        temb = F.linear(emb, t_emb_w1, t_emb_b1)
-        temb = F.silu(temb)
-        temb = F.linear(temb, t_emb_w2, t_emb_b2)
-    else:
-        temb = emb
+        context = cache.project_context(context, project) if cache is not None else project(context)
 
-    # Run through transformer blocks (use fewer for speed)
-    blocks_to_run = min(num_blocks, 10)  # Run first 10 blocks for speed
-    for i in range(blocks_to_run):
-        x = apply_transformer_block(x, context, temb, i, transformer_sd, device, dtype)
+    # Get timestep embedding
+    if temb is None:
+        temb = timestep_embedding(timestep, plan)
+
+    # Run through transformer blocks
+    speed = speed or SpeedMode()
+    num_total = plan.num_blocks if num_blocks is None else min(num_blocks, plan.num_blocks)
+    indices = speed.block_indices(num_total)
+    x_in = x
+    x, rows = speed.reuse(x, num_total)
+    if len(rows):
+        # Only the items that cannot reuse their cached output run the blocks
+        ran_rows = rows
+        hidden = x[rows]
+        ctx = context[rows] if context is not None else None
+        t = temb[rows] if temb.shape[0] == batch > 1 else temb
+        split = cache.deep_split(indices) if cache is not None else len(indices)
+        evaluated = 0
+        for j, i in enumerate(indices):
+            if j == split:
+                hidden, run = cache.reuse_deep(hidden, rows, batch)
+                x = x.index_copy(0, rows, hidden)
+                if not len(run):
+                    break
+                rows, hidden = rows[run], hidden[run]
+                ctx = ctx[run] if ctx is not None else None
+                t = t[run] if t.shape[0] > 1 else t
+                deep_in = hidden
+            weights = plan.block(i, prefetch=indices[(j + 1) % len(indices)])
+            hidden, ctx = apply_transformer_block(hidden, ctx, t, weights)
+            evaluated += len(rows)
+        else:
+            x = x.index_copy(0, rows, hidden)
+            if split < len(indices):
+                cache.store_deep(deep_in, hidden, rows, batch)
+        speed.record(x_in, x, ran_rows, evaluated, num_total)
 
     # Output projection
-    norm_out_w = transformer_sd.get(prefix + "norm_out.linear.weight")
-    norm_out_b = transformer_sd.get(prefix + "norm_out.linear.bias")
-    proj_out_w = transformer_sd.get(prefix + "proj_out.weight")
-    proj_out_b = transformer_sd.get(prefix + "proj_out.bias")
+    norm_out_w = plan.get("norm_out.linear.weight")
+    proj_out_w = plan.get("proj_out.weight")
 
     if norm_out_w is not None:
-        norm_out_w = norm_out_w.to(device=device, dtype=dtype)
-        norm_out_b = norm_out_b.to(device=device, dtype=dtype) if norm_out_b is not None else None
-
         # Final modulation
         mod = F.silu(temb)
-        mod = F.linear(mod, norm_out_w, norm_out_b)
+        mod = F.linear(mod, norm_out_w, plan.get("norm_out.linear.bias"))
         scale, shift = mod.chunk(2, dim=-1)
 
         x = F.layer_norm(x, x.shape[-1:])
         x = x * (1 + scale.unsqueeze(1)) + shift.unsqueeze(1)
 
     if proj_out_w is not None:
-        proj_out_w = proj_out_w.to(device=device, dtype=dtype)
-        proj_out_b = proj_out_b.to(device=device, dtype=dtype) if proj_out_b is not None else None
-        x = F.linear(x, proj_out_w, proj_out_b)
+        x = F.linear(x, proj_out_w, plan.get("proj_out.bias"))
 
     # Unpatchify: reshape back to image
     # [B, (H/2)*(W/2), C*4] -> [B, C, H, W]
@@ -557,69 +1745,132 @@ def run_transformer(latent, timestep, context, transformer_sd, num_blocks=60):
     return x
 
 
-def generate_with_ai(prompt, width, height, transformer_sd, vae_sd, text_encoder_sd, steps=20, cfg_scale=7.0, seed=None):
+def encode_prompt(prompt, device, dtype=torch.bfloat16, hidden_dim=TEXT_HIDDEN_DIM):
     """
-    Generate an image using Qwen-Image model with actual transformer inference.
+    Dummy prompt encoding (proper implementation would run the text encoder).
+
+    Context shape: [batch, seq_len, hidden_dim=3584]
     """
-    if seed is not None:
-        torch.manual_seed(seed)
+    # Simple prompt encoding approximation: hash prompt to create pattern
+    generator = torch.Generator(device=device)
+    generator.manual_seed(stable_seed(prompt))
+    context = torch.randn(1, 77, hidden_dim, generator=generator, device=device)
+    return (context * 0.1).to(dtype)
 
-    device = "cuda"
+
+def pick_batch_size(width, height, plan, cfg=True):
+    """
+    How many same-size assets fit in one forward pass.
+
+    Estimates activation memory per item from the token count and hidden size
+    and fits as many items as VRAM_LIMIT_GB leaves room for after the weights.
+    """
+    hidden = plan.get("img_in.weight").shape[0] if plan.get("img_in.weight") is not None else 3072
+    tokens = (height // VAE_SCALE_FACTOR // PATCH_SIZE) * (width // VAE_SCALE_FACTOR // PATCH_SIZE) + 77
+    per_item = tokens * hidden * 2 * ACTIVATION_FACTOR * (2 if cfg else 1)
+    if plan.device.type != "cuda":
+        return MAX_BATCH_SIZE
+    free = VRAM_LIMIT_GB * (1024**3) - torch.cuda.memory_allocated(plan.device)
+    return max(1, min(MAX_BATCH_SIZE, int(free // per_item)))
+
+
+def batch_assets(assets, plan, cfg=True):
+    """Group asset names by (width, height) into batches that fit in memory."""
+    groups = {}
+    for name, config in assets.items():
+        groups.setdefault((config['width'], config['height']), []).append(name)
+
+    batches = []
+    for (width, height), names in groups.items():
+        size = pick_batch_size(width, height, plan, cfg)
+        for i in range(0, len(names), size):
+            batches.append(names[i:i + size])
+    return batches
+
+
+def generate_batch(prompts, width, height, plan, vae, text_encoder_sd, steps=20, cfg_scale=7.0, seeds=None,
+                   negative_prompts=None, cfg_off_last_steps=0, cfg_min_sigma=0.0, num_blocks=None, speed=None,
+                   deep_cache_from=None, schedule_kind="linear", shift=1.0, sampler="euler"):
+    """
+    Generate several same-size images in one batched sampling run.
+
+    Each item draws its noise from its own generator seeded with its seed,
+    so an image does not depend on which other assets share its batch.
+    Returns one PIL image per prompt, in order.
+    """
+    speed = speed or SpeedMode()
+    speed.reset()
+    cache = ActivationCache(deep_from=deep_cache_from)
+    start = time.perf_counter()
+    device = plan.device
     dtype = torch.bfloat16
+    count = len(prompts)
+    seeds = seeds if seeds is not None else [None] * count
+    negative_prompts = negative_prompts if negative_prompts is not None else [""] * count
 
     # Calculate latent size
     latent_h = height // VAE_SCALE_FACTOR
     latent_w = width // VAE_SCALE_FACTOR
 
-    print(f"  Generating {width}x{height} (latent: {latent_w}x{latent_h})")
+    print(f"  Generating {count}x {width}x{height} (latent: {latent_w}x{latent_h})")
 
     # Start with random noise
-    latent = torch.randn(1, LATENT_CHANNELS, latent_h, latent_w, device=device, dtype=dtype)
-
-    # Create sigma schedule (1.0 -> 0.0) - flow matching schedule
-    sigmas = torch.linspace(1.0, 0.0, steps + 1, device=device)
-
-    # Dummy context (proper implementation would encode the prompt)
-    # Context shape: [batch, seq_len, hidden_dim=3584]
-    context = torch.zeros(1, 77, 3584, device=device, dtype=dtype)
-
-    # Simple prompt encoding approximation: hash prompt to create pattern
-    prompt_hash = hash(prompt)
-    torch.manual_seed(prompt_hash % 2**32)
-    context = torch.randn_like(context) * 0.1
-
-    # Reset seed for generation
-    if seed is not None:
-        torch.manual_seed(seed)
-
-    # Euler flow matching sampling
+    noise = []
+    for seed in seeds:
+        generator = None
+        if seed is not None:
+            generator = torch.Generator(device=device)
+            generator.manual_seed(seed)
+        noise.append(torch.randn(1, LATENT_CHANNELS, latent_h, latent_w, generator=generator, device=device, dtype=dtype))
+    latent = torch.cat(noise)
+
+    # Sigma schedule (1.0 -> 0.0) with its timestep embeddings, shared across assets
+    schedule = get_schedule(steps, schedule_kind, shift, device)
+    temb = schedule.temb(plan)
+
+    context = torch.cat([encode_prompt(p, device, dtype, plan.context_dim) for p in prompts])
+    uncond_context = None
+    if cfg_scale != 1.0:
+        uncond_context = torch.cat([encode_prompt(p, device, dtype, plan.context_dim) for p in negative_prompts])
+
+    def model_fn(x, i, ctx):
+        return run_transformer(x, schedule.timesteps[i:i + 1], ctx, plan, num_blocks=num_blocks, speed=speed,
+                               cache=cache, temb=temb[i:i + 1])
+
+    # Flow matching sampling
     with torch.no_grad():
-        for i in range(len(sigmas) - 1):
-            sigma = sigmas[i]
-            sigma_next = sigmas[i + 1]
-
-            # Current timestep (sigma as timestep)
-            t = sigma.unsqueeze(0) * 1000  # Scale to typical timestep range
-
-            # Get model prediction (velocity)
-            with torch.cuda.amp.autocast(dtype=dtype):
-                v = run_transformer(latent, t, context, transformer_sd, num_blocks=60)
+        latent = SAMPLERS[sampler](model_fn, latent, schedule.sigmas, context, uncond_context, cfg_scale,
+                                   cfg_off_last_steps=cfg_off_last_steps, cfg_min_sigma=cfg_min_sigma)
 
-            # Euler step: x_{t-dt} = x_t - v * dt
-            dt = sigma - sigma_next
-            latent = latent - v * dt
-
-            if (i + 1) % 5 == 0:
-                print(f"  Step {i+1}/{steps}, sigma={sigma:.4f}")
+    print(f"  Sampled in {time.perf_counter() - start:.1f}s, {cache.summary()}")
+    if speed.mode != "full" or deep_cache_from is not None:
+        print(f"  Blocks ({speed.mode}): {speed.evaluated} evaluated, {speed.saved} saved over the batch")
 
     # Decode to image
     print("  Decoding VAE...")
-    image = latent_to_image(latent, vae_sd)
+    return [latent_to_image(latent[i:i + 1], vae) for i in range(count)]
+
 
-    return image
+def generate_with_ai(prompt, width, height, plan, vae, text_encoder_sd, steps=20, cfg_scale=7.0, seed=None,
+                     negative_prompt="", cfg_off_last_steps=0, cfg_min_sigma=0.0, num_blocks=None, speed=None,
+                     deep_cache_from=None, schedule_kind="linear", shift=1.0, sampler="euler"):
+    """
+    Generate an image using Qwen-Image model with actual transformer inference.
+
+    plan is a BlockWeightPlan and vae a VAEDecoder, both built once per run
+    and shared by every asset.
+    Guidance runs the prompt and negative_prompt as one batch-2 forward per
+    step; cfg_off_last_steps and cfg_min_sigma switch it off near the end.
+    """
+    images = generate_batch([prompt], width, height, plan, vae, text_encoder_sd, steps=steps, cfg_scale=cfg_scale,
+                            seeds=[seed], negative_prompts=[negative_prompt],
+                            cfg_off_last_steps=cfg_off_last_steps, cfg_min_sigma=cfg_min_sigma,
+                            num_blocks=num_blocks, speed=speed, deep_cache_from=deep_cache_from,
+                            schedule_kind=schedule_kind, shift=shift, sampler=sampler)
+    return images[0]
 
 
-def test_loading():
+def test_loading(stream=False):
     """Test that models load correctly to VRAM using safetensors."""
     print("\n" + "=" * 60)
     print("Testing Direct VRAM Loading (safetensors)")
@@ -638,15 +1889,25 @@ def test_loading():
 
     try:
         # Load transformer directly to CUDA
-        print(f"\nLoading transformer to VRAM...")
-        transformer_sd = load_file(str(TRANSFORMER_PATH), device="cuda")
+        print(f"\nLoading transformer to VRAM{' (streaming)' if stream else ''}...")
+        transformer_sd = load_transformer("cuda", stream=stream)
         print(f"  Loaded {len(transformer_sd)} tensors")
         print(f"  VRAM: {get_vram_usage():.2f}GB")
 
+        if stream:
+            plan = BlockWeightPlan(transformer_sd, "cuda", budget_bytes=0)
+            plan.block(0, prefetch=1)
+            print(f"  Block 0 streamed: {transformer_sd.bytes_read / (1024**3):.2f}GB read")
+            print(f"  VRAM: {get_vram_usage():.2f}GB")
+            del plan
+            transformer_sd.close()
+
         # Load VAE
         print(f"\nLoading VAE to VRAM...")
         vae_sd = load_file(str(VAE_PATH), device="cuda")
         print(f"  Loaded {len(vae_sd)} tensors")
+        vae = VAEDecoder(vae_sd, "cuda")
+        print(f"  Decoder: {len(vae.weights)} tensors, {len(vae.up_blocks)} up blocks, {vae.scale_factor}x upscale")
         print(f"  VRAM: {get_vram_usage():.2f}GB")
 
         print(f"\n{'='*60}")
@@ -655,7 +1916,7 @@ def test_loading():
         print("=" * 60)
 
         # Cleanup
-        del transformer_sd, vae_sd
+        del transformer_sd, vae_sd, vae
         cleanup()
 
         return True
@@ -667,13 +1928,86 @@ def test_loading():
         return False
 
 
-def generate_all():
-    """Generate all assets using AI."""
+def inspect_model(path=None):
+    """Summarize a safetensors file from its header only, without loading tensors."""
+    path = Path(path) if path else TRANSFORMER_PATH
+    if not path.exists():
+        print(f"[ERROR] Missing: {path}")
+        return False
+    print_safetensors_summary(summarize_safetensors(path, strip_prefix=TRANSFORMER_PREFIX))
+    return True
+
+
+def model_digest():
+    """Identity of the model files for cache keys, from their safetensors headers."""
+    paths = [TRANSFORMER_PATH, VAE_PATH] + ([TEXT_ENCODER_PATH] if TEXT_ENCODER_PATH.exists() else [])
+    return {path.name: safetensors_header_digest(path) for path in paths}
+
+
+def asset_cache_key(name, seed, steps, sampler, schedule_kind, shift, speed, deep_cache_from, model, encoding,
+                    vae_tile=VAE_TILE_SIZE, vae_overlap=VAE_TILE_OVERLAP):
+    """cache_key over everything that determines an asset's image and its encoded file."""
+    config = ASSETS[name]
+    return cache_key(
+        backend="generate_assets", prompt=config['prompt'], negative=config.get('negative', ""),
+        width=config['width'], height=config['height'], seed=seed, steps=steps, cfg=CFG_SCALE,
+        cfg_off_last_steps=CFG_OFF_LAST_STEPS, cfg_min_sigma=CFG_MIN_SIGMA, sampler=sampler,
+        schedule=schedule_kind, shift=shift, speed=[speed.mode, speed.blocks, speed.tolerance],
+        deep_cache_from=deep_cache_from, vae_tile=vae_tile, vae_overlap=vae_overlap, model=model,
+        encoding=encoding,
+    )
+
+
+def encoder_options(compress_level=PNG_COMPRESS_LEVEL, formats=OUTPUT_FORMATS, min_psnr=MIN_PSNR):
+    """Keyword arguments for ImageWriter / encode_and_write."""
+    return {"compress_level": compress_level, "formats": tuple(formats), "min_psnr": min_psnr,
+            "webp_quality": WEBP_QUALITY}
+
+
+def parse_formats(spec):
+    """--formats value: comma-separated names from IMAGE_ENCODERS."""
+    formats = [f.strip() for f in spec.split(",") if f.strip()]
+    unknown = [f for f in formats if f not in IMAGE_ENCODERS]
+    if unknown or not formats:
+        import argparse
+        raise argparse.ArgumentTypeError(f"unknown format {', '.join(unknown)} (choose from {', '.join(IMAGE_ENCODERS)})")
+    return formats
+
+
+def generate_all(stream=False, speed=None, deep_cache_from=None, schedule_kind=SCHEDULE, shift=SCHEDULE_SHIFT,
+                 sampler=SAMPLER, steps=STEPS, vae_tile=VAE_TILE_SIZE, vae_overlap=VAE_TILE_OVERLAP,
+                 compress_level=PNG_COMPRESS_LEVEL, force=False, seed=SEED, formats=OUTPUT_FORMATS,
+                 min_psnr=MIN_PSNR):
+    """
+    Generate all assets using AI.
+
+    Each image is written in the smallest of formats that keeps min_psnr
+    (see encode_best), and a size report is saved to SIZE_REPORT_PATH.
+
+    Assets whose inputs and model files match a generation cache entry are
+    skipped (or restored from the cache) unless force is set.
+    """
     print("\n" + "=" * 60)
     print("DailyWell Asset Generator - AI Mode")
     print("=" * 60)
 
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    speed = speed or SpeedMode()
+    seeds = {n: stable_seed(n, seed) for n in ASSETS}
+    model = model_digest()
+    encoding = encoder_options(compress_level, formats, min_psnr)
+    keys = {n: asset_cache_key(n, seeds[n], steps, sampler, schedule_kind, shift, speed, deep_cache_from, model,
+                               encoding, vae_tile, vae_overlap)
+            for n in ASSETS}
+    cache = GenerationCache(CACHE_DIR, max_bytes=int(CACHE_MAX_GB * 1024**3))
+    pending = {n: c for n, c in ASSETS.items() if force or not cache.fetch(keys[n], OUTPUT_DIR / c['filename'])}
+    cache.save()
+    print(f"Cache: {cache.summary()}{' (--force)' if force else ''}")
+    if not pending:
+        print(f"\nAll {len(ASSETS)} assets up to date")
+        return
+
     cleanup()
 
     print(f"Starting VRAM: {get_vram_usage():.2f}GB")
@@ -681,13 +2015,15 @@ def generate_all():
     # Load models
     print("\nLoading models...")
 
-    print("  Loading transformer...")
-    transformer_sd = load_file(str(TRANSFORMER_PATH), device="cuda")
+    print(f"  Loading transformer{' (streaming)' if stream else ''}...")
+    transformer_sd = load_transformer("cuda", stream=stream)
     print(f"  Transformer: {len(transformer_sd)} tensors, VRAM: {get_vram_usage():.2f}GB")
 
     print("  Loading VAE...")
     vae_sd = load_file(str(VAE_PATH), device="cuda")
-    print(f"  VAE: {len(vae_sd)} tensors, VRAM: {get_vram_usage():.2f}GB")
+    vae = VAEDecoder(vae_sd, "cuda", tile_size=vae_tile, overlap=vae_overlap)
+    del vae_sd
+    print(f"  VAE: {len(vae.weights)} decoder tensors, VRAM: {get_vram_usage():.2f}GB")
 
     # Check if text encoder exists
     text_encoder_sd = None
@@ -696,35 +2032,66 @@ def generate_all():
         text_encoder_sd = load_file(str(TEXT_ENCODER_PATH), device="cuda")
         print(f"  Text Encoder: {len(text_encoder_sd)} tensors, VRAM: {get_vram_usage():.2f}GB")
 
+    print("  Building weight plan...")
+    plan = build_weight_plan(transformer_sd, "cuda", stream=stream)
+    print(f"  Weight plan: {plan.num_blocks} blocks, {plan.resident_bytes / (1024**3):.2f}GB resident")
+
     print(f"\nTotal VRAM after loading: {get_vram_usage():.2f}GB")
+    print(f"Sampler: {sampler}, {steps} steps, {schedule_kind} schedule")
 
-    success = 0
-    for name, config in ASSETS.items():
-        print(f"\nGenerating: {name}")
+    writer = ImageWriter(workers=WRITER_WORKERS, **encoding)
+    for names in batch_assets(pending, plan, cfg=CFG_SCALE != 1.0):
+        first = ASSETS[names[0]]
+        print(f"\nGenerating: {', '.join(names)}")
         try:
-            image = generate_with_ai(
-                prompt=config['prompt'],
-                width=config['width'],
-                height=config['height'],
-                transformer_sd=transformer_sd,
-                vae_sd=vae_sd,
+            images = generate_batch(
+                prompts=[ASSETS[n]['prompt'] for n in names],
+                width=first['width'],
+                height=first['height'],
+                plan=plan,
+                vae=vae,
                 text_encoder_sd=text_encoder_sd,
-                steps=20,
-                seed=hash(name) % 2**32
+                steps=steps,
+                cfg_scale=CFG_SCALE,
+                seeds=[seeds[n] for n in names],
+                negative_prompts=[ASSETS[n].get('negative', "") for n in names],
+                cfg_off_last_steps=CFG_OFF_LAST_STEPS,
+                cfg_min_sigma=CFG_MIN_SIGMA,
+                speed=speed,
+                deep_cache_from=deep_cache_from,
+                schedule_kind=schedule_kind,
+                shift=shift,
+                sampler=sampler,
             )
 
-            output_path = OUTPUT_DIR / config['filename']
-            image.save(output_path, 'PNG', optimize=True)
-            print(f"  -> {config['filename']}")
-            success += 1
+            for name, image in zip(names, images):
+                config = ASSETS[name]
+                writer.submit(OUTPUT_DIR / config['filename'], image)
+                print(f"  -> {config['filename']}")
 
         except Exception as e:
             print(f"  [ERROR] {e}")
             import traceback
             traceback.print_exc()
 
+    results = writer.close()
+    print_write_report(results, writer.submit_wait_s)
+    names_by_path = {OUTPUT_DIR / ASSETS[n]['filename']: n for n in pending}
+    for r in results:
+        if r.ok:
+            cache.store(keys[names_by_path[r.path]], r.output, name=names_by_path[r.path])
+    cache.save()
+    write_size_report([(r.output, r.encoded) for r in results if r.ok], SIZE_REPORT_PATH)
+    success = len(ASSETS) - len(pending) + sum(r.ok for r in results)
+
+    print(f"\nWeight plan: {plan.resident_bytes / (1024**3):.2f}GB resident, "
+          f"{plan.hits} block hits, {plan.misses} on-the-fly casts")
+
     # Cleanup
-    del transformer_sd, vae_sd
+    if stream:
+        print(f"Streamed {transformer_sd.bytes_read / (1024**3):.2f}GB of transformer weights")
+        transformer_sd.close()
+    del plan, transformer_sd, vae
     if text_encoder_sd is not None:
         del text_encoder_sd
     cleanup()
@@ -735,132 +2102,767 @@ def generate_all():
     print("=" * 60)
 
 
-def generate_placeholders():
-    """Generate high-quality placeholder assets (PIL-based, no AI)."""
-    from PIL import ImageDraw, ImageFilter
-    import random
+def _placeholder_job(name, seed, encoding, densities):
+    """
+    Render one placeholder, then resample, encode and write each of its
+    outputs; runs in a --jobs pool worker.
+
+    Everything, including the seed, is derived from the arguments, so the
+    output does not depend on which worker runs it or in what order.
+    Returns (name, render_s, encode_s, write_s, bytes, worker pid,
+    [(output path, EncodedImage)]), where render_s includes the density
+    resampling.
+    """
+    start = time.perf_counter()
+    outputs = placeholder_outputs(name, ASSETS[name], seed, densities)
+    rendered = time.perf_counter()
+    encode_s = write_s = 0.0
+    nbytes = 0
+    written = []
+    for path, img in outputs:
+        e, w, n, output, encoded = encode_and_write(path, img, **encoding)
+        encode_s += e
+        write_s += w
+        nbytes += n
+        written.append((output, encoded))
+    return name, rendered - start, encode_s, write_s, nbytes, os.getpid(), written
+
+
+def _placeholders_in_process(seed, encoding, densities):
+    """jobs=1: render and resample here, encode and write on the background ImageWriter."""
+    writer = ImageWriter(workers=WRITER_WORKERS, **encoding)
+    render_s = {}
+    names = {}
+    for name, config in ASSETS.items():
+        try:
+            start = time.perf_counter()
+            outputs = placeholder_outputs(name, config, seed, densities)
+            render_s[name] = time.perf_counter() - start
+            for path, img in outputs:
+                names[path] = name
+                writer.submit(path, img)
+        except Exception as e:
+            print(f"  [ERROR] {name}: {e}")
+
+    totals = {}
+    for r in writer.close():
+        if not r.ok:
+            print(f"  [ERROR] {r.path}: {r.error}")
+            continue
+        encode_s, write_s, nbytes, written = totals.get(names[r.path], (0.0, 0.0, 0, []))
+        totals[names[r.path]] = (encode_s + r.encode_s, write_s + r.write_s, nbytes + r.nbytes,
+                                 written + [(r.output, r.encoded)])
+    return [(name, render_s[name], *totals[name][:3], os.getpid(), totals[name][3])
+            for name in ASSETS if name in totals]
+
+
+def _placeholders_in_pool(seed, encoding, densities, jobs):
+    """jobs>1: each asset is rendered, encoded and written by a process pool worker."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(_placeholder_job, name, seed, encoding, densities): name for name in ASSETS}
+        for future, name in futures.items():
+            try:
+                rows.append(future.result())
+            except Exception as e:
+                print(f"  [ERROR] {name}: {e}")
+    return rows
+
+
+def _placeholders_single_job_time(seed, encoding, densities):
+    """Wall time to render, resample and encode every placeholder back to back, without writing."""
+    start = time.perf_counter()
+    for name, config in ASSETS.items():
+        for _, img in placeholder_outputs(name, config, seed, densities):
+            encode_best(img, **encoding)
+    return time.perf_counter() - start
+
 
+def generate_placeholders(compress_level=PNG_COMPRESS_LEVEL, seed=SEED, jobs=1, densities=DENSITIES,
+                          formats=OUTPUT_FORMATS, min_psnr=MIN_PSNR):
+    """
+    Generate high-quality placeholder assets (NumPy-rendered, no AI).
+
+    jobs > 1 spreads rendering and encoding across that many processes,
+    then times the same work in a single job to report the speedup.
+    Icons are drawn once and written to each density bucket in densities
+    (see placeholder_outputs); an empty list writes them to OUTPUT_DIR.
+    Each file is written in the smallest of formats that keeps min_psnr,
+    and a size report is saved to SIZE_REPORT_PATH.
+    """
     print("\n" + "=" * 60)
     print("DailyWell Asset Generator - Placeholder Mode")
     print("=" * 60)
 
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-    # Color schemes for different asset types
-    COLORS = {
-        "habit_rest": [(139, 92, 246), (88, 28, 135)],
-        "habit_hydrate": [(34, 211, 238), (6, 95, 124)],
-        "habit_move": [(52, 211, 153), (4, 120, 87)],
-        "habit_nourish": [(163, 230, 53), (22, 101, 52)],
-        "habit_calm": [(249, 168, 212), (131, 24, 67)],
-        "habit_connect": [(251, 146, 60), (154, 52, 18)],
-        "habit_unplug": [(148, 163, 184), (51, 65, 85)],
-        "badge_streak_7": [(217, 119, 6), (120, 53, 15)],
-        "badge_streak_30": [(203, 213, 225), (100, 116, 139)],
-        "badge_streak_100": [(251, 191, 36), (180, 83, 9)],
-        "badge_first_habit": [(34, 211, 238), (6, 95, 124)],
-        "badge_perfect_week": [(52, 211, 153), (4, 120, 87)],
-        "badge_early_bird": [(251, 146, 60), (180, 83, 9)],
-        "badge_night_owl": [(139, 92, 246), (30, 27, 75)],
-        "badge_comeback": [(239, 68, 68), (153, 27, 27)],
-        "coach_sam": [(139, 92, 246), (88, 28, 135)],
-        "coach_alex": [(52, 211, 153), (4, 120, 87)],
-        "coach_dana": [(249, 168, 212), (131, 24, 67)],
-        "coach_grace": [(163, 230, 53), (120, 80, 20)],
-        "bg_dashboard": [(240, 253, 250), (204, 251, 241)],
-        "bg_insights": [(250, 245, 255), (233, 213, 255)],
-        "bg_settings": [(248, 250, 252), (226, 232, 240)],
-        "bg_profile": [(255, 251, 235), (254, 243, 199)],
-    }
+    encoding = encoder_options(compress_level, formats, min_psnr)
+    start = time.perf_counter()
+    if densities:
+        print(f"Icon densities: {', '.join(densities)} (drawn at {ICON_SUPERSAMPLE}x {ICON_SOURCE_DENSITY})")
+    print(f"Formats: {', '.join(formats)} (lossy above {min_psnr:g} dB)")
+    if jobs > 1:
+        rows = _placeholders_in_pool(seed, encoding, densities, jobs)
+    else:
+        rows = _placeholders_in_process(seed, encoding, densities)
+    wall = time.perf_counter() - start
+
+    print(f"\n{'Asset':24s} {'Render ms':>10s} {'Encode ms':>10s} {'Write ms':>9s} {'KB':>8s} {'Worker':>8s}")
+    for name, render_s, encode_s, write_s, nbytes, pid, _ in rows:
+        print(f"{name:24s} {render_s * 1000:10.1f} {encode_s * 1000:10.1f} {write_s * 1000:9.1f} "
+              f"{nbytes / 1024:8.1f} {pid:8d}")
+    print(f"\n{len(rows)} assets in {wall:.2f}s with {jobs} job{'s' if jobs > 1 else ''}")
+    if jobs > 1:
+        # Summed worker times overstate the work when workers share cores, so time a real single job
+        print("Timing the same work in a single job...")
+        single = _placeholders_single_job_time(seed, encoding, densities)
+        print(f"Single job: {single:.2f}s, {single / wall:.1f}x speedup with {jobs} jobs "
+              f"({os.cpu_count()} CPUs)")
+    write_size_report([item for row in rows for item in row[6]], SIZE_REPORT_PATH)
 
-    def create_icon(config, colors):
-        width = config['width']
-        height = config['height']
+    print(f"\n{'='*60}")
+    print(f"Done: {len(rows)}/{len(ASSETS)} assets generated")
+    print(f"Output: {OUTPUT_DIR}")
+    print("=" * 60)
 
-        img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(img)
 
-        center_x, center_y = width // 2, height // 2
-        max_radius = int(width * 0.45)
+# ================= BENCHMARKS =================
 
-        # Gradient circle
-        for r in range(max_radius, 0, -1):
-            ratio = r / max_radius
-            color = tuple(int(colors[0][i] * ratio + colors[1][i] * (1 - ratio)) for i in range(3))
-            alpha = int(255 * (0.7 + 0.3 * ratio))
-            draw.ellipse([center_x - r, center_y - r, center_x + r, center_y + r], fill=(*color, alpha))
+def compare_samplers(step_counts=(4, 8, 12, 20), reference_steps=50, schedule_kind=SCHEDULE, shift=SCHEDULE_SHIFT,
+                     cfg_scale=CFG_SCALE, seed=0):
+    """
+    Wall time and error of each sampler against a many-step Euler reference.
+
+    Runs on the synthetic transformer on CPU so it needs no model files; the
+    error is the MSE between final latents started from the same noise, which
+    is what matters when trading steps for quality on the real model.
+    """
+    print("\n" + "=" * 60)
+    print("DailyWell Asset Generator - Sampler Comparison")
+    print("=" * 60)
+
+    plan = BlockWeightPlan(make_synthetic_transformer_sd(num_blocks=4, seed=seed), "cpu", dtype=torch.float32)
+    generator = torch.Generator().manual_seed(seed)
+    noise = torch.randn(1, LATENT_CHANNELS, 16, 16, generator=generator)
+    context = torch.randn(1, 8, plan.context_dim, generator=generator)
+    uncond_context = torch.randn(1, 8, plan.context_dim, generator=generator)
+
+    def run(sampler, steps):
+        schedule = get_schedule(steps, schedule_kind, shift, "cpu")
+        temb = schedule.temb(plan)
+
+        def model_fn(x, i, ctx):
+            return run_transformer(x, schedule.timesteps[i:i + 1], ctx, plan, temb=temb[i:i + 1])
+
+        stats = {}
+        start = time.perf_counter()
+        with torch.no_grad():
+            latent = SAMPLERS[sampler](model_fn, noise, schedule.sigmas, context, uncond_context, cfg_scale,
+                                       stats=stats)
+        return latent.float(), time.perf_counter() - start, stats["evaluations"]
 
-        # Glassmorphic rings
-        for i in range(3):
-            r = max_radius - 5 - i * 12
-            alpha = 120 - i * 30
-            draw.ellipse([center_x - r, center_y - r, center_x + r, center_y + r], outline=(255, 255, 255, alpha), width=2)
+    print(f"\nReference: euler, {reference_steps} steps, {schedule_kind} schedule")
+    reference, _, _ = run("euler", reference_steps)
 
-        # Inner glow
-        inner_r = int(max_radius * 0.6)
-        draw.ellipse([center_x - inner_r, center_y - inner_r, center_x + inner_r, center_y + inner_r], fill=(255, 255, 255, 30))
+    rows = []
+    for steps in step_counts:
+        for sampler in SAMPLERS:
+            latent, elapsed, nfe = run(sampler, steps)
+            rows.append((sampler, steps, nfe, elapsed, F.mse_loss(latent, reference).item()))
 
-        return img
+    print(f"\n{'Sampler':10s} {'Steps':>5s} {'NFE':>5s} {'Time (s)':>9s} {'MSE vs ref':>12s}")
+    for sampler, steps, nfe, elapsed, mse in rows:
+        print(f"{sampler:10s} {steps:5d} {nfe:5d} {elapsed:9.3f} {mse:12.3e}")
+    return rows
 
-    def create_background(config, colors):
-        width = config['width']
-        height = config['height']
 
-        img = Image.new('RGBA', (width, height), (255, 255, 255, 255))
-        draw = ImageDraw.Draw(img)
+class AllocationCounter:
+    """
+    Count bytes of new tensor storage created by torch ops, plus the peak of
+    Python-tracked host allocations (numpy arrays), inside a with block.
+    """
+
+    def __enter__(self):
+        import tracemalloc
+        from torch.utils._python_dispatch import TorchDispatchMode
+
+        counter = self
+
+        class Mode(TorchDispatchMode):
+            def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+                inputs = {t.untyped_storage().data_ptr() for t in _tensors((args, kwargs or {}))}
+                out = func(*args, **(kwargs or {}))
+                for t in _tensors(out):
+                    storage = t.untyped_storage()
+                    if storage.data_ptr() not in inputs:
+                        inputs.add(storage.data_ptr())
+                        counter.tensor_bytes += storage.nbytes()
+                return out
+
+        self.tensor_bytes = 0
+        self.host_peak = 0
+        self._tracemalloc = tracemalloc
+        self._mode = Mode()
+        tracemalloc.start()
+        self._mode.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self._mode.__exit__(*exc)
+        _, self.host_peak = self._tracemalloc.get_traced_memory()
+        self._tracemalloc.stop()
+        return False
+
 
-        # Vertical gradient
-        for y in range(height):
-            ratio = y / height
-            color = tuple(int(colors[0][i] * (1 - ratio) + colors[1][i] * ratio) for i in range(3))
-            draw.line([(0, y), (width, y)], fill=(*color, 255))
+def _tensors(tree):
+    if isinstance(tree, torch.Tensor):
+        yield tree
+    elif isinstance(tree, (list, tuple)):
+        for item in tree:
+            yield from _tensors(item)
+    elif isinstance(tree, dict):
+        for item in tree.values():
+            yield from _tensors(item)
 
-        # Glassmorphic circles
-        random.seed(hash(config['filename']))
-        for _ in range(5):
-            x = random.randint(0, width)
-            y = random.randint(0, height)
-            r = random.randint(100, 300)
-            alpha = random.randint(10, 30)
-            draw.ellipse([x - r, y - r, x + r, y + r], fill=(255, 255, 255, alpha))
 
-        return img
+def bench_frame_conversion(width=1080, height=1920, repeats=5, device=None):
+    """
+    Bytes allocated and time per frame turning a decoded image tensor into a
+    PIL image, for the previous float32 numpy path and image_to_pil.
+    """
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    print("\n" + "=" * 60)
+    print(f"DailyWell Asset Generator - Frame Conversion Benchmark ({width}x{height}, {device})")
+    print("=" * 60)
 
-    success = 0
+    def legacy(img):
+        img = img[0].permute(1, 2, 0).cpu().float().numpy()
+        img = (img * 255).astype(np.uint8)
+        return Image.fromarray(img)
+
+    pool = FrameBufferPool()
+    source = torch.rand(1, 3, height, width, device=device)
+    rows = []
+    for name, convert in (("legacy", legacy), ("image_to_pil", lambda img: image_to_pil(img, pool))):
+        convert(source.clone())  # warm up pools and kernels
+        img = source.clone()
+        with AllocationCounter() as counter:
+            image = convert(img)
+        assert image.size == (width, height)
+
+        # Timed separately, the counters slow every allocation down
+        elapsed = 0.0
+        for _ in range(repeats):
+            img = source.clone()
+            start = time.perf_counter()
+            convert(img)
+            elapsed += time.perf_counter() - start
+        rows.append((name, counter.tensor_bytes, counter.host_peak, elapsed / repeats))
+
+    print(f"\n{'Path':14s} {'Tensor MB':>10s} {'Host peak MB':>13s} {'ms/frame':>9s}")
+    for name, tensor_bytes, host_peak, seconds in rows:
+        print(f"{name:14s} {tensor_bytes / 2**20:10.1f} {host_peak / 2**20:13.1f} {seconds * 1000:9.1f}")
+    print(f"\nHost buffers allocated by the pool: {pool.allocated}")
+    return rows
+
+
+# ================= SELF TEST =================
+
+def make_synthetic_transformer_sd(hidden=32, num_blocks=3, seed=0, head_dim=8, context_dim=48):
+    """Tiny random transformer state dict with the real key layout."""
+    generator = torch.Generator().manual_seed(seed)
+
+    def rand(*shape, scale=0.02):
+        return torch.randn(*shape, generator=generator) * scale
+
+    p = TRANSFORMER_PREFIX
+    patch_dim = LATENT_CHANNELS * PATCH_SIZE * PATCH_SIZE
+    sd = {
+        p + "img_in.weight": rand(hidden, patch_dim, scale=0.1),
+        p + "img_in.bias": rand(hidden),
+        p + "time_text_embed.timestep_embedder.linear_1.weight": rand(hidden, 256),
+        p + "time_text_embed.timestep_embedder.linear_1.bias": rand(hidden),
+        p + "time_text_embed.timestep_embedder.linear_2.weight": rand(hidden, hidden),
+        p + "time_text_embed.timestep_embedder.linear_2.bias": rand(hidden),
+        p + "norm_out.linear.weight": rand(2 * hidden, hidden),
+        p + "norm_out.linear.bias": rand(2 * hidden),
+        p + "proj_out.weight": rand(patch_dim, hidden, scale=0.1),
+        p + "proj_out.bias": rand(patch_dim),
+        p + "txt_norm.weight": 1 + rand(context_dim),
+        p + "txt_in.weight": rand(hidden, context_dim, scale=0.1),
+        p + "txt_in.bias": rand(hidden),
+    }
+    for i in range(num_blocks):
+        b = f"{p}transformer_blocks.{i}."
+        for stream in ("img", "txt"):
+            sd[b + f"{stream}_mod.1.weight"] = rand(6 * hidden, hidden)
+            sd[b + f"{stream}_mod.1.bias"] = rand(6 * hidden)
+            sd[b + f"{stream}_mlp.net.0.proj.weight"] = rand(4 * hidden, hidden, scale=0.1)
+            sd[b + f"{stream}_mlp.net.0.proj.bias"] = rand(4 * hidden)
+            sd[b + f"{stream}_mlp.net.2.weight"] = rand(hidden, 4 * hidden, scale=0.1)
+            sd[b + f"{stream}_mlp.net.2.bias"] = rand(hidden)
+        for name in ("to_q", "to_k", "to_v", "add_q_proj", "add_k_proj", "add_v_proj", "to_out.0", "to_add_out"):
+            sd[b + f"attn.{name}.weight"] = rand(hidden, hidden, scale=0.2)
+            sd[b + f"attn.{name}.bias"] = rand(hidden)
+        for name in ("norm_q", "norm_k", "norm_added_q", "norm_added_k"):
+            sd[b + f"attn.{name}.weight"] = 1 + rand(head_dim)
+    return sd
+
+
+def make_synthetic_vae_sd(base=8, dim_mult=(1, 2, 4, 4), num_res_blocks=1, seed=0, attention=False):
+    """Tiny random Wan VAE decoder in the ComfyUI key layout, with 5D causal conv weights."""
+    generator = torch.Generator().manual_seed(seed)
+    sd = {}
+
+    def conv(name, cin, cout, kernel=3, causal=True):
+        shape = (cout, cin, 3, kernel, kernel) if causal else (cout, cin, kernel, kernel)
+        sd[name + ".weight"] = torch.randn(*shape, generator=generator) / math.sqrt(cin * kernel * kernel)
+        sd[name + ".bias"] = torch.randn(cout, generator=generator) * 0.02
+
+    def norm(name, dim):
+        sd[name + ".gamma"] = 1 + torch.randn(dim, 1, 1, 1, generator=generator) * 0.1
+
+    def residual(name, cin, cout):
+        norm(name + ".residual.0", cin)
+        conv(name + ".residual.2", cin, cout)
+        norm(name + ".residual.3", cout)
+        conv(name + ".residual.6", cout, cout)
+        if cin != cout:
+            conv(name + ".shortcut", cin, cout, kernel=1)
+
+    dims = [base * m for m in (dim_mult[-1],) + tuple(reversed(dim_mult))]
+    conv("conv2", LATENT_CHANNELS, LATENT_CHANNELS, kernel=1)
+    conv("decoder.conv1", LATENT_CHANNELS, dims[0])
+    residual("decoder.middle.0", dims[0], dims[0])
+    if attention:
+        norm("decoder.middle.1.norm", dims[0])
+        conv("decoder.middle.1.to_qkv", dims[0], 3 * dims[0], kernel=1, causal=False)
+        conv("decoder.middle.1.proj", dims[0], dims[0], kernel=1, causal=False)
+    residual("decoder.middle.2", dims[0], dims[0])
+
+    index = 0
+    for i, (cin, cout) in enumerate(zip(dims[:-1], dims[1:])):
+        if i > 0:
+            cin //= 2
+        for _ in range(num_res_blocks + 1):
+            residual(f"decoder.upsamples.{index}", cin, cout)
+            cin, index = cout, index + 1
+        if i != len(dim_mult) - 1:
+            conv(f"decoder.upsamples.{index}.resample.1", cout, cout // 2, causal=False)
+            index += 1
+
+    norm("decoder.head.0", dims[-1])
+    conv("decoder.head.2", dims[-1], 3)
+    return sd
+
+
+def check_streaming_loader():
+    """Streaming loader on a synthetic file matches a fully loaded state dict."""
+    import tempfile
+    from safetensors.torch import save_file
+
+    sd = make_synthetic_transformer_sd(num_blocks=4)
+    latent = torch.randn(1, LATENT_CHANNELS, 8, 8, generator=torch.Generator().manual_seed(1)).to(torch.bfloat16)
+    t = torch.tensor([500.0])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "synthetic.safetensors"
+        save_file(sd, str(path))
+
+        full = BlockWeightPlan(load_file(str(path)), "cpu")
+        streamed_sd = StreamingStateDict(path, device="cpu")
+        streamed = BlockWeightPlan(streamed_sd, "cpu", budget_bytes=0)
+        try:
+            expected = run_transformer(latent, t, None, full)
+            for _ in range(2):
+                actual = run_transformer(latent, t, None, streamed)
+            held = len(streamed._blocks)
+        finally:
+            streamed_sd.close()
+
+    print(f"    streamed {streamed_sd.bytes_read} bytes, {held} blocks held")
+    return torch.equal(expected, actual) and held == 0
+
+
+def check_streaming_plan():
+    """The generate path's plan for --stream holds at most two blocks (running and prefetched) at a time."""
+    import tempfile
+    from safetensors.torch import save_file
+
+    sd = make_synthetic_transformer_sd(num_blocks=4)
+    latent = torch.randn(1, LATENT_CHANNELS, 8, 8, generator=torch.Generator().manual_seed(1)).to(torch.bfloat16)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "synthetic.safetensors"
+        save_file(sd, str(path))
+        streamed_sd = StreamingStateDict(path, device="cpu")
+        plan = build_weight_plan(streamed_sd, "cpu", stream=True)
+        peak = 0
+        cast_block = plan.block
+
+        def block(idx, prefetch=None):
+            nonlocal peak
+            weights = cast_block(idx, prefetch=prefetch)
+            prefetched = {key.split("transformer_blocks.")[1].split(".")[0] for key in streamed_sd._pending
+                          if "transformer_blocks." in key}
+            peak = max(peak, len(plan._blocks) + 1 + len(prefetched - {str(idx)}))
+            return weights
+
+        plan.block = block
+        try:
+            for step in range(3):
+                run_transformer(latent, torch.tensor([1000.0 - 300 * step]), None, plan)
+        finally:
+            streamed_sd.close()
+    print(f"    budget {plan.budget_bytes} bytes, {len(plan._blocks)} blocks resident, at most {peak} in memory")
+    return plan.budget_bytes == 0 and not plan._blocks and peak <= 2
+
+
+def check_schedule_release():
+    """A cached FlowSchedule does not keep a deleted BlockWeightPlan alive."""
+    plan = BlockWeightPlan(make_synthetic_transformer_sd(num_blocks=1), "cpu", dtype=torch.float32)
+    schedule = get_schedule(4)
+    table = schedule.temb(plan)
+    reused = schedule.temb(plan) is table
+    ref = weakref.ref(plan)
+    del plan
+    gc.collect()
+    print(f"    temb table {tuple(table.shape)}, {len(schedule._temb)} plans held after del")
+    return reused and ref() is None and len(schedule._temb) == 0
+
+
+def check_attention():
+    """Fused and chunked joint attention match a naive reference on random weights."""
+    sd = make_synthetic_transformer_sd(num_blocks=1)
+    prefix = f"{TRANSFORMER_PREFIX}transformer_blocks.0.attn."
+    raw = {k[len(prefix):]: v for k, v in sd.items() if k.startswith(prefix)}
+    plan = BlockWeightPlan(sd, "cpu", dtype=torch.float32)
+    weights = plan.block(0)
+
+    generator = torch.Generator().manual_seed(2)
+    img = torch.randn(2, 24, 32, generator=generator)
+    txt = torch.randn(2, 5, 32, generator=generator)
+
+    def naive(h, q, k, v, nq, nk):
+        def heads(t):
+            return t.view(t.shape[0], t.shape[1], -1, 8)
+
+        def rms(t, w):
+            return t * torch.rsqrt(t.pow(2).mean(-1, keepdim=True) + 1e-6) * w
+
+        def lin(t, n):
+            return t @ raw[f"{n}.weight"].T + raw[f"{n}.bias"]
+
+        return rms(heads(lin(h, q)), raw[f"{nq}.weight"]), rms(heads(lin(h, k)), raw[f"{nk}.weight"]), heads(lin(h, v))
+
+    iq, ik, iv = naive(img, "to_q", "to_k", "to_v", "norm_q", "norm_k")
+    tq, tk, tv = naive(txt, "add_q_proj", "add_k_proj", "add_v_proj", "norm_added_q", "norm_added_k")
+    q, k, v = (torch.cat(pair, dim=1).transpose(1, 2) for pair in ((tq, iq), (tk, ik), (tv, iv)))
+    probs = torch.softmax(q @ k.transpose(-1, -2) / math.sqrt(q.shape[-1]), dim=-1)
+    out = (probs @ v).transpose(1, 2).flatten(2)
+    expected_img = out[:, 5:] @ raw["to_out.0.weight"].T + raw["to_out.0.bias"]
+    expected_txt = out[:, :5] @ raw["to_add_out.weight"].T + raw["to_add_out.bias"]
+
+    worst = 0.0
+    for chunk in (None, 7):
+        img_out, txt_out = joint_attention(img, txt, weights, chunk_size=chunk)
+        worst = max(worst, (img_out - expected_img).abs().max().item(), (txt_out - expected_txt).abs().max().item())
+    print(f"    max abs error {worst:.2e}")
+    return worst < 1e-5
+
+
+def check_samplers():
+    """Higher-order samplers land closer to the Euler reference than Euler at the same step count, at the counted cost."""
+    rows = compare_samplers(step_counts=(8,))
+    mse = {sampler: error for sampler, _, _, _, error in rows}
+    nfe = {sampler: evaluations for sampler, _, evaluations, _, _ in rows}
+    return (all(mse[sampler] < mse["euler"] for sampler in SAMPLERS if sampler != "euler")
+            and nfe == {"euler": 8, "heun": 15, "dpmpp_2m": 8, "unipc": 8})
+
+
+def check_cache_batch_invariance():
+    """Under --speed cache (and deep cache) each asset samples the same alone as in a batch."""
+    plan = BlockWeightPlan(make_synthetic_transformer_sd(num_blocks=4, seed=5), "cpu", dtype=torch.float32)
+    generator = torch.Generator().manual_seed(7)
+    noise = torch.randn(3, LATENT_CHANNELS, 8, 8, generator=generator)
+    context = torch.randn(3, 6, plan.context_dim, generator=generator)
+    uncond_context = torch.randn(3, 6, plan.context_dim, generator=generator)
+    schedule = get_schedule(10)
+    temb = schedule.temb(plan)
+
+    def sample(rows):
+        speed = SpeedMode("cache", tolerance=0.5)
+        cache = ActivationCache(deep_from=2)
+
+        def model_fn(x, i, ctx):
+            return run_transformer(x, schedule.timesteps[i:i + 1], ctx, plan, speed=speed, cache=cache,
+                                   temb=temb[i:i + 1])
+
+        with torch.no_grad():
+            latent = euler_sample(model_fn, noise[rows], schedule.sigmas, context[rows], uncond_context[rows], 4.0)
+        return latent, speed.saved
+
+    batched, _ = sample([0, 1, 2])
+    singles = [sample([i]) for i in range(3)]
+    worst = max((batched[i:i + 1] - latent).abs().max().item() for i, (latent, _) in enumerate(singles))
+    saved = [s for _, s in singles]
+    print(f"    block evaluations saved alone: {saved}; max abs difference {worst:.2e}")
+    return worst < 1e-5 and len(set(saved)) > 1
+
+
+def check_vae_tiling():
+    """Tiled VAE decode matches a one-pass decode of a random attention-free VAE."""
+    sd = make_synthetic_vae_sd()
+    latent = torch.randn(1, LATENT_CHANNELS, 24, 40, generator=torch.Generator().manual_seed(3))
+    full = VAEDecoder(sd, "cpu", dtype=torch.float32, tile_size=0)
+    tiled = VAEDecoder(sd, "cpu", dtype=torch.float32, tile_size=128, overlap=112)
+
+    expected = full.decode(latent)
+    actual = tiled.decode(latent)
+    error = (actual - expected).abs()
+    print(f"    {tuple(expected.shape)} image, {len(full.up_blocks)} up blocks, "
+          f"max abs error {error.max().item():.2e}, mean {error.mean().item():.2e}")
+    return expected.shape == (1, 3, 192, 320) and error.max().item() < 1e-4
+
+
+def check_frame_conversion():
+    """image_to_pil rounds to the same pixels as a float32 numpy reference."""
+    img = torch.rand(1, 3, 40, 24, generator=torch.Generator().manual_seed(4))
+    expected = np.round(img[0].permute(1, 2, 0).numpy() * 255).astype(np.uint8)
+    actual = np.asarray(image_to_pil(img.clone()))
+    print(f"    {actual.shape} frame, {int((actual != expected).sum())} pixels differ")
+    return actual.shape == expected.shape and np.array_equal(actual, expected)
+
+
+def check_generation_cache():
+    """Generation cache skips current outputs, restores missing ones and evicts least recently used."""
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        cache = GenerationCache(tmp / "cache", max_bytes=250)
+        keys = [cache_key(prompt=p, seed=1) for p in ("a", "b", "c")]
+        outputs = [tmp / f"{p}.png" for p in ("a", "b", "c")]
+        for key, path in zip(keys, outputs):
+            path.write_bytes(b"x" * 100)
+            assert not cache.fetch(key, path)
+            cache.store(key, path)
+        cache.save()
+
+        # "a" was evicted to stay under 250 bytes; "b" is current; "c" is restored after deletion
+        reopened = GenerationCache(tmp / "cache", max_bytes=250)
+        outputs[2].unlink()
+        results = [reopened.fetch(key, path) for key, path in zip(keys, outputs)]
+        restored = outputs[2].exists()
+        changed = reopened.fetch(cache_key(prompt="b", seed=2), outputs[1])
+
+    # Decode tiling changes the pixels, so it must change the asset key too
+    name = next(iter(ASSETS))
+    args = (name, SEED, STEPS, SAMPLER, SCHEDULE, SCHEDULE_SHIFT, SpeedMode(), None, "model", encoder_options())
+    tiled = {asset_cache_key(*args), asset_cache_key(*args, vae_tile=0),
+             asset_cache_key(*args, vae_overlap=VAE_TILE_OVERLAP // 2)}
+
+    print(f"    {reopened.summary()}")
+    return (results == [False, True, True] and restored and not changed and cache.evicted == 1
+            and len(tiled) == 3)
+
+
+def check_placeholders():
+    """NumPy placeholders match the ImageDraw renderings within a small pixel tolerance."""
+    start = time.perf_counter()
+    images = {name: render_placeholder(name, config) for name, config in ASSETS.items()}
+    elapsed = time.perf_counter() - start
+
+    worst = 0.0
     for name, config in ASSETS.items():
-        print(f"Generating: {name}")
+        colors = PLACEHOLDER_COLORS.get(name, PLACEHOLDER_DEFAULT_COLORS)
+        draw = draw_background_pil if name.startswith('bg_') else draw_icon_pil
+        expected = np.asarray(draw(config, colors)).astype(np.int16)
+        actual = np.asarray(images[name]).astype(np.int16)
+        worst = max(worst, (np.abs(actual - expected).max(-1) > 2).mean())
+    print(f"    {len(images)} placeholders in {elapsed:.2f}s, worst {worst:.3%} pixels off by more than 2")
+    return worst < 0.001
+
+
+def check_density_buckets():
+    """Icons are drawn once, supersampled, and resampled into every drawable-<bucket> folder at its size."""
+    config = ASSETS["habit_rest"]
+    outputs = placeholder_outputs("habit_rest", config, densities=list(DENSITY_BUCKETS))
+    sizes = {path.parent.name: out.size for path, out in outputs}
+    levels = {path.parent.name: len(np.unique(np.asarray(out)[..., 3])) for path, out in outputs}
+    drawn = len(np.unique(np.asarray(render_placeholder("habit_rest", config))[..., 3]))
+    print(f"    sizes {sizes}, alpha levels xxxhdpi {levels['drawable-xxxhdpi']} vs hard-edged {drawn}")
+    return (sizes == {"drawable-mdpi": (64, 64), "drawable-hdpi": (96, 96), "drawable-xhdpi": (128, 128),
+                      "drawable-xxhdpi": (192, 192), "drawable-xxxhdpi": (256, 256)}
+            and levels["drawable-xxxhdpi"] > drawn
+            and placeholder_outputs("bg_profile", ASSETS["bg_profile"],
+                                    densities=list(DENSITY_BUCKETS))[0][0].parent == OUTPUT_DIR)
+
+
+def check_drawable_layouts():
+    """Placeholder (drawable-<bucket>/) and AI (drawable/) runs never leave an icon in both layouts."""
+    import tempfile
+
+    global OUTPUT_DIR
+    saved = OUTPUT_DIR
+    name = "habit_rest"
+    filename = ASSETS[name]["filename"]
+    encoding = encoder_options(formats=["png"])
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        OUTPUT_DIR = tmp / "res" / "drawable"
         try:
-            colors = COLORS.get(name, [(128, 128, 128), (64, 64, 64)])
-
-            if name.startswith('bg_'):
-                img = create_background(config, colors)
-            else:
-                img = create_icon(config, colors)
+            def layouts():
+                return sorted({p.parent.name for p in (tmp / "res").glob(f"*/{Path(filename).stem}.*")})
+
+            cache = GenerationCache(tmp / "cache")
+            _placeholder_job(name, SEED, encoding, DENSITIES)
+            placeholders = layouts()
+            # generate_all writes drawable/<file> and stores it in the cache
+            output = encode_and_write(OUTPUT_DIR / filename, render_placeholder(name, ASSETS[name]), **encoding)[3]
+            cache.store("ai", output)
+            generated = layouts()
+            _placeholder_job(name, SEED, encoding, DENSITIES)
+            replaced = layouts()
+            restored = cache.fetch("ai", OUTPUT_DIR / filename) and layouts()
+            # A bucket copy from an older placeholder run is cleared even when drawable/ is current
+            (tmp / "res" / "drawable-mdpi" / filename).write_bytes(b"stale")
+            current = cache.fetch("ai", OUTPUT_DIR / filename) and layouts()
+        finally:
+            OUTPUT_DIR = saved
+    buckets = sorted(f"drawable-{bucket}" for bucket in DENSITIES)
+    print(f"    placeholders -> {len(placeholders)} buckets, AI -> {generated}, "
+          f"restored -> {restored}, stale bucket copy -> {current}")
+    return (placeholders == replaced == buckets and generated == restored == current == ["drawable"])
+
+
+def check_output_formats():
+    """Encoders pick the smallest file above the quality floor and replace outputs in other formats."""
+    import tempfile
+
+    background = render_placeholder("bg_profile", ASSETS["bg_profile"])
+    encoded = encode_best(background, **encoder_options())
+    png = encoded.candidates["png"][0]
+    strict = encode_best(background, **encoder_options(min_psnr=float("inf")))
+    print(f"    bg_profile: {encoded.format} {len(encoded.data) / 1024:.1f} KB at {encoded.psnr:.1f} dB "
+          f"vs png {png / 1024:.1f} KB; lossless only: {strict.format}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bg_profile.png"
+        path.write_bytes(b"stale")
+        _, _, nbytes, output, _ = encode_and_write(path, background, **encoder_options(formats=["webp_lossless"]))
+        replaced = output.suffix == ".webp" and output.stat().st_size == nbytes and not path.exists()
+    return (encoded.psnr >= MIN_PSNR and len(encoded.data) == min(size for size, psnr in
+                                                                  encoded.candidates.values() if psnr is not None)
+            and len(encoded.data) < png and not IMAGE_ENCODERS[strict.format][1] and replaced)
+
+
+SELF_CHECKS = [
+    check_streaming_loader,
+    check_streaming_plan,
+    check_schedule_release,
+    check_attention,
+    check_cache_batch_invariance,
+    check_vae_tiling,
+    check_frame_conversion,
+    check_generation_cache,
+    check_placeholders,
+    check_density_buckets,
+    check_drawable_layouts,
+    check_output_formats,
+    check_samplers,
+]
+
+
+def run_selftests():
+    """Run the CPU self checks on synthetic weights."""
+    print("\n" + "=" * 60)
+    print("DailyWell Asset Generator - Self Test")
+    print("=" * 60)
 
-            output_path = OUTPUT_DIR / config['filename']
-            img.save(output_path, 'PNG', optimize=True)
-            print(f"  -> {config['filename']}")
-            success += 1
+    passed = 0
+    for check in SELF_CHECKS:
+        try:
+            ok = check()
         except Exception as e:
-            print(f"  [ERROR] {e}")
+            print(f"    [ERROR] {e}")
+            import traceback
+            traceback.print_exc()
+            ok = False
+        print(f"  [{'PASS' if ok else 'FAIL'}] {check.__name__}: {check.__doc__}")
+        passed += ok
 
-    print(f"\n{'='*60}")
-    print(f"Done: {success}/{len(ASSETS)} assets generated")
-    print(f"Output: {OUTPUT_DIR}")
-    print("=" * 60)
+    print(f"\nDone: {passed}/{len(SELF_CHECKS)} checks passed")
+    return passed == len(SELF_CHECKS)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        cmd = sys.argv[1].lower()
-        if cmd == "test":
-            test_loading()
-        elif cmd == "generate" or cmd == "ai":
-            generate_all()
-        elif cmd == "placeholders":
-            generate_placeholders()
-        else:
-            print(f"Unknown command: {cmd}")
+    import argparse
+
+    parser = argparse.ArgumentParser(description="DailyWell Asset Generator")
+    parser.add_argument("command", nargs="?", default="")
+    parser.add_argument("path", nargs="?", help="safetensors file for inspect (default: transformer)")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream transformer weights block by block instead of loading the whole file")
+    parser.add_argument("--speed", choices=SpeedMode.MODES, default="full",
+                        help="run every block, a subset (--blocks), or reuse the previous step's blocks (cache)")
+    parser.add_argument("--blocks", type=parse_block_spec,
+                        help="blocks for --speed subset: a count like 20 or indices like 0-29,40")
+    parser.add_argument("--cache-tolerance", type=float, default=0.05,
+                        help="relative input change below which --speed cache reuses blocks")
+    parser.add_argument("--schedule", choices=FlowSchedule.KINDS, default=SCHEDULE,
+                        help="sigma schedule for sampling")
+    parser.add_argument("--shift", type=float, default=SCHEDULE_SHIFT,
+                        help="flow-matching shift for --schedule shifted")
+    parser.add_argument("--deep-cache", type=int, metavar="BLOCK",
+                        help="run blocks from BLOCK on every other step and reuse their output in between")
+    parser.add_argument("--sampler", choices=list(SAMPLERS), default=SAMPLER,
+                        help="flow-matching sampler")
+    parser.add_argument("--steps", type=int, default=STEPS,
+                        help="sampling steps")
+    parser.add_argument("--compress-level", type=int, choices=range(10), default=PNG_COMPRESS_LEVEL,
+                        metavar="0-9", help="PNG zlib compression level (generate, placeholders)")
+    parser.add_argument("--seed", type=int, default=SEED,
+                        help="global seed mixed into every asset's seed (generate, placeholders)")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="processes rendering and encoding placeholders in parallel")
+    parser.add_argument("--densities", type=parse_densities, default=DENSITIES,
+                        help="icon density buckets for placeholders: comma-separated, 'all' or 'none'")
+    parser.add_argument("--formats", type=parse_formats, default=OUTPUT_FORMATS,
+                        help=f"candidate encoders, smallest above --min-psnr wins: {','.join(IMAGE_ENCODERS)}")
+    parser.add_argument("--min-psnr", type=float, default=MIN_PSNR,
+                        help="quality floor in dB for the lossy encoders")
+    parser.add_argument("--force", action="store_true",
+                        help="regenerate every asset even if the generation cache has it")
+    parser.add_argument("--vae-tile", type=int, default=VAE_TILE_SIZE,
+                        help="VAE decode tile size in pixels, 0 decodes in one pass")
+    parser.add_argument("--vae-overlap", type=int, default=VAE_TILE_OVERLAP,
+                        help="pixels of overlap between VAE decode tiles")
+    args = parser.parse_args()
+
+    cmd = args.command.lower()
+    if cmd == "test":
+        test_loading(stream=args.stream)
+    elif cmd == "generate" or cmd == "ai":
+        generate_all(stream=args.stream, speed=SpeedMode(args.speed, args.blocks, args.cache_tolerance),
+                     deep_cache_from=args.deep_cache, schedule_kind=args.schedule, shift=args.shift,
+                     sampler=args.sampler, steps=args.steps, vae_tile=args.vae_tile, vae_overlap=args.vae_overlap,
+                     compress_level=args.compress_level, force=args.force, seed=args.seed,
+                     formats=args.formats, min_psnr=args.min_psnr)
+    elif cmd == "placeholders":
+        generate_placeholders(compress_level=args.compress_level, seed=args.seed, jobs=args.jobs,
+                              densities=args.densities, formats=args.formats, min_psnr=args.min_psnr)
+    elif cmd == "inspect":
+        inspect_model(args.path)
+    elif cmd == "bench":
+        bench_frame_conversion()
+    elif cmd == "samplers":
+        compare_samplers(schedule_kind=args.schedule, shift=args.shift)
+    elif cmd == "selftest":
+        sys.exit(0 if run_selftests() else 1)
+    elif cmd:
+        print(f"Unknown command: {cmd}")
     else:
         print("DailyWell Asset Generator")
         print("=" * 40)
@@ -868,5 +2870,23 @@ if __name__ == "__main__":
         print("  python generate_assets.py test         - Test VRAM model loading")
         print("  python generate_assets.py generate     - Generate assets with AI")
         print("  python generate_assets.py placeholders - Generate placeholder assets")
+        print("  python generate_assets.py inspect [f]  - Summarize a safetensors header")
+        print("  python generate_assets.py samplers     - Compare samplers on synthetic weights")
+        print("  python generate_assets.py bench        - Bytes allocated per 1080x1920 frame conversion")
+        print("  python generate_assets.py selftest     - Run CPU self checks on synthetic weights")
+        print("\nOptions:")
+        print("  --stream  Stream transformer weights block by block (test, generate)")
+        print("  --speed   full | subset --blocks N | cache --cache-tolerance T (generate)")
+        print("  --deep-cache N  Reuse blocks N+ on alternating steps (generate)")
+        print("  --schedule linear | shifted --shift S  Sigma schedule (generate, samplers)")
+        print("  --sampler euler | heun | dpmpp_2m | unipc --steps N  Sampler (generate)")
+        print("  --vae-tile PX --vae-overlap PX  Tiled VAE decode, 0 = one pass (generate)")
+        print("  --jobs N  Parallel placeholder processes (placeholders)")
+        print("  --densities mdpi,hdpi,...|all|none  Icon density buckets (placeholders)")
+        print("  --seed N  Global seed for reproducible runs (generate, placeholders)")
+        print(f"  --force   Ignore the generation cache in {CACHE_DIR.name} (generate)")
+        print("  --compress-level 0-9  PNG compression, written in the background (generate, placeholders)")
+        print(f"  --formats {','.join(IMAGE_ENCODERS)} --min-psnr DB  Smallest encoding above the floor "
+              "(generate, placeholders)")
         print(f"\nVRAM Limit: {VRAM_LIMIT_GB}GB")
         print(f"Output: {OUTPUT_DIR}")
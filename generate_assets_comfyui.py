@@ -10,6 +10,13 @@ Prerequisites:
 2. Have Qwen-Image FP8 model loaded in ComfyUI
 3. Run this script: python generate_assets_comfyui.py
 
+Prompts are pipelined: --in-flight N stay queued on the server (--url
+sets its address) while finished images download and write. Completion
+and per-step progress come from the /ws event stream, with /history
+polling (--no-websocket forces it) as the fallback. Same-size assets
+are submitted as one workflow per group of up to --group N. The selftest
+command runs the client against comfyui_stub.py instead.
+
 Asset Specifications for 2026 Premium Health App:
 - Habit Icons:        256x256px  (glassmorphic, minimal)
 - Coach Avatars:      512x512px  (photorealistic, friendly)
@@ -18,19 +25,53 @@ Asset Specifications for 2026 Premium Health App:
 """
 
 import json
-import urllib.request
+import contextlib
+import functools
+import http.client
 import urllib.error
 import time
 import uuid
 import os
+import queue
+import socket
+import struct
+import threading
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional
+from urllib.parse import urlencode, urlparse
 import base64
 import io
 
+from asset_pipeline import (ImageWriter, encode_and_write, print_write_report, write_size_report, GenerationCache,
+                            cache_key, stable_seed)
+
 # ================= PATHS =================
 OUTPUT_DIR = Path(r"C:\Users\PC\Desktop\moneygrinder\mobile\PART_2_HEALTH_APPS\03_HABIT_BASED_HEALTH\habit-health\shared\src\androidMain\res\drawable")
 COMFYUI_URL = "http://127.0.0.1:8001"
+MAX_IN_FLIGHT = 3      # Prompts kept queued on the ComfyUI server at once
+DOWNLOAD_WORKERS = 2   # Threads downloading finished images while the server keeps generating
+USE_WEBSOCKET = True   # Follow /ws execution events; /history is polled only when that fails
+POLL_INTERVAL = 0.5    # First /history check delay when polling, doubled after every miss...
+MAX_POLL_INTERVAL = 4.0  # ...up to this many seconds
+PROMPT_TIMEOUT = 300   # Seconds per asset a prompt may run, from its start on the server, before it is cancelled
+MAX_GROUP_SIZE = 4     # Same-size assets submitted together as one workflow (1 = one prompt per asset)
+HTTP_TIMEOUT = 30      # Seconds per API call (connect and each read)...
+DOWNLOAD_TIMEOUT = 120  # ...except /view image downloads
+HTTP_RETRIES = 3       # Retries of a call after a transient error (dropped connection, timeout, 502-504)
+HTTP_BACKOFF = 0.5     # Seconds before the first retry, doubled after each
+DOWNLOAD_CHUNK = 64 * 1024  # Bytes per read when streaming a download to disk
+CACHE_DIR = Path(__file__).resolve().parent / ".asset_cache"
+CACHE_MAX_GB = 2
+SEED = 0  # Global seed; per-asset seeds are stable_seed(asset name, SEED), same as generate_assets.py
+# Smallest of these encodings above MIN_PSNR is written, same as generate_assets.py
+OUTPUT_FORMATS = ["png", "png8", "webp_lossless", "webp"]
+MIN_PSNR = 40.0
+WEBP_QUALITY = 90
+ENCODING = {"formats": tuple(OUTPUT_FORMATS), "min_psnr": MIN_PSNR, "webp_quality": WEBP_QUALITY}
+SIZE_REPORT_PATH = Path(__file__).resolve().parent / "asset_size_report.json"
 
 # ================= 2026 PREMIUM ASSET DEFINITIONS =================
 # Style: Glassmorphic, Neumorphism 2.0, Liquid Glass (Apple), Premium Health App
@@ -184,16 +225,6 @@ ASSETS = {
 }
 
 
-def check_comfyui_running():
-    """Check if ComfyUI is running on localhost:8188"""
-    try:
-        req = urllib.request.Request(f"{COMFYUI_URL}/system_stats")
-        with urllib.request.urlopen(req, timeout=5) as response:
-            return response.status == 200
-    except:
-        return False
-
-
 def get_workflow_template():
     """
     Returns Qwen-Image workflow using UNETLoader + CLIPLoader + VAELoader
@@ -267,130 +298,854 @@ def get_workflow_template():
     return workflow
 
 
-def queue_prompt(prompt_workflow):
-    """Queue a prompt to ComfyUI and return the prompt_id"""
-    p = {"prompt": prompt_workflow}
-    data = json.dumps(p).encode('utf-8')
-    req = urllib.request.Request(f"{COMFYUI_URL}/prompt", data=data)
-    req.add_header('Content-Type', 'application/json')
+# ================= WEBSOCKET EVENTS =================
 
-    with urllib.request.urlopen(req) as response:
-        result = json.loads(response.read())
-        return result.get('prompt_id')
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
 
 
-def get_history(prompt_id):
-    """Get the execution history for a prompt"""
-    req = urllib.request.Request(f"{COMFYUI_URL}/history/{prompt_id}")
-    with urllib.request.urlopen(req) as response:
-        return json.loads(response.read())
+def _ws_mask(payload, key):
+    n = len(payload)
+    return (int.from_bytes(payload, "big") ^ int.from_bytes((key * (n // 4 + 1))[:n], "big")).to_bytes(n, "big")
 
 
-def get_image(filename, subfolder, folder_type):
-    """Get an image from ComfyUI output"""
-    url = f"{COMFYUI_URL}/view?filename={filename}&subfolder={subfolder}&type={folder_type}"
-    req = urllib.request.Request(url)
-    with urllib.request.urlopen(req) as response:
-        return response.read()
+class ComfyUIEvents:
+    """
+    Minimal WebSocket (RFC 6455) client for ComfyUI's /ws event stream.
 
+    Just what the stream needs: the upgrade handshake, masked client
+    frames, and text, binary, ping and close frames (fragmented or not)
+    from the server. A reader thread puts each JSON event on inbox and
+    then None once the connection is gone. Binary messages (latent
+    previews) are dropped.
+    """
 
-def wait_for_completion(prompt_id, timeout=300):
-    """Wait for a prompt to complete, return the output images"""
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        history = get_history(prompt_id)
-        if prompt_id in history:
-            outputs = history[prompt_id].get('outputs', {})
-            if outputs:
-                # Find the SaveImage node output
-                for node_id, node_output in outputs.items():
-                    if 'images' in node_output:
-                        return node_output['images']
-        time.sleep(1)
-    return None
+    def __init__(self, base_url, client_id, inbox, timeout=5):
+        url = urlparse(base_url)
+        port = url.port or (443 if url.scheme == "https" else 80)
+        self.sock = socket.create_connection((url.hostname, port), timeout=timeout)
+        if url.scheme == "https":
+            import ssl
+            self.sock = ssl.create_default_context().wrap_socket(self.sock, server_hostname=url.hostname)
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.sock.sendall((f"GET /ws?clientId={client_id} HTTP/1.1\r\nHost: {url.netloc}\r\n"
+                           f"Upgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n"
+                           f"Sec-WebSocket-Version: 13\r\n\r\n").encode())
+        self._rfile = self.sock.makefile("rb")
+        status = self._rfile.readline()
+        headers = {}
+        for line in iter(self._rfile.readline, b"\r\n"):
+            if not line:
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        if status.split()[1:2] != [b"101"] or headers.get("sec-websocket-accept") != accept:
+            self.sock.close()
+            raise ConnectionError(f"websocket upgrade refused: {status.decode('latin-1').strip()}")
+        self.sock.settimeout(None)
+        self.inbox = inbox
+        self.closed = False
+        self._lock = threading.Lock()
+        threading.Thread(target=self._read_loop, daemon=True).start()
 
+    def _read(self, n):
+        data = self._rfile.read(n)
+        if len(data) < n:
+            raise ConnectionError("websocket closed")
+        return data
 
-def generate_asset_comfyui(asset_name: str, asset_config: dict, seed: Optional[int] = None) -> bool:
-    """Generate a single asset using ComfyUI API"""
-    print(f"\nGenerating: {asset_name}")
-    print(f"  Size: {asset_config['width']}x{asset_config['height']}")
+    def _send(self, opcode, payload=b""):
+        key = os.urandom(4)
+        length = len(payload)
+        if length < 126:
+            header = struct.pack(">BB", 0x80 | opcode, 0x80 | length)
+        elif length < 1 << 16:
+            header = struct.pack(">BBH", 0x80 | opcode, 0x80 | 126, length)
+        else:
+            header = struct.pack(">BBQ", 0x80 | opcode, 0x80 | 127, length)
+        with self._lock:
+            self.sock.sendall(header + key + _ws_mask(payload, key))
 
-    # Get workflow template
-    workflow = get_workflow_template()
+    def _read_loop(self):
+        message, kind = bytearray(), None
+        try:
+            while True:
+                head = self._read(2)
+                opcode, length = head[0] & 0x0F, head[1] & 0x7F
+                if length == 126:
+                    (length,) = struct.unpack(">H", self._read(2))
+                elif length == 127:
+                    (length,) = struct.unpack(">Q", self._read(8))
+                key = self._read(4) if head[1] & 0x80 else None
+                payload = self._read(length)
+                if key:
+                    payload = _ws_mask(payload, key)
+                if opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    self._send(0xA, payload)
+                    continue
+                if opcode in (0x1, 0x2):
+                    message, kind = bytearray(), opcode
+                elif opcode != 0x0:
+                    continue
+                message += payload
+                if head[0] & 0x80 and kind == 0x1:
+                    try:
+                        self.inbox.put(json.loads(message))
+                    except ValueError:
+                        pass
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.closed = True
+            self.inbox.put(None)
 
-    # Update workflow with asset-specific settings
-    workflow["5"]["inputs"]["width"] = asset_config["width"]
-    workflow["5"]["inputs"]["height"] = asset_config["height"]
-    workflow["4"]["inputs"]["text"] = asset_config["prompt"]
+    def close(self):
+        if not self.closed:
+            try:
+                self._send(0x8, struct.pack(">H", 1000))
+            except OSError:
+                pass
+        self.sock.close()
 
-    # Set seed
-    if seed is None:
-        seed = hash(asset_name) % (2**32)
-    workflow["6"]["inputs"]["seed"] = seed
 
-    try:
-        # Queue the prompt
-        prompt_id = queue_prompt(workflow)
-        print(f"  Queued: {prompt_id}")
+# ================= HTTP CONNECTION POOL =================
+
+class ConnectionPool:
+    """
+    Keep-alive http.client connections to one server, shared by threads.
+
+    request() reuses an idle connection when there is one and opens a new
+    one otherwise, so at most one connection per concurrent caller is ever
+    open. Transient failures (dropped or refused connections, timeouts,
+    502/503/504) are retried with exponential backoff. Non-idempotent
+    calls are only retried when the request cannot have reached the
+    server: a refused connection or a reused keep-alive connection that
+    the server had already closed. Other HTTP errors raise
+    urllib.error.HTTPError. Counters: connections_opened, requests,
+    retries and total_s (time spent in successful requests).
+
+    With dest_dir the response body is streamed in DOWNLOAD_CHUNK reads
+    to a hidden .part file there, whose Path is returned instead of the
+    bytes, so memory stays flat however large the body. A body cut short
+    of its Content-Length raises http.client.IncompleteRead
+    (retried like a dropped connection) and the partial file is removed.
+    """
+
+    RETRY_STATUS = (502, 503, 504)
+
+    def __init__(self, base_url, timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF):
+        url = urlparse(base_url)
+        self.base_url = base_url.rstrip("/")
+        self.host = url.hostname
+        self.port = url.port
+        self.https = url.scheme == "https"
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._idle = []
+        self._lock = threading.Lock()
+        self.connections_opened = 0
+        self.requests = 0
+        self.retried = 0
+        self.total_s = 0.0
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+            self.connections_opened += 1
+        connection = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return connection(self.host, self.port, timeout=self.timeout), False
+
+    def _release(self, conn):
+        with self._lock:
+            self._idle.append(conn)
 
-        # Wait for completion
-        images = wait_for_completion(prompt_id)
+    def request(self, method, path, body=None, headers=None, timeout=None, idempotent=True, dest_dir=None):
+        """Send one request and return the response body (or the Path it was streamed to)."""
+        timeout = timeout or self.timeout
+        for attempt in range(self.retries + 1):
+            conn, reused = self._acquire()
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                if dest_dir is not None and response.status < 300:
+                    data = self._stream(response, dest_dir)
+                else:
+                    data = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                stale = reused and isinstance(e, (http.client.RemoteDisconnected, BrokenPipeError,
+                                                  ConnectionResetError))
+                if attempt == self.retries or not (idempotent or stale or isinstance(e, ConnectionRefusedError)):
+                    raise
+                self._retry(attempt, stale)
+                continue
 
-        if images:
-            # Get the first image
-            img_info = images[0]
-            img_data = get_image(img_info['filename'], img_info.get('subfolder', ''), img_info['type'])
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+            if response.status in self.RETRY_STATUS and idempotent and attempt < self.retries:
+                self._retry(attempt)
+                continue
+            if response.status >= 400:
+                raise urllib.error.HTTPError(f"{self.base_url}{path}", response.status, response.reason,
+                                             response.headers, io.BytesIO(data))
+            with self._lock:
+                self.requests += 1
+                self.total_s += time.perf_counter() - start
+            return data
+
+    @staticmethod
+    def _stream(response, dest_dir):
+        expected = response.getheader("Content-Length")
+        fd, name = tempfile.mkstemp(prefix=".download-", suffix=".part", dir=dest_dir)
+        received = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while chunk := response.read(DOWNLOAD_CHUNK):
+                    f.write(chunk)
+                    received += len(chunk)
+            if expected is not None and received != int(expected):
+                raise http.client.IncompleteRead(b"", int(expected) - received)
+        except BaseException:
+            os.unlink(name)
+            raise
+        return Path(name)
+
+    def _retry(self, attempt, immediate=False):
+        with self._lock:
+            self.retried += 1
+        if not immediate:
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def summary(self):
+        average = self.total_s / self.requests * 1000 if self.requests else 0.0
+        return (f"{self.requests} requests over {self.connections_opened} connections, "
+                f"{average:.1f}ms average, {self.retried} retried")
+
+
+# ================= COMFYUI CLIENT =================
+
+class ComfyUIResult:
+    """
+    Outcome of one prompt run by ComfyUIClient.run(); images holds the
+    downloaded bytes. nodes lists the workflow's node ids and cached the
+    ones ComfyUI reused from its cache (None when the server did not say).
+    """
+
+    def __init__(self, key, prompt_id=None, images=None, error=None, elapsed_s=0.0, nodes=(), cached=None):
+        self.key = key
+        self.prompt_id = prompt_id
+        self.images = images or []
+        self.error = error
+        self.elapsed_s = elapsed_s
+        self.nodes = list(nodes)
+        self.cached = cached
 
-            # Save to output directory
-            output_path = OUTPUT_DIR / asset_config["filename"]
-            output_path.parent.mkdir(parents=True, exist_ok=True)
+    @property
+    def ok(self):
+        return self.error is None and bool(self.images)
 
-            with open(output_path, 'wb') as f:
-                f.write(img_data)
 
-            print(f"  -> {asset_config['filename']}")
+class _InFlight:
+    """Bookkeeping for one queued prompt in ComfyUIClient.run()."""
+
+    def __init__(self, key, workflow, poll_interval, timeout):
+        self.key = key
+        self.queued = time.monotonic()
+        self.save_nodes = [node_id for node_id, node in workflow.items() if node["class_type"] == "SaveImage"]
+        self.timeout = timeout * max(1, len(self.save_nodes))   # A grouped prompt renders one asset per SaveImage
+        self.titles = {node_id: node["_meta"]["title"] for node_id, node in workflow.items() if "_meta" in node}
+        self.nodes = list(workflow)
+        self.cached = None
+        self.outputs = {}
+        self.delay = poll_interval
+        self.next_check = self.queued + poll_interval
+        self.polling = False
+        self.running = False
+        self.started = None   # When it started running on the server; the timeout counts from here
+
+    def images(self):
+        """Image records from executed events, or None until every SaveImage node has reported."""
+        if not self.save_nodes or any(node_id not in self.outputs for node_id in self.save_nodes):
+            return None
+        return [img for node_id in self.save_nodes for img in self.outputs[node_id]]
+
+
+class ComfyUIClient:
+    """
+    Pipelined client for ComfyUI's HTTP API.
+
+    run() keeps up to max_in_flight prompts queued on the server so it
+    never sits idle between jobs, and downloads finished outputs on a
+    thread pool while the server works on the next prompts. Results come
+    back in completion order.
+
+    Completion comes from the /ws event stream: a prompt is done as soon
+    as all its SaveImage nodes report executed, and progress events are
+    passed to on_progress(label, step, steps), where label is the
+    sampling node's _meta title or else the job key. If the socket cannot be
+    opened or drops, /history is polled instead, each prompt backing off
+    from poll_interval to max_poll_interval between checks.
+
+    timeout counts from when a prompt starts running (its execution_start
+    event, or when polling, when the prompts queued ahead of it are done),
+    so waiting behind other prompts does not count. It is per SaveImage
+    node, so a grouped prompt gets as long as its assets would separately. A prompt that times out is removed from the server
+    queue, or interrupted if it is running, so it does not hold up the
+    prompts behind it.
+
+    Images come back as bytes, or with download_dir as the Paths of files
+    streamed there (see ConnectionPool), which the caller then owns.
+    """
+
+    def __init__(self, base_url=COMFYUI_URL, max_in_flight=MAX_IN_FLIGHT, download_workers=DOWNLOAD_WORKERS,
+                 poll_interval=POLL_INTERVAL, max_poll_interval=MAX_POLL_INTERVAL, timeout=PROMPT_TIMEOUT,
+                 websocket=USE_WEBSOCKET, on_progress=None, download_dir=None):
+        self.base_url = base_url.rstrip("/")
+        self.max_in_flight = max(1, max_in_flight)
+        self.download_workers = download_workers
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max(poll_interval, max_poll_interval)
+        self.timeout = timeout
+        self.websocket = websocket
+        self.on_progress = on_progress
+        self.download_dir = download_dir
+        self.client_id = uuid.uuid4().hex
+        self.http = ConnectionPool(self.base_url)
+        self.queued = 0
+        self.history_checks = 0
+        self.event_stream = False   # whether the last run() got a websocket
+
+    def is_running(self):
+        """Check if ComfyUI answers on base_url"""
+        try:
+            self.http.request("GET", "/system_stats", timeout=5)
             return True
-        else:
-            print(f"  [ERROR] Timeout waiting for image")
+        except (OSError, http.client.HTTPException):
             return False
 
+    def close(self):
+        self.http.close()
+
+    def connect_events(self, inbox):
+        """ComfyUIEvents feeding inbox, or None when websockets are off or refused."""
+        if not self.websocket:
+            return None
+        try:
+            return ComfyUIEvents(self.base_url, self.client_id, inbox)
+        except (OSError, ValueError) as e:
+            print(f"  [WARN] No websocket events ({e}), polling /history")
+            return None
+
+    def queue_prompt(self, workflow):
+        """Queue a prompt and return its prompt_id"""
+        data = json.dumps({"prompt": workflow, "client_id": self.client_id}).encode('utf-8')
+        result = json.loads(self.http.request("POST", "/prompt", data, {'Content-Type': 'application/json'},
+                                              idempotent=False))
+        self.queued += 1
+        return result.get('prompt_id')
+
+    def get_history(self, prompt_id):
+        """Get the execution history for a prompt"""
+        self.history_checks += 1
+        return json.loads(self.http.request("GET", f"/history/{prompt_id}"))
+
+    def cancel(self, prompt_id, running=False):
+        """
+        Delete a prompt from the server queue, and interrupt it when it is
+        running. Best effort: failures are reported, not raised.
+        """
+        try:
+            self.http.request("POST", "/queue", json.dumps({"delete": [prompt_id]}).encode('utf-8'),
+                              {'Content-Type': 'application/json'})
+            if running:
+                # Servers that ignore prompt_id interrupt whatever runs, which is this prompt
+                self.http.request("POST", "/interrupt", json.dumps({"prompt_id": prompt_id}).encode('utf-8'),
+                                  {'Content-Type': 'application/json'})
+        except (OSError, http.client.HTTPException) as e:
+            print(f"  [WARN] Could not cancel prompt {prompt_id}: {e}")
+
+    def get_image(self, filename, subfolder, folder_type):
+        """Get an image from ComfyUI output, as bytes or streamed into download_dir"""
+        query = urlencode({"filename": filename, "subfolder": subfolder, "type": folder_type})
+        return self.http.request("GET", f"/view?{query}", timeout=DOWNLOAD_TIMEOUT, dest_dir=self.download_dir)
+
+    def finished_images(self, prompt_id, nodes=None):
+        """
+        Image records of a finished prompt, in the order of the SaveImage
+        node ids in nodes (default: sorted), or None while it is still
+        queued or running.
+        """
+        return self._entry_images(prompt_id, self.get_history(prompt_id).get(prompt_id), nodes)
+
+    @staticmethod
+    def cached_nodes(entry):
+        """Node ids a history entry's execution_cached message lists, or None without one."""
+        for message in (entry or {}).get('status', {}).get('messages', []):
+            if message[0] == 'execution_cached':
+                return [str(node_id) for node_id in message[1].get('nodes', [])]
+        return None
+
+    @staticmethod
+    def _entry_images(prompt_id, entry, nodes=None):
+        if not entry:
+            return None
+        status = entry.get('status', {})
+        if status.get('status_str') == 'error':
+            raise RuntimeError(f"prompt {prompt_id} failed: {status.get('messages')}")
+        outputs = entry.get('outputs', {})
+        nodes = nodes or sorted(outputs, key=str)
+        images = [img for node_id in nodes for img in outputs.get(node_id, {}).get('images', [])]
+        return images or None
+
+    def download(self, images):
+        downloaded = []
+        try:
+            for img in images:
+                downloaded.append(self.get_image(img['filename'], img.get('subfolder', ''), img['type']))
+        except BaseException:
+            discard_downloads(downloaded)
+            raise
+        return downloaded
+
+    def _on_event(self, event, in_flight):
+        """
+        Apply one websocket event; returns (prompt_id, images) when it
+        finishes a prompt. Raises RuntimeError for execution errors.
+        """
+        data = event.get('data') or {}
+        prompt_id = data.get('prompt_id')
+        state = in_flight.get(prompt_id)
+        if state is None:
+            return None
+        kind = event.get('type')
+        if state.started is None and (kind in ('execution_start', 'progress')
+                                      or (kind == 'executing' and data.get('node') is not None)):
+            state.running = True
+            state.started = time.monotonic()
+        if kind == 'progress' and self.on_progress:
+            label = state.titles.get(data.get('node')) or state.key
+            self.on_progress(label, data.get('value', 0), data.get('max', 0))
+        elif kind == 'execution_cached':
+            state.cached = [str(node_id) for node_id in data.get('nodes', [])]
+        elif kind == 'executed' and data.get('node') in state.save_nodes:
+            state.outputs[data['node']] = (data.get('output') or {}).get('images', [])
+            images = state.images()
+            if images:
+                return prompt_id, images
+        elif kind == 'execution_error':
+            raise RuntimeError(f"prompt {prompt_id} failed in node {data.get('node_id')}: "
+                               f"{data.get('exception_message', '').strip()}")
+        elif kind == 'execution_interrupted':
+            raise RuntimeError(f"prompt {prompt_id} interrupted in node {data.get('node_id')}")
+        elif (kind == 'executing' and data.get('node') is None) or kind == 'execution_success':
+            # Finished without executed events for every output (e.g. cached): ask /history now
+            state.polling = True
+            state.next_check = time.monotonic()
+        return None
+
+    def _poll(self, prompt_id, state):
+        """Check /history for one prompt, backing off when it is not done yet."""
+        entry = self.get_history(prompt_id).get(prompt_id)
+        images = self._entry_images(prompt_id, entry, state.save_nodes)
+        if entry and state.cached is None:
+            state.cached = self.cached_nodes(entry)
+        if images is None:
+            state.delay = min(state.delay * 2, self.max_poll_interval)
+            state.next_check = time.monotonic() + state.delay
+        return images
+
+    def run(self, jobs):
+        """
+        Run (key, workflow) jobs, yielding a ComfyUIResult per job as it
+        finishes and its images are downloaded.
+        """
+        jobs = iter(jobs)
+        inbox = queue.Queue()   # websocket events, None when the socket closes, finished downloads
+        events = self.connect_events(inbox)
+        self.event_stream = events is not None
+        in_flight = {}          # prompt_id -> _InFlight
+        downloads = {}          # future -> (key, prompt_id, queued at)
+        exhausted = False
+
+        def finish(prompt_id, images):
+            state = in_flight.pop(prompt_id)
+            future = pool.submit(self.download, images)
+            downloads[future] = (prompt_id, state)
+            future.add_done_callback(inbox.put)
+
+        def result(prompt_id, state, images=None, error=None):
+            return ComfyUIResult(state.key, prompt_id, images, error, time.monotonic() - state.queued,
+                                 state.nodes, state.cached)
+
+        def failed(prompt_id, error):
+            return result(prompt_id, in_flight.pop(prompt_id), error=error)
+
+        pool = ThreadPoolExecutor(max_workers=self.download_workers)
+        try:
+            while True:
+                while not exhausted and len(in_flight) < self.max_in_flight:
+                    try:
+                        key, workflow = next(jobs)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    try:
+                        in_flight[self.queue_prompt(workflow)] = _InFlight(key, workflow, self.poll_interval,
+                                                                          self.timeout)
+                    except (OSError, ValueError, http.client.HTTPException) as e:
+                        yield ComfyUIResult(key, error=e)
+                if not in_flight and not downloads:
+                    return
+
+                now = time.monotonic()
+                listening = events is not None and not events.closed
+                for position, (prompt_id, state) in enumerate(list(in_flight.items())):
+                    if state.started is None and position == 0 and not listening:
+                        # Without events, the oldest prompt is taken to start once those ahead of it are done
+                        state.running = True
+                        state.started = now
+                    if state.started is not None and now - state.started > state.timeout:
+                        self.cancel(prompt_id, state.running)
+                        yield failed(prompt_id, TimeoutError(f"still running after {state.timeout:g}s"))
+                    elif (state.polling or not listening) and state.next_check <= now:
+                        try:
+                            images = self._poll(prompt_id, state)
+                        except (OSError, ValueError, http.client.HTTPException, RuntimeError) as e:
+                            yield failed(prompt_id, e)
+                            continue
+                        if images:
+                            finish(prompt_id, images)
+
+                checks = [s.next_check for s in in_flight.values() if s.polling or not listening]
+                wait_s = min(checks, default=now + 1.0) - time.monotonic()
+                try:
+                    items = [inbox.get(timeout=max(0.0, min(wait_s, 1.0)))]
+                except queue.Empty:
+                    continue
+                while not inbox.empty():
+                    items.append(inbox.get_nowait())
+
+                for item in items:
+                    if item is None:
+                        if in_flight:
+                            print("  [WARN] Websocket closed, polling /history")
+                        for state in in_flight.values():
+                            state.next_check = time.monotonic()
+                    elif isinstance(item, dict):
+                        try:
+                            done = self._on_event(item, in_flight)
+                        except RuntimeError as e:
+                            yield failed(item['data']['prompt_id'], e)
+                            continue
+                        if done:
+                            finish(*done)
+                    else:
+                        prompt_id, state = downloads.pop(item)
+                        try:
+                            yield result(prompt_id, state, item.result())
+                        except (OSError, ValueError, http.client.HTTPException) as e:
+                            yield result(prompt_id, state, error=e)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+            if events is not None:
+                events.close()
+
+
+def discard_downloads(images):
+    """Delete the staged files among downloaded images (bytes are left alone)."""
+    for img in images or ():
+        if isinstance(img, Path):
+            img.unlink(missing_ok=True)
+
+
+def check_comfyui_running(base_url=COMFYUI_URL):
+    """Check if ComfyUI is running on base_url"""
+    return ComfyUIClient(base_url).is_running()
+
+
+# ================= GENERATION =================
+
+def asset_seed(asset_name: str) -> int:
+    return stable_seed(asset_name, SEED)
+
+
+def asset_cache_key(asset_config: dict, seed: int, batch_index: int = 0) -> str:
+    """
+    cache_key over the prompt, size, seed and batch index (ComfyUI draws
+    the noise for a latent by its index in the batch), the workflow's
+    sampler settings and model file names (the files live on the ComfyUI
+    side, so names stand in for a header hash) and the output encoding.
+    """
+    workflow = workflow_template()
+    sampler = workflow["6"]["inputs"]
+    return cache_key(
+        backend="comfyui", prompt=asset_config["prompt"], negative=asset_config.get("negative", ""),
+        width=asset_config["width"], height=asset_config["height"], seed=seed, batch_index=batch_index,
+        steps=sampler["steps"],
+        cfg=sampler["cfg"], sampler=[sampler["sampler_name"], sampler["scheduler"]],
+        model=[workflow["1"]["inputs"]["unet_name"], workflow["1"]["inputs"]["weight_dtype"],
+               workflow["2"]["inputs"]["clip_name"], workflow["3"]["inputs"]["vae_name"]],
+        encoding=ENCODING,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def workflow_template():
+    """
+    get_workflow_template(), built once. Shared and read-only: the
+    build_* functions put new dicts in place of the nodes they change and
+    reuse the untouched ones, so the loaders are identical in every
+    submitted workflow.
+    """
+    return get_workflow_template()
+
+
+def _with_inputs(node, **inputs):
+    return {**node, "inputs": {**node["inputs"], **inputs}}
+
+
+def build_asset_workflow(asset_name: str, asset_config: dict, seed: Optional[int] = None) -> dict:
+    """The workflow template filled in with one asset's size, prompt and seed"""
+    workflow = dict(workflow_template())
+    workflow["5"] = _with_inputs(workflow["5"], width=asset_config["width"], height=asset_config["height"])
+    workflow["4"] = _with_inputs(workflow["4"], text=asset_config["prompt"])
+    workflow["6"] = _with_inputs(workflow["6"], seed=asset_seed(asset_name) if seed is None else seed)
+    return workflow
+
+
+def _assets_by_size():
+    by_size = {}
+    for name, config in ASSETS.items():
+        by_size.setdefault((config["width"], config["height"]), []).append(name)
+    return by_size
+
+
+def workflow_groups(names=None, max_group_size=MAX_GROUP_SIZE):
+    """
+    Same-size assets in chunks of max_group_size, as lists of (name,
+    batch index). The chunks are cut from all of ASSETS and then narrowed
+    to names, so an asset keeps its batch index (and with it its noise)
+    whichever other assets are pending. Groups of one size are
+    consecutive, so back-to-back prompts reuse ComfyUI's cached latent
+    node (see build_group_workflow).
+    """
+    groups = []
+    for members in _assets_by_size().values():
+        for start in range(0, len(members), max_group_size):
+            chunk = [(name, index) for index, name in enumerate(members[start:start + max_group_size])
+                     if names is None or name in names]
+            if chunk:
+                groups.append(chunk)
+    return groups
+
+
+def build_group_workflow(group: list, max_group_size=MAX_GROUP_SIZE) -> dict:
+    """
+    One workflow for a workflow_groups() entry.
+
+    The loaders and an EmptySD3LatentImage are shared. ComfyUI caches a
+    node's output while its id and inputs stay the same, so node ids are
+    fixed, the loader nodes are the template's own, and the latent always
+    holds a full group (min(max_group_size, assets of that size)) rather
+    than just the pending ones: every prompt after the first reuses the
+    loaders, and every prompt after the first of its size reuses the
+    latent. Each asset gets its own LatentFromBatch,
+    CLIPTextEncode, KSampler, VAEDecode and SaveImage (filename_prefix =
+    asset name), with node ids 10 * (batch index + 1) + 0..4 and the asset
+    name as _meta title. Core ComfyUI has no node that batches different
+    conditionings per latent, so each asset is sampled by its own
+    KSampler; the graph still saves a prompt round trip per asset and
+    runs the loaders once.
+    """
+    template = workflow_template()
+    size = ASSETS[group[0][0]]["width"], ASSETS[group[0][0]]["height"]
+    capacity = min(max_group_size, len(_assets_by_size()[size]))
+    workflow = {node_id: template[node_id] for node_id in ("1", "2", "3")}
+    workflow["5"] = _with_inputs(template["5"], width=size[0], height=size[1], batch_size=capacity)
+    for name, index in group:
+        latent, encode, sampler, decode, save = (str(10 * (index + 1) + k) for k in range(5))
+        meta = {"title": name}
+        workflow[latent] = {"class_type": "LatentFromBatch", "_meta": meta,
+                            "inputs": {"samples": ["5", 0], "batch_index": index, "length": 1}}
+        workflow[encode] = {"class_type": "CLIPTextEncode", "_meta": meta,
+                            "inputs": {**template["4"]["inputs"], "text": ASSETS[name]["prompt"]}}
+        workflow[sampler] = {"class_type": "KSampler", "_meta": meta,
+                             "inputs": {**template["6"]["inputs"], "latent_image": [latent, 0],
+                                        "positive": [encode, 0], "negative": [encode, 0],
+                                        "seed": asset_seed(name)}}
+        workflow[decode] = {"class_type": "VAEDecode", "_meta": meta,
+                            "inputs": {"samples": [sampler, 0], "vae": ["3", 0]}}
+        workflow[save] = {"class_type": "SaveImage", "_meta": meta,
+                          "inputs": {"filename_prefix": name, "images": [decode, 0]}}
+    return workflow
+
+
+def generate_asset_comfyui(asset_name: str, asset_config: dict, seed: Optional[int] = None,
+                           writer: Optional[ImageWriter] = None, client: Optional[ComfyUIClient] = None,
+                           base_url=COMFYUI_URL) -> bool:
+    """
+    Generate a single asset using ComfyUI API, waiting for it to finish.
+
+    The PNG is streamed to a staged file in OUTPUT_DIR. With a writer it
+    is handed to its background pool and this returns as soon as the
+    download finishes; otherwise it is renamed or re-encoded into place
+    (see ENCODING) before returning. A client made here is closed before
+    returning. generate_all() runs many assets pipelined instead.
+    """
+    print(f"\nGenerating: {asset_name}")
+    print(f"  Size: {asset_config['width']}x{asset_config['height']}")
+
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    owned = client is None
+    client = client or ComfyUIClient(base_url, on_progress=print_progress, download_dir=OUTPUT_DIR)
+    try:
+        # Closing run() also closes its websocket listener
+        job = (asset_name, build_asset_workflow(asset_name, asset_config, seed))
+        with contextlib.closing(client.run([job])) as run:
+            result = next(run)
+        if not result.ok:
+            print(f"  [ERROR] {result.error or 'no images'}")
+            return False
+
+        discard_downloads(result.images[1:])
+        img_data = result.images[0]
+        output_path = OUTPUT_DIR / asset_config["filename"]
+        if writer is not None:
+            writer.submit(output_path, img_data)
+        else:
+            encode_and_write(output_path, img_data, **ENCODING)
+        print(f"  -> {asset_config['filename']}")
+        return True
+
     except Exception as e:
         print(f"  [ERROR] {e}")
         return False
+    finally:
+        if owned:
+            client.close()
+
+
+def print_node_cache_report(results):
+    """Print how many workflow nodes ComfyUI reused from its cache, from the execution_cached metadata."""
+    known = [r for r in results if r.cached is not None]
+    if not known:
+        print("Node cache: not reported by the server")
+        return
+    cached = sum(len(r.cached) for r in known)
+    total = sum(len(r.nodes) for r in known)
+    loaders = sum({"1", "2", "3"} <= set(r.cached) for r in known)
+    latent = sum("5" in r.cached for r in known)
+    print(f"Node cache: {cached}/{total} nodes reused over {len(known)} prompts "
+          f"(loaders in {loaders}, latent in {latent})")
 
 
-def generate_all():
-    """Generate all assets"""
+def print_progress(key, step, steps):
+    """ComfyUIClient on_progress callback: one live sampler step line per asset."""
+    print(f"\r  {key}: step {step}/{steps}", end="\n" if step >= steps else "", flush=True)
+
+
+def generate_all(force=False, base_url=COMFYUI_URL, max_in_flight=MAX_IN_FLIGHT, poll_interval=POLL_INTERVAL,
+                 websocket=USE_WEBSOCKET, max_group_size=MAX_GROUP_SIZE):
+    """
+    Generate all assets, skipping those the generation cache has unless force is set.
+
+    Pending assets are submitted as same-size groups of up to
+    max_group_size (see build_group_workflow). Up to max_in_flight
+    prompts stay queued on the server, and finished images are split back
+    out to their files, downloaded and written while the next ones
+    generate.
+    """
     print("=" * 60)
     print("DailyWell Asset Generator - ComfyUI API")
     print("=" * 60)
 
+    client = ComfyUIClient(base_url, max_in_flight=max_in_flight, poll_interval=poll_interval, websocket=websocket,
+                           on_progress=print_progress, download_dir=OUTPUT_DIR)
+
     # Check if ComfyUI is running
-    if not check_comfyui_running():
-        print("\n[ERROR] ComfyUI is not running!")
-        print("Please start ComfyUI first (localhost:8188)")
+    if not client.is_running():
+        print(f"\n[ERROR] ComfyUI is not running at {base_url}!")
+        print("Please start ComfyUI first")
         print("\nSteps:")
         print("1. Open ComfyUI")
         print("2. Load your Qwen-Image workflow")
         print("3. Run this script again")
-        return
+        return False
 
-    print("\nComfyUI connected!")
+    print(f"\nComfyUI connected at {base_url}")
 
     # Ensure output directory exists
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-    success_count = 0
     total = len(ASSETS)
 
-    for asset_name, asset_config in ASSETS.items():
-        if generate_asset_comfyui(asset_name, asset_config):
-            success_count += 1
+    cache = GenerationCache(CACHE_DIR, max_bytes=int(CACHE_MAX_GB * 1024**3))
+    batch_index = {name: index for group in workflow_groups(max_group_size=max_group_size) for name, index in group}
+    keys = {name: asset_cache_key(config, asset_seed(name), batch_index[name]) for name, config in ASSETS.items()}
+    pending = {name: config for name, config in ASSETS.items()
+               if force or not cache.fetch(keys[name], OUTPUT_DIR / config["filename"])}
+    cache.save()
+    print(f"Cache: {cache.summary()}{' (--force)' if force else ''}")
+    if not pending:
+        print(f"\nAll {total} assets up to date")
+        return True
+    groups = workflow_groups(pending, max_group_size)
+    print(f"Pipelining {len(pending)} assets as {len(groups)} prompts, {client.max_in_flight} in flight")
+
+    # ComfyUI returns PNGs, streamed to staged files in OUTPUT_DIR; the writer renames them into
+    # place, or re-encodes them when other formats come out smaller
+    start = time.perf_counter()
+    writer = ImageWriter(workers=2, **ENCODING)
+    jobs = (([name for name, _ in group], build_group_workflow(group, max_group_size)) for group in groups)
+    outcomes = []
+    for result in client.run(jobs):
+        outcomes.append(result)
+        if not result.ok or len(result.images) != len(result.key):
+            print(f"  [ERROR] {', '.join(result.key)}: {result.error or f'{len(result.images)} images'}")
+            discard_downloads(result.images)
+            continue
+        for name, img_data in zip(result.key, result.images):
+            filename = ASSETS[name]["filename"]
+            writer.submit(OUTPUT_DIR / filename, img_data)
+            print(f"  -> {filename} ({result.elapsed_s:.1f}s after queueing)")
+    wall = time.perf_counter() - start
+    print(f"Completion via {'websocket events' if client.event_stream else 'polling'}, "
+          f"{client.history_checks} /history checks")
+    print(f"HTTP: {client.http.summary()}")
+    print_node_cache_report(outcomes)
+    client.close()
+
+    results = writer.close()
+    print_write_report(results, writer.submit_wait_s)
+    names_by_path = {OUTPUT_DIR / config["filename"]: name for name, config in pending.items()}
+    for r in results:
+        if r.ok:
+            cache.store(keys[names_by_path[r.path]], r.output, name=names_by_path[r.path])
+    cache.save()
+    write_size_report([(r.output, r.encoded) for r in results if r.ok], SIZE_REPORT_PATH)
+    success_count = total - len(pending) + sum(r.ok for r in results)
 
     print("\n" + "=" * 60)
-    print(f"Done: {success_count}/{total} assets generated")
+    print(f"Done: {success_count}/{total} assets generated in {wall:.1f}s")
     print(f"Output: {OUTPUT_DIR}")
     print("=" * 60)
+    return success_count == total
 
 
 def print_workflow_instructions():
@@ -428,23 +1183,347 @@ Before running this script, you need to set up ComfyUI:
 """)
 
 
+# ================= SELF TEST =================
+
+def check_pipelined_client():
+    """Pipelined client keeps max_in_flight prompts queued and beats one-at-a-time submission."""
+    from PIL import Image
+    from comfyui_stub import StubComfyUI
+
+    names = list(ASSETS)[:6]
+    timings = {}
+    for in_flight in (1, 3):
+        with StubComfyUI(step_time=0.002) as stub:
+            client = ComfyUIClient(stub.url, max_in_flight=in_flight, poll_interval=0.05, websocket=False)
+            start = time.perf_counter()
+            results = list(client.run((n, build_asset_workflow(n, ASSETS[n])) for n in names))
+            timings[in_flight] = time.perf_counter() - start
+            pending = stub.max_pending
+    sizes = {r.key: Image.open(io.BytesIO(r.images[0])).size for r in results if r.ok}
+    print(f"    {len(names)} prompts: {timings[1]:.2f}s one at a time, {timings[3]:.2f}s with 3 in flight "
+          f"(server saw {pending} pending)")
+    return (sizes == {n: (ASSETS[n]["width"], ASSETS[n]["height"]) for n in names}
+            and pending == 3 and timings[3] < timings[1])
+
+
+def check_websocket_events():
+    """Websocket events finish prompts without /history polling; backoff polling covers a server without /ws."""
+    from comfyui_stub import StubComfyUI
+
+    names = list(ASSETS)[:4]
+    runs = {}
+    for websocket in (True, False):
+        progress = []
+        with StubComfyUI(step_time=0.005, websocket=websocket) as stub:
+            client = ComfyUIClient(stub.url, max_in_flight=2, poll_interval=0.02, max_poll_interval=0.5,
+                                   on_progress=lambda key, step, steps: progress.append((key, step, steps)))
+            results = list(client.run((n, build_asset_workflow(n, ASSETS[n])) for n in names))
+            latency = sum(r.elapsed_s for r in results) / len(results)
+            runs[websocket] = (all(r.ok for r in results), client.history_checks, latency, len(progress))
+            steps = get_workflow_template()["6"]["inputs"]["steps"]
+    for websocket, (ok, checks, latency, events) in runs.items():
+        print(f"    {'websocket' if websocket else 'polling  '}: {checks:3d} /history checks, "
+              f"{latency * 1000:6.1f}ms mean queue-to-download, {events} progress events")
+    return (runs[True][0] and runs[False][0] and runs[True][1] == 0 and runs[True][3] == len(names) * steps
+            and runs[False][1] > 0 and runs[False][3] == 0)
+
+
+def check_prompt_timeout():
+    """The prompt timeout ignores time queued behind other prompts; a stalled prompt is interrupted, not waited on."""
+    from comfyui_stub import StubComfyUI
+
+    names = list(ASSETS)[:4]
+    jobs = [(n, build_asset_workflow(n, ASSETS[n])) for n in names]
+    queued = {}
+    for websocket in (True, False):
+        # Each prompt runs ~0.14s, under the timeout, but the last waits ~0.4s behind the others
+        with StubComfyUI(step_time=0.005, websocket=websocket) as stub:
+            client = ComfyUIClient(stub.url, max_in_flight=4, poll_interval=0.02, max_poll_interval=0.05,
+                                   timeout=0.3)
+            results = list(client.run(jobs))
+            queued[websocket] = (all(r.ok for r in results), max(r.elapsed_s for r in results))
+            client.close()
+
+    with StubComfyUI(step_time=0.002) as stub:
+        stub.hang_next = 1
+        client = ComfyUIClient(stub.url, max_in_flight=3, poll_interval=0.02, timeout=0.3)
+        results = {r.key: r for r in client.run(jobs[:3])}
+        stalled = isinstance(results[names[0]].error, TimeoutError)
+        others = all(results[n].ok for n in names[1:3])
+        interrupted = stub.interrupted
+        # A prompt that has not started is deleted from the queue instead
+        stub.hang_next = 1
+        running, waiting = client.queue_prompt(jobs[0][1]), client.queue_prompt(jobs[1][1])
+        client.cancel(waiting)
+        client.cancel(running, running=True)
+        client.close()
+        cancelled = stub.deleted == 1 and stub.interrupted == 2
+    for websocket, (ok, longest) in queued.items():
+        print(f"    {'websocket' if websocket else 'polling  '}: all ok {ok}, longest {longest:.2f}s from queueing")
+    print(f"    stalled prompt: {results[names[0]].error}; {interrupted} interrupted, {stub.deleted} deleted")
+    return (all(ok and longest > 0.3 for ok, longest in queued.values()) and stalled and others
+            and interrupted == 1 and cancelled)
+
+
+def check_group_timeout():
+    """A grouped prompt gets the timeout once per asset, so a slow full group is not cut off."""
+    from comfyui_stub import StubComfyUI
+
+    group = next(g for g in workflow_groups() if len(g) == MAX_GROUP_SIZE)
+    keys = [name for name, _ in group]
+    # ~0.14s per asset on the stub, so the group runs ~0.56s against a 0.3s per-asset timeout
+    with StubComfyUI(step_time=0.005) as stub:
+        client = ComfyUIClient(stub.url, poll_interval=0.02, timeout=0.3)
+        result = next(client.run([(keys, build_group_workflow(group))]))
+        client.close()
+    print(f"    group of {len(keys)}: ok {result.ok}, {result.elapsed_s:.2f}s, error {result.error}")
+    return result.ok and len(result.images) == len(keys) and result.elapsed_s > 0.3
+
+
+def check_single_asset_cleanup():
+    """generate_asset_comfyui closes the client it creates: no sockets or listener threads outlive the call."""
+    from comfyui_stub import StubComfyUI
+
+    global OUTPUT_DIR, ComfyUIClient
+    saved = OUTPUT_DIR, ComfyUIClient
+    closed = []
+
+    class TrackedClient(ComfyUIClient):
+        def close(self):
+            super().close()
+            closed.append(not self.http._idle)
+
+    name = "habit_rest"
+    with tempfile.TemporaryDirectory() as tmp, StubComfyUI(step_time=0.0005) as stub:
+        OUTPUT_DIR, ComfyUIClient = Path(tmp), TrackedClient
+        try:
+            baseline = threading.active_count()
+            ok = all(generate_asset_comfyui(name, ASSETS[name], base_url=stub.url) for _ in range(3))
+            # Server handler threads end once the client has closed their connections
+            deadline = time.monotonic() + 2.0
+            while threading.active_count() > baseline and time.monotonic() < deadline:
+                time.sleep(0.02)
+            left = threading.active_count() - baseline
+            written = sorted(p.name for p in OUTPUT_DIR.iterdir())
+        finally:
+            OUTPUT_DIR, ComfyUIClient = saved
+    print(f"    {len(closed)} of 3 clients closed, {left} threads left, files {written}")
+    return ok and closed == [True] * 3 and left == 0 and len(written) == 1
+
+
+def check_connection_pool():
+    """API calls reuse keep-alive connections and retry dropped connections and 503s."""
+    from comfyui_stub import StubComfyUI
+
+    names = list(ASSETS)[:6]
+    with StubComfyUI(step_time=0.002) as stub:
+        client = ComfyUIClient(stub.url, max_in_flight=3, poll_interval=0.01, websocket=False)
+        client.http.backoff = 0.01
+        results = list(client.run((n, build_asset_workflow(n, ASSETS[n])) for n in names))
+        opened = client.http.connections_opened
+        stub.drop_next, stub.fail_next = 1, 2
+        retried = client.is_running() and client.http.retried == 3
+        # A POST is resent after a hang-up on a reused connection (it never ran) but not after a 503
+        workflow = build_asset_workflow(names[0], ASSETS[names[0]])
+        stub.drop_next = 1
+        resent = bool(client.queue_prompt(workflow)) and stub.requests["/prompt"] == len(names) + 2
+        stub.fail_next = 1
+        try:
+            client.queue_prompt(workflow)
+            not_resent = False
+        except urllib.error.HTTPError as e:
+            not_resent = e.code == 503 and stub.requests["/prompt"] == len(names) + 3
+        client.close()
+    print(f"    {client.http.summary()}; server accepted {stub.connections} connections")
+    return (all(r.ok for r in results) and opened <= 1 + client.download_workers
+            and client.http.requests > 3 * opened and retried and resent and not_resent)
+
+
+def check_streamed_download():
+    """Images stream to staged files with encoded /view queries, and truncated bodies are retried."""
+    from comfyui_stub import StubComfyUI, solid_png
+
+    filename = "habit rest & sleep=\u263e #1.png"
+    data = solid_png(300, 200, b"\x20\x40\x60")
+    with tempfile.TemporaryDirectory() as tmp, StubComfyUI() as stub:
+        tmp = Path(tmp)
+        stub.images[filename] = data
+        client = ComfyUIClient(stub.url, download_dir=tmp)
+        client.http.backoff = 0.01
+        staged = client.get_image(filename, "", "output")
+        fetched = staged.parent == tmp and staged.read_bytes() == data
+        stub.truncate_next = 1
+        again = client.get_image(filename, "", "output")
+        retried = again.read_bytes() == data and client.http.retried == 1
+        discard_downloads([again])
+        stub.truncate_next = client.http.retries + 1
+        try:
+            client.get_image(filename, "", "output")
+            detected = False
+        except http.client.IncompleteRead:
+            detected = True
+        client.close()
+        encode_and_write(tmp / "habit_rest.png", staged, formats=("png",))
+        files = sorted(p.name for p in tmp.iterdir())
+        placed = (tmp / "habit_rest.png").read_bytes() == data
+    print(f"    {len(data)} bytes in {DOWNLOAD_CHUNK // 1024} KB reads; files left: {files}")
+    return fetched and retried and detected and placed and files == ["habit_rest.png"]
+
+
+def check_group_workflow():
+    """Grouped workflow JSON shares the loaders and latent and gives each asset its own sampling chain."""
+    group = [("habit_hydrate", 1), ("habit_nourish", 3)]
+    workflow = json.loads(json.dumps(build_group_workflow(group)))
+    template = get_workflow_template()
+
+    def chain(name, index, base):
+        meta = {"title": name}
+        sampler = {**template["6"]["inputs"], "latent_image": [str(base), 0], "positive": [str(base + 1), 0],
+                   "negative": [str(base + 1), 0], "seed": asset_seed(name)}
+        return {
+            str(base): {"class_type": "LatentFromBatch", "_meta": meta,
+                        "inputs": {"samples": ["5", 0], "batch_index": index, "length": 1}},
+            str(base + 1): {"class_type": "CLIPTextEncode", "_meta": meta,
+                            "inputs": {"clip": ["2", 0], "text": ASSETS[name]["prompt"]}},
+            str(base + 2): {"class_type": "KSampler", "_meta": meta, "inputs": sampler},
+            str(base + 3): {"class_type": "VAEDecode", "_meta": meta,
+                            "inputs": {"samples": [str(base + 2), 0], "vae": ["3", 0]}},
+            str(base + 4): {"class_type": "SaveImage", "_meta": meta,
+                            "inputs": {"filename_prefix": name, "images": [str(base + 3), 0]}},
+        }
+
+    expected = {
+        "1": template["1"], "2": template["2"], "3": template["3"],
+        "5": {"class_type": "EmptySD3LatentImage", "inputs": {"batch_size": 4, "height": 256, "width": 256}},
+        **chain("habit_hydrate", 1, 20), **chain("habit_nourish", 3, 40),
+    }
+    groups = workflow_groups()
+    pending = workflow_groups({"habit_hydrate", "habit_nourish", "bg_profile"})
+    print(f"    {len(workflow)} nodes; {len(ASSETS)} assets in {len(groups)} groups of up to {MAX_GROUP_SIZE}; "
+          f"pending subset -> {pending}")
+    return (workflow == expected and list(workflow) == list(expected)
+            and sorted(n for g in groups for n, _ in g) == sorted(ASSETS)
+            and all(len({(ASSETS[n]["width"], ASSETS[n]["height"]) for n, _ in g}) == 1 for g in groups)
+            and pending == [[("habit_hydrate", 1), ("habit_nourish", 3)], [("bg_profile", 3)]])
+
+
+def check_node_cache():
+    """Consecutive grouped prompts reuse the loaders and same-size latents, per execution_cached in events or history."""
+    from comfyui_stub import StubComfyUI
+
+    groups = workflow_groups()
+    runs = {}
+    for websocket in (True, False):
+        with StubComfyUI(step_time=0.0005, websocket=websocket) as stub:
+            client = ComfyUIClient(stub.url, max_in_flight=2, poll_interval=0.01, websocket=websocket)
+            results = list(client.run(([n for n, _ in g], build_group_workflow(g)) for g in groups))
+            client.close()
+        runs[websocket] = [set(r.cached or ()) for r in results], results
+    print(f"    {len(groups)} prompts; cached per prompt: {[sorted(c, key=int) for c in runs[True][0]]}")
+    print_node_cache_report(runs[False][1])
+
+    expected = []
+    seen = set()
+    for g in groups:
+        size = ASSETS[g[0][0]]["width"], ASSETS[g[0][0]]["height"]
+        latents = {"5"} | {str(10 * (index + 1)) for _, index in g} if size in seen else set()
+        expected.append(set() if not expected else {"1", "2", "3"} | latents)
+        seen.add(size)
+    return all(cached == expected and all(r.ok for r in results) for cached, results in runs.values())
+
+
+def check_generate_all_stub():
+    """generate_all writes every asset through the stub server in grouped prompts, then finds them all in the cache."""
+    from comfyui_stub import StubComfyUI
+
+    global OUTPUT_DIR, CACHE_DIR, SIZE_REPORT_PATH
+    saved = OUTPUT_DIR, CACHE_DIR, SIZE_REPORT_PATH
+    with tempfile.TemporaryDirectory() as tmp, StubComfyUI(step_time=0.0005) as stub:
+        tmp = Path(tmp)
+        OUTPUT_DIR, CACHE_DIR, SIZE_REPORT_PATH = tmp / "drawable", tmp / "cache", tmp / "report.json"
+        try:
+            first = generate_all(base_url=stub.url, poll_interval=0.02)
+            queued = stub.executed
+            second = generate_all(base_url=stub.url, poll_interval=0.02)
+            written = len(list(OUTPUT_DIR.iterdir()))
+            # Each file must hold its own asset's image: the stub colours every SaveImage output differently
+            distinct = len({p.read_bytes() for p in OUTPUT_DIR.iterdir()})
+        finally:
+            OUTPUT_DIR, CACHE_DIR, SIZE_REPORT_PATH = saved
+    print(f"    {queued} prompts run, {written} files written ({distinct} distinct), "
+          f"{stub.executed - queued} prompts on the cached rerun")
+    return (first and second and queued == len(workflow_groups()) and written == distinct == len(ASSETS)
+            and stub.executed == queued)
+
+
+SELF_CHECKS = [
+    check_pipelined_client,
+    check_websocket_events,
+    check_prompt_timeout,
+    check_group_timeout,
+    check_single_asset_cleanup,
+    check_connection_pool,
+    check_streamed_download,
+    check_group_workflow,
+    check_node_cache,
+    check_generate_all_stub,
+]
+
+
+def run_selftests():
+    """Run the client checks against the local stub server (comfyui_stub.py)."""
+    print("\n" + "=" * 60)
+    print("DailyWell Asset Generator - ComfyUI Client Self Test")
+    print("=" * 60)
+
+    passed = 0
+    for check in SELF_CHECKS:
+        try:
+            ok = check()
+        except Exception as e:
+            print(f"    [ERROR] {e}")
+            import traceback
+            traceback.print_exc()
+            ok = False
+        print(f"  [{'PASS' if ok else 'FAIL'}] {check.__name__}: {check.__doc__}")
+        passed += ok
+
+    print(f"\nDone: {passed}/{len(SELF_CHECKS)} checks passed")
+    return passed == len(SELF_CHECKS)
+
+
+def _option(args, flag, default, cast=str):
+    """Value following flag in args, or default."""
+    if flag in args and args.index(flag) + 1 < len(args):
+        return cast(args[args.index(flag) + 1])
+    return default
+
+
 if __name__ == "__main__":
     import sys
 
-    if len(sys.argv) > 1:
+    url = _option(sys.argv, "--url", COMFYUI_URL)
+    in_flight = _option(sys.argv, "--in-flight", MAX_IN_FLIGHT, int)
+    group_size = _option(sys.argv, "--group", MAX_GROUP_SIZE, int)
+    if len(sys.argv) > 1 and not sys.argv[1].startswith("--"):
         cmd = sys.argv[1].lower()
         if cmd == "help":
             print_workflow_instructions()
         elif cmd == "check":
-            if check_comfyui_running():
+            if check_comfyui_running(url):
                 print("ComfyUI is running!")
             else:
                 print("ComfyUI is NOT running. Start it first.")
         elif cmd == "generate":
-            generate_all()
+            generate_all(force="--force" in sys.argv, base_url=url, max_in_flight=in_flight,
+                         websocket="--no-websocket" not in sys.argv, max_group_size=group_size)
+        elif cmd == "selftest":
+            sys.exit(0 if run_selftests() else 1)
         else:
             print(f"Unknown command: {cmd}")
-            print("Usage: python generate_assets_comfyui.py [help|check|generate]")
+            print("Usage: python generate_assets_comfyui.py [help|check|generate [--force]|selftest] "
+                  "[--url URL] [--in-flight N] [--group N] [--no-websocket]")
     else:
         # Default: try to generate
-        generate_all()
+        generate_all(base_url=url, max_in_flight=in_flight, websocket="--no-websocket" not in sys.argv,
+                     max_group_size=group_size)
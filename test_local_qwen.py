@@ -6,6 +6,18 @@ No downloads - uses D:\Models\qwen_image_fp8 files only.
 import torch
 from pathlib import Path
 
+from asset_pipeline import read_safetensors_header
+
+
+def describe(f):
+    """Size plus tensor count from the header for safetensors files."""
+    size_mb = f.stat().st_size / (1024*1024)
+    if f.suffix != ".safetensors":
+        return f"{size_mb:.1f} MB"
+    tensors, _ = read_safetensors_header(f)
+    return f"{size_mb:.1f} MB, {len(tensors)} tensors"
+
+
 # Local model files
 MODEL_DIR = Path(r"D:\Models\qwen_image_fp8")
 TEXT_ENCODER_DIR = Path(r"D:\Models\text-encoders\split_files\text_encoders")
@@ -17,13 +29,11 @@ print("=" * 60)
 # List available files
 print("\nLocal model files:")
 for f in MODEL_DIR.iterdir():
-    size_mb = f.stat().st_size / (1024*1024)
-    print(f"  {f.name}: {size_mb:.1f} MB")
+    print(f"  {f.name}: {describe(f)}")
 
 print(f"\nText encoder files:")
 for f in TEXT_ENCODER_DIR.iterdir():
-    size_mb = f.stat().st_size / (1024*1024)
-    print(f"  {f.name}: {size_mb:.1f} MB")
+    print(f"  {f.name}: {describe(f)}")
 
 # Try loading transformer
 print("\n" + "=" * 60)
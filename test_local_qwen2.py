@@ -1,34 +1,29 @@
 """
 Test loading local Qwen-Image FP8 - attempt 2 with config specification.
+
+Reads only the safetensors header, so listing keys no longer loads the
+19GB state dict into RAM.
 """
 
-import torch
 from pathlib import Path
-from safetensors.torch import load_file
+
+from asset_pipeline import summarize_safetensors, print_safetensors_summary
 
 MODEL_DIR = Path(r"D:\Models\qwen_image_fp8")
 
-print("Testing direct safetensors loading...")
+print("Testing safetensors header inspection...")
 
 # Check file structure
 transformer_path = MODEL_DIR / "qwen_image_2512_fp8_e4m3fn.safetensors"
-print(f"\nLoading weights from: {transformer_path}")
-print("This may take a moment for 19GB file...")
-
-# Load with safetensors
-state_dict = load_file(str(transformer_path))
+print(f"\nReading header from: {transformer_path}")
 
-print(f"\nLoaded {len(state_dict)} tensors")
-print("\nFirst 20 key names:")
-for i, key in enumerate(list(state_dict.keys())[:20]):
-    shape = state_dict[key].shape
-    dtype = state_dict[key].dtype
-    print(f"  {key}: {shape} ({dtype})")
+summary = summarize_safetensors(transformer_path, strip_prefix="model.diffusion_model.")
+print_safetensors_summary(summary, show_keys=20)
 
 print("\n...checking for model structure clues...")
 # Look for patterns
 prefixes = set()
-for key in state_dict.keys():
+for key in summary["tensors"].keys():
     parts = key.split('.')
     if len(parts) > 1:
         prefixes.add(parts[0])